@@ -70,8 +70,25 @@ zip -j $build_dist_dir/PrepareRevisionMapInputFunction.zip $source_dir/PrepareRe
 zip -j $build_dist_dir/CreateRevisionAndPrepareJobMapInputFunction.zip $source_dir/CreateRevisionAndPrepareJobMapInputFunction/*
 zip -j $build_dist_dir/CreateAndStartImportJobFunction.zip $source_dir/CreateAndStartImportJobFunction/*
 zip -j $build_dist_dir/CheckJobStatusFunction.zip $source_dir/CheckJobStatusFunction/*
+zip -j $build_dist_dir/JobCompletionCallbackFunction.zip $source_dir/JobCompletionCallbackFunction/*
 zip -j $build_dist_dir/FinalizeAndUpdateCatalogFunction.zip $source_dir/FinalizeAndUpdateCatalogFunction/*
 
+echo "------------------------------------------------------------------------------"
+echo "package the shared layer with its pinned dependencies"
+echo "------------------------------------------------------------------------------"
+layer_build_dir="$build_dist_dir/SharedLayer"
+mkdir -p "$layer_build_dir/python"
+cp -r "$source_dir"/SharedLayer/python/. "$layer_build_dir/python/"
+# Resolved for the functions' python3.8 runtime rather than the Python running this
+# script. pip evaluates environment markers against this interpreter, so botocore's
+# urllib3 bound for Python < 3.10 is repeated here.
+pip install -r "$source_dir/SharedLayer/python/requirements.txt" "urllib3<1.27" \
+    -t "$layer_build_dir/python" \
+    --python-version 3.8 --implementation cp --platform manylinux2014_x86_64 \
+    --only-binary=:all: --no-compile
+(cd "$layer_build_dir" && zip -r "$build_dist_dir/SharedLayer.zip" python -x "*__pycache__*")
+rm -rf "$layer_build_dir"
+
 
 echo "------------------------------------------------------------------------------"
 echo "Upload code to the $SOURCE_CODE_BUCKET/$SOLUTION_NAME/$SOLUTION_VERSION/ S3 bucket"
@@ -0,0 +1,278 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Throughput benchmark over synthetic manifests.
+
+Each run deploys a fresh ``LocalWorkflow``, writes a manifest whose prefix expands to
+the requested number of synthetic assets and publishes it, then reports wall time,
+simulated time, Lambda invocations, state transitions and S3 traffic.
+
+    python -m local_workflow.benchmark --assets 1000 100000 1000000 \\
+        --parameter JobOrchestration=PER_REVISION --parameter RevisionConcurrency=4
+
+Simulated time is wall time divided by ``--time-scale``, so it includes the harness's
+own processing scaled up by the same factor; compare runs made with the same scale.
+
+``--failing-assets`` makes the import jobs of some assets end in ERROR, and
+``--republish`` then uploads the manifest again once they would succeed, e.g. to check
+that delta publishing imports exactly the assets of the failed jobs:
+
+    python -m local_workflow.benchmark --assets 10000 --failing-assets 3 --republish \
+        --parameter DeltaPublishing=Yes
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import random
+from urllib.parse import quote_plus
+
+from local_workflow.harness import LocalWorkflow
+
+ASSET_PREFIX = "benchmark/"
+# Assets are spread over sub-prefixes so that listing fan-out has work to split
+ASSETS_PER_SUB_PREFIX = 10000
+MIN_ASSET_SIZE = 1024
+MAX_ASSET_SIZE = 64 * 1024 * 1024
+INVENTORY_BUCKET = "inventory-local"
+INVENTORY_MANIFEST_KEY = "inventory/manifest.json"
+
+
+def synthetic_asset_key(index):
+    return f"{ASSET_PREFIX}{index // ASSETS_PER_SUB_PREFIX:04d}/part-{index:07d}.csv"
+
+
+def add_synthetic_assets(s3, bucket, asset_count, seed=0):
+    """Adds ``asset_count`` body-less objects of random size under ASSET_PREFIX"""
+    rng = random.Random(seed)
+    s3.add_synthetic_objects(
+        bucket,
+        (
+            (
+                synthetic_asset_key(index),
+                int(rng.lognormvariate(13, 2)) % MAX_ASSET_SIZE + MIN_ASSET_SIZE,
+            )
+            for index in range(asset_count)
+        ),
+    )
+
+
+def failing_asset_keys(asset_count, failing_assets):
+    """Returns the keys of ``failing_assets`` assets spread evenly over the listing"""
+    if not failing_assets:
+        return set()
+    step = max(1, asset_count // failing_assets)
+    return {synthetic_asset_key(index) for index in range(0, asset_count, step)[:failing_assets]}
+
+
+def add_synthetic_inventory(s3, bucket, file_count):
+    """
+    Writes a CSV S3 Inventory report of every object in ``bucket``, split over
+    ``file_count`` gzipped data files, and returns the location of its manifest.json
+    """
+    objects = list(s3.iter_objects(bucket))
+    rows_per_file = -(-len(objects) // file_count)
+    files = []
+    for file_index in range(file_count):
+        text = io.StringIO()
+        writer = csv.writer(text, quoting=csv.QUOTE_ALL)
+        for key, size, etag in objects[file_index * rows_per_file:][:rows_per_file]:
+            writer.writerow([bucket, quote_plus(key), size, etag.strip('"')])
+        data_file_key = f"inventory/data/part-{file_index:04d}.csv.gz"
+        s3.add_object(
+            INVENTORY_BUCKET, data_file_key, gzip.compress(text.getvalue().encode("utf-8"))
+        )
+        files.append({"key": data_file_key})
+    inventory = {
+        "sourceBucket": bucket,
+        "destinationBucket": f"arn:aws:s3:::{INVENTORY_BUCKET}",
+        "version": "2016-11-30",
+        "fileFormat": "CSV",
+        "fileSchema": "Bucket, Key, Size, ETag",
+        "files": files,
+    }
+    s3.add_object(
+        INVENTORY_BUCKET, INVENTORY_MANIFEST_KEY, json.dumps(inventory).encode("utf-8")
+    )
+    return {"Bucket": INVENTORY_BUCKET, "Key": INVENTORY_MANIFEST_KEY}
+
+
+def synthetic_manifest(bucket, inventory_location=None):
+    entry = {"Bucket": bucket, "Key": ASSET_PREFIX}
+    if inventory_location:
+        entry["Inventory"] = inventory_location
+    return {
+        "product_id": "prod-local",
+        "dataset_id": "ds-local",
+        "asset_list": [entry],
+    }
+
+
+def run(
+    asset_count,
+    parameters,
+    inventory_files=0,
+    metrics_delay=0.0,
+    failing_assets=0,
+    republish=False,
+    **workflow_options,
+):
+    with LocalWorkflow(parameters=parameters, **workflow_options) as workflow:
+        workflow.http.delay = metrics_delay
+        bucket = workflow.parameters["AssetBucket"]
+        add_synthetic_assets(workflow.s3, bucket, asset_count)
+        workflow.dataexchange.failing_keys = failing_asset_keys(asset_count, failing_assets)
+        inventory_location = None
+        if inventory_files:
+            inventory_location = add_synthetic_inventory(
+                workflow.s3, bucket, inventory_files
+            )
+        manifest = synthetic_manifest(bucket, inventory_location)
+        key = f"manifests/benchmark-{asset_count}.json"
+        report = workflow.publish(manifest, key=key)
+        if republish:
+            # Reports are cumulative, so the republish is reported as the difference
+            workflow.dataexchange.failing_keys = set()
+            imported = report["AssetsImported"]
+            report = workflow.publish(manifest, key=key)
+            report["AssetsImportedOnRepublish"] = report["AssetsImported"] - imported
+    report["Assets"] = asset_count
+    return report
+
+
+def format_report(report):
+    lines = [
+        f"assets={report['Assets']} revisions={report['RevisionsFinalized']}/{report['Revisions']} "
+        f"jobs={report['ImportJobs']} imported={report['AssetsImported']}",
+        f"  wall={report['WallSeconds']:.2f}s simulated={report['SimulatedSeconds']:.0f}s "
+        f"executions={dict(report['Executions'])}",
+        f"  lambda_invocations={sum(report['LambdaInvocations'].values())} "
+        f"state_transitions={report['StateTransitions']} "
+        f"max_state_payload={report['MaxStatePayloadBytes']}B",
+        f"  s3_bytes_read={report['S3BytesRead']} s3_bytes_written={report['S3BytesWritten']}",
+    ]
+    if "AssetsImportedOnRepublish" in report:
+        lines.append(f"  imported_on_republish={report['AssetsImportedOnRepublish']}")
+    if report["MetricsRequests"]:
+        lines.append(f"  anonymous_metrics_requests={report['MetricsRequests']}")
+    for function_name, count in sorted(report["LambdaInvocations"].items()):
+        lines.append(
+            f"    {function_name}: {count} invocations, "
+            f"{report['LambdaSeconds'][function_name]:.2f}s"
+        )
+    for service, calls in report["ApiCalls"].items():
+        if calls:
+            lines.append(f"    {service}: {dict(sorted(calls.items()))}")
+    for stage, stage_metrics in sorted(report["Stages"].items()):
+        stage_seconds = stage_metrics.get("StageSeconds", {})
+        details = ", ".join(
+            f"{name} mean={summary['Mean']} max={summary['Max']}"
+            for name, summary in sorted(stage_metrics.items())
+            if name not in ("StageSeconds", "S3BytesRead")
+        )
+        lines.append(
+            f"    stage {stage}: {stage_seconds.get('Count', 0)} records, "
+            f"{stage_seconds.get('Sum', 0):.2f}s, "
+            f"{stage_metrics.get('S3BytesRead', {}).get('Sum', 0)}B read; {details}"
+        )
+    for failure in report["FailedExecutions"]:
+        lines.append(f"  FAILED {failure['name']}: {failure['error']}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--assets", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument(
+        "--parameter",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="template parameter override, may be repeated",
+    )
+    parser.add_argument("--time-scale", type=float, default=0.001)
+    parser.add_argument("--job-latency", type=float, default=30.0)
+    parser.add_argument("--per-asset-latency", type=float, default=0.1)
+    parser.add_argument("--max-concurrent-jobs", type=int, default=10)
+    parser.add_argument(
+        "--api-rate-limit",
+        type=float,
+        help="requests per simulated second ADX allows for each job API before throttling",
+    )
+    parser.add_argument(
+        "--inventory-files",
+        type=int,
+        default=0,
+        help="expand the manifest from a CSV S3 Inventory report with this many data "
+        "files instead of listing the asset prefix",
+    )
+    parser.add_argument(
+        "--anonymous-usage",
+        action="store_true",
+        help="send anonymous usage metrics, to the local HTTP stand-in",
+    )
+    parser.add_argument(
+        "--metrics-delay",
+        type=float,
+        default=0.0,
+        help="wall seconds the metrics stand-in takes to respond",
+    )
+    parser.add_argument(
+        "--failing-assets",
+        type=int,
+        default=0,
+        help="number of assets whose import jobs end in ERROR",
+    )
+    parser.add_argument(
+        "--republish",
+        action="store_true",
+        help="upload the manifest again after the first publish, with no failing assets",
+    )
+    parser.add_argument("--json", action="store_true", help="print reports as JSON lines")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format="%(levelname)s %(message)s")
+    # Failures are listed in the report; the functions' own error logs are silenced
+    parameters = {"LoggingLevel": "CRITICAL"}
+    parameters.update(parameter.split("=", 1) for parameter in args.parameter)
+    for asset_count in args.assets:
+        report = run(
+            asset_count,
+            parameters,
+            time_scale=args.time_scale,
+            job_latency=args.job_latency,
+            per_asset_latency=args.per_asset_latency,
+            max_concurrent_jobs=args.max_concurrent_jobs,
+            api_rate_limit=args.api_rate_limit,
+            inventory_files=args.inventory_files,
+            metrics_delay=args.metrics_delay,
+            failing_assets=args.failing_assets,
+            republish=args.republish,
+            environment={"AnonymousUsage": "Yes" if args.anonymous_usage else "No"},
+        )
+        print(json.dumps(report, default=str) if args.json else format_report(report), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Cold-start benchmark of the functions' module imports.
+
+Each run imports a function's ``app`` module in a fresh interpreter, as the Lambda
+runtime does in the init phase, with the function directory and the shared layer on
+``sys.path``. The report gives the median import time over the runs, the number of
+modules the import loaded, and the import time of each top-level package taken from
+``python -X importtime``, heaviest first.
+
+    python -m local_workflow.coldstart --runs 5 --max-init-ms 400
+
+Bytecode caches on disk are used, so the first run after editing a module also
+includes compiling it. ``--max-init-ms`` makes the command fail when a function's
+median import time exceeds the budget.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from local_workflow import fakes
+from local_workflow.harness import SHARED_LAYER_PATH, SOURCE_DIR, load_template
+
+_MARKER = "--- import app ---"
+
+# Runs in the fresh interpreter; only builtin modules are imported before the marker so
+# that everything app needs is attributed to it
+_CHILD = f"""
+import sys
+import time
+
+modules = len(sys.modules)
+sys.stderr.write("{_MARKER}\\n")
+sys.stderr.flush()
+started = time.perf_counter()
+import app
+print(time.perf_counter() - started, len(sys.modules) - modules)
+"""
+
+# Module-level code only reads the log level and the region, never calls AWS
+CHILD_ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": fakes.REGION,
+    "LOG_LEVEL": "ERROR",
+    "AnonymousUsage": "No",
+    "PYTHONDONTWRITEBYTECODE": "1",
+}
+
+
+def function_directories(template=None):
+    """Maps each function's logical id to its code directory"""
+    template = template or load_template()
+    return {
+        logical_id: os.path.join(SOURCE_DIR, resource["Properties"]["CodeUri"])
+        for logical_id, resource in template["Resources"].items()
+        if resource["Type"] == "AWS::Serverless::Function"
+    }
+
+
+def _package_import_times(importtime_output):
+    """Sums the self import time of every module after the marker by top-level package"""
+    seconds = defaultdict(float)
+    lines = importtime_output.splitlines()
+    for line in lines[lines.index(_MARKER) + 1:]:
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        seconds[name.strip().split(".")[0]] += int(self_us) / 1e6
+    return seconds
+
+
+def import_once(function_dir):
+    """Imports ``app`` from ``function_dir`` in a new interpreter"""
+    environment = dict(os.environ, **CHILD_ENVIRONMENT)
+    environment["PYTHONPATH"] = os.pathsep.join([function_dir, SHARED_LAYER_PATH])
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD],
+        cwd=function_dir,
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"importing {function_dir} failed:\n{completed.stderr[-2000:]}")
+    init_seconds, modules = completed.stdout.split()
+    return float(init_seconds), int(modules), _package_import_times(completed.stderr)
+
+
+def measure(logical_id, function_dir, runs):
+    init_seconds, modules, packages = [], [], defaultdict(list)
+    for _ in range(runs):
+        seconds, module_count, package_seconds = import_once(function_dir)
+        init_seconds.append(seconds)
+        modules.append(module_count)
+        for package, package_time in package_seconds.items():
+            packages[package].append(package_time)
+    return {
+        "Function": logical_id,
+        "Runs": runs,
+        "InitSeconds": statistics.median(init_seconds),
+        "MaxInitSeconds": max(init_seconds),
+        "Modules": max(modules),
+        "PackageSeconds": dict(
+            sorted(
+                ((package, statistics.median(times)) for package, times in packages.items()),
+                key=lambda item: item[1],
+                reverse=True,
+            )
+        ),
+    }
+
+
+def format_report(report, top):
+    packages = ", ".join(
+        f"{package} {seconds * 1000:.1f} ms"
+        for package, seconds in list(report["PackageSeconds"].items())[:top]
+    )
+    return (
+        f"{report['Function']}: init {report['InitSeconds'] * 1000:.1f} ms "
+        f"(median of {report['Runs']}, max {report['MaxInitSeconds'] * 1000:.1f} ms), "
+        f"{report['Modules']} modules\n  {packages}"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--function",
+        action="append",
+        default=[],
+        metavar="LOGICAL_ID",
+        help="function to measure, may be repeated; all functions by default",
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=6, help="packages listed per function")
+    parser.add_argument(
+        "--max-init-ms",
+        type=float,
+        help="fail when a function's median import time exceeds this many milliseconds",
+    )
+    parser.add_argument("--json", action="store_true", help="print reports as JSON lines")
+    args = parser.parse_args(argv)
+
+    directories = function_directories()
+    unknown = set(args.function) - set(directories)
+    if unknown:
+        parser.error(f"Unknown functions: {sorted(unknown)}")
+    over_budget = []
+    for logical_id in args.function or sorted(directories):
+        report = measure(logical_id, directories[logical_id], args.runs)
+        print(json.dumps(report) if args.json else format_report(report, args.top), flush=True)
+        if args.max_init_ms and report["InitSeconds"] * 1000 > args.max_init_ms:
+            over_budget.append(logical_id)
+    if over_budget:
+        sys.exit(f"Import time over {args.max_init_ms} ms: {', '.join(over_budget)}")
+
+
+if __name__ == "__main__":
+    main()
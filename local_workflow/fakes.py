@@ -0,0 +1,796 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+In-memory stand-ins for the AWS APIs the solution calls.
+
+Each fake implements only the operations and response fields the functions use, raises
+``botocore.exceptions.ClientError`` with the service's error codes, and counts the calls
+it serves so benchmark runs can report request volume and bytes read.
+"""
+
+import bisect
+import hashlib
+import io
+import itertools
+import json
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from botocore.exceptions import ClientError
+
+REGION = "local"
+ACCOUNT_ID = "000000000000"
+
+
+def _error(code, operation, message=""):
+    return ClientError(
+        {"Error": {"Code": code, "Message": message}, "ResponseMetadata": {}}, operation
+    )
+
+
+def _response(**fields):
+    return dict(fields, ResponseMetadata={"HTTPStatusCode": 200})
+
+
+class Clock:
+    """
+    Scaled wall clock shared by the fakes and the interpreter.
+
+    One simulated second lasts ``time_scale`` real seconds, so Wait states and import job
+    latencies keep their relative timing while the run finishes quickly.
+    """
+
+    def __init__(self, time_scale=0.001):
+        self.time_scale = time_scale
+        self._start = time.monotonic()
+        self._epoch = datetime.now(timezone.utc)
+
+    def now(self):
+        return (time.monotonic() - self._start) / self.time_scale
+
+    def timestamp(self, seconds=None):
+        """Returns the datetime of a simulated time, by default the current one"""
+        return self._epoch + timedelta(seconds=self.now() if seconds is None else seconds)
+
+    def sleep(self, seconds):
+        time.sleep(max(0, seconds) * self.time_scale)
+
+
+class CallCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = Counter()
+
+    def count(self, operation, amount=1):
+        with self._lock:
+            self.calls[operation] += amount
+
+
+# ---------------------------------------------------------------------------
+# S3
+# ---------------------------------------------------------------------------
+
+
+class _Object:
+    __slots__ = ("data", "size", "etag", "last_modified")
+
+    def __init__(self, data, size, etag):
+        self.data = data
+        self.size = size
+        self.etag = etag
+        self.last_modified = datetime.now(timezone.utc)
+
+
+class _Paginator:
+    def __init__(self, s3):
+        self._s3 = s3
+
+    def paginate(self, Bucket, Prefix="", Delimiter=None, PaginationConfig=None, **kwargs):
+        page_size = (PaginationConfig or {}).get("PageSize", 1000)
+        return self._s3._list_pages(Bucket, Prefix, Delimiter, page_size)
+
+
+class FakeS3:
+    """
+    Buckets of objects held in memory.
+
+    Synthetic assets only record a size and ETag so a benchmark can list a million
+    objects without holding their bodies. Every PutObject is reported to ``listener``,
+    if set, with the bucket, key and ETag of the new object, which is how the harness
+    models bucket notifications.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._buckets = {}
+        self._sorted_keys = {}
+        self.listener = None
+        self.counter = CallCounter()
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def _bucket(self, bucket):
+        return self._buckets.setdefault(bucket, {})
+
+    def _store(self, bucket, key, obj):
+        objects = self._bucket(bucket)
+        if key not in objects:
+            self._sorted_keys.pop(bucket, None)
+        objects[key] = obj
+
+    def add_object(self, bucket, key, data):
+        data = data if isinstance(data, bytes) else data.encode("utf-8")
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        with self._lock:
+            self._store(bucket, key, _Object(data, len(data), etag))
+
+    def add_synthetic_objects(self, bucket, sizes_by_key):
+        """Adds body-less objects, e.g. the assets referenced by a benchmark manifest"""
+        with self._lock:
+            for key, size in sizes_by_key:
+                etag = f'"{hashlib.md5(f"{key}:{size}".encode()).hexdigest()}"'
+                self._store(bucket, key, _Object(None, size, etag))
+
+    def add_object(self, bucket, key, data):
+        """Adds an object without counting it as a request, e.g. an inventory report"""
+        with self._lock:
+            self._store(
+                bucket, key, _Object(data, len(data), f'"{hashlib.md5(data).hexdigest()}"')
+            )
+
+    def object_count(self, bucket):
+        return len(self._buckets.get(bucket, {}))
+
+    def iter_objects(self, bucket):
+        """Yields the key, size and ETag of every object, e.g. to build an inventory"""
+        with self._lock:
+            objects = sorted(self._buckets.get(bucket, {}).items())
+        for key, obj in objects:
+            yield key, obj.size, obj.etag
+
+    def _get(self, bucket, key, operation, missing_code):
+        try:
+            return self._buckets[bucket][key]
+        except KeyError:
+            raise _error(missing_code, operation, f"{bucket}/{key} does not exist")
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self.counter.count("GetObject")
+        with self._lock:
+            obj = self._get(Bucket, Key, "GetObject", "NoSuchKey")
+        data = obj.data if obj.data is not None else bytes(obj.size)
+        if Range:
+            start, _, end = Range[len("bytes="):].partition("-")
+            if start == "":
+                data = data[-int(end):]
+            else:
+                data = data[int(start): int(end) + 1 if end else None]
+        with self._lock:
+            self.bytes_read += len(data)
+        return _response(
+            Body=io.BytesIO(data),
+            ContentLength=len(data),
+            ETag=obj.etag,
+            LastModified=obj.last_modified,
+        )
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.counter.count("HeadObject")
+        with self._lock:
+            obj = self._get(Bucket, Key, "HeadObject", "404")
+        return _response(
+            ContentLength=obj.size, ETag=obj.etag, LastModified=obj.last_modified
+        )
+
+    def put_object(self, Body, Bucket, Key, IfMatch=None, IfNoneMatch=None, **kwargs):
+        self.counter.count("PutObject")
+        data = Body if isinstance(Body, bytes) else Body.encode("utf-8")
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        with self._lock:
+            current = self._buckets.get(Bucket, {}).get(Key)
+            if IfNoneMatch == "*" and current is not None:
+                raise _error("PreconditionFailed", "PutObject")
+            if IfMatch and (current is None or current.etag != IfMatch):
+                raise _error("PreconditionFailed", "PutObject")
+            self._store(Bucket, Key, _Object(data, len(data), etag))
+            self.bytes_written += len(data)
+        if self.listener is not None:
+            self.listener(Bucket, Key, etag)
+        return _response(ETag=etag)
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.counter.count("DeleteObject")
+        with self._lock:
+            if self._buckets.get(Bucket, {}).pop(Key, None) is not None:
+                self._sorted_keys.pop(Bucket, None)
+        return _response()
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self.counter.count("DeleteObjects")
+        if len(Delete["Objects"]) > 1000:
+            raise _error("MalformedXML", "DeleteObjects", "More than 1000 keys")
+        with self._lock:
+            objects = self._buckets.get(Bucket, {})
+            for obj in Delete["Objects"]:
+                objects.pop(obj["Key"], None)
+            self._sorted_keys.pop(Bucket, None)
+        if Delete.get("Quiet"):
+            return _response()
+        return _response(Deleted=[{"Key": obj["Key"]} for obj in Delete["Objects"]])
+
+    def get_paginator(self, operation_name):
+        if operation_name != "list_objects_v2":
+            raise NotImplementedError(operation_name)
+        return _Paginator(self)
+
+    def _keys(self, bucket):
+        keys = self._sorted_keys.get(bucket)
+        if keys is None:
+            keys = sorted(self._buckets.get(bucket, {}))
+            self._sorted_keys[bucket] = keys
+        return keys
+
+    def _list_pages(self, bucket, prefix, delimiter, page_size):
+        with self._lock:
+            keys = self._keys(bucket)
+            start = bisect.bisect_left(keys, prefix)
+            end = bisect.bisect_left(keys, prefix + "\U0010ffff")
+            matching = keys[start:end]
+            objects = self._buckets.get(bucket, {})
+            entries = []
+            common_prefixes = []
+            for key in matching:
+                if delimiter:
+                    position = key.find(delimiter, len(prefix))
+                    if position >= 0:
+                        common_prefix = key[: position + len(delimiter)]
+                        if not common_prefixes or common_prefixes[-1] != common_prefix:
+                            common_prefixes.append(common_prefix)
+                        continue
+                obj = objects[key]
+                entries.append(
+                    {
+                        "Key": key,
+                        "Size": obj.size,
+                        "ETag": obj.etag,
+                        "LastModified": obj.last_modified,
+                    }
+                )
+
+        # CommonPrefixes are returned with the first page for simplicity
+        first = True
+        for offset in range(0, max(len(entries), 1), page_size):
+            self.counter.count("ListObjectsV2")
+            page = {"KeyCount": len(entries[offset: offset + page_size])}
+            if entries:
+                page["Contents"] = entries[offset: offset + page_size]
+            if first and common_prefixes:
+                page["CommonPrefixes"] = [{"Prefix": p} for p in common_prefixes]
+            first = False
+            yield page
+
+
+# ---------------------------------------------------------------------------
+# AWS Data Exchange
+# ---------------------------------------------------------------------------
+
+
+class FakeDataExchange:
+    """
+    Revisions and import jobs with a configurable import latency.
+
+    A started job takes ``job_latency + per_asset_latency * assets`` simulated seconds.
+    Like the account-level quota on concurrent import jobs, StartJob raises
+    ServiceLimitExceededException while ``max_concurrent_jobs`` jobs are in progress. A job
+    importing one of the keys in ``failing_keys`` ends in ERROR instead of COMPLETED. With ``api_rate_limit``, CreateJob, StartJob and GetJob each
+    raise ThrottlingException beyond that many requests per simulated second.
+    """
+
+    MAX_ASSETS_PER_JOB = 100
+    MAX_ASSETS_PER_REVISION = 10000
+
+    def __init__(
+        self,
+        clock,
+        job_latency=30.0,
+        per_asset_latency=0.1,
+        max_concurrent_jobs=10,
+        api_rate_limit=None,
+    ):
+        self.clock = clock
+        self.api_rate_limit = api_rate_limit
+        self._requests = {}
+        self.job_latency = job_latency
+        self.per_asset_latency = per_asset_latency
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.failing_keys = set()
+        self.revisions = {}
+        self.jobs = {}
+        self.counter = CallCounter()
+
+    def _admit(self, operation):
+        self.counter.count(operation)
+        if not self.api_rate_limit:
+            return
+        with self._lock:
+            now = self.clock.now()
+            recent = self._requests.setdefault(operation, deque())
+            while recent and recent[0] <= now - 1:
+                recent.popleft()
+            if len(recent) >= self.api_rate_limit:
+                self.counter.count(f"{operation}Throttled")
+                raise _error("ThrottlingException", operation, "Rate exceeded")
+            recent.append(now)
+
+    def _next_id(self):
+        return f"{next(self._ids):032x}"
+
+    def create_revision(self, DataSetId, Comment=None, **kwargs):
+        self.counter.count("CreateRevision")
+        revision_id = self._next_id()
+        revision = {
+            "Id": revision_id,
+            "Arn": f"arn:aws:dataexchange:{REGION}:{ACCOUNT_ID}:data-sets/{DataSetId}/revisions/{revision_id}",
+            "DataSetId": DataSetId,
+            "Comment": Comment,
+            "Finalized": False,
+            "AssetCount": 0,
+            "CreatedAt": self.clock.timestamp(),
+        }
+        revision["UpdatedAt"] = revision["CreatedAt"]
+        with self._lock:
+            self.revisions[revision_id] = revision
+        return _response(**{k: v for k, v in revision.items() if k != "AssetCount"})
+
+    def get_revision(self, DataSetId, RevisionId, **kwargs):
+        self.counter.count("GetRevision")
+        with self._lock:
+            revision = self.revisions.get(RevisionId)
+            if revision is None or revision["DataSetId"] != DataSetId:
+                raise _error("ResourceNotFoundException", "GetRevision")
+            return _response(
+                **{k: v for k, v in revision.items() if k != "AssetCount"}
+            )
+
+    def update_revision(self, DataSetId, RevisionId, Finalized=None, Comment=None, **kwargs):
+        self.counter.count("UpdateRevision")
+        with self._lock:
+            revision = self.revisions.get(RevisionId)
+            if revision is None or revision["DataSetId"] != DataSetId:
+                raise _error("ResourceNotFoundException", "UpdateRevision")
+            if Finalized:
+                if any(
+                    job["State"] == "IN_PROGRESS" for job in self._revision_jobs(RevisionId)
+                ):
+                    raise _error(
+                        "ConflictException", "UpdateRevision", "Revision has running jobs"
+                    )
+                revision["Finalized"] = True
+                revision["UpdatedAt"] = self.clock.timestamp()
+            if Comment is not None:
+                revision["Comment"] = Comment
+            return _response(
+                **{k: v for k, v in revision.items() if k != "AssetCount"}
+            )
+
+    def create_job(self, Type, Details, **kwargs):
+        self._admit("CreateJob")
+        if Type != "IMPORT_ASSETS_FROM_S3":
+            raise _error("ValidationException", "CreateJob", f"Unsupported job type {Type}")
+        details = Details["ImportAssetsFromS3"]
+        sources = details["AssetSources"]
+        if not 0 < len(sources) <= self.MAX_ASSETS_PER_JOB:
+            raise _error(
+                "ValidationException", "CreateJob", f"{len(sources)} assets in one job"
+            )
+        with self._lock:
+            revision = self.revisions.get(details["RevisionId"])
+            if revision is None:
+                raise _error("ResourceNotFoundException", "CreateJob")
+            if revision["Finalized"]:
+                raise _error("ConflictException", "CreateJob", "Revision is finalized")
+            job_id = self._next_id()
+            now = self.clock.timestamp()
+            self.jobs[job_id] = {
+                "Id": job_id,
+                "Arn": f"arn:aws:dataexchange:{REGION}:{ACCOUNT_ID}:jobs/{job_id}",
+                "Type": Type,
+                "RevisionId": details["RevisionId"],
+                "AssetCount": len(sources),
+                "Fails": any(source["Key"] in self.failing_keys for source in sources),
+                "State": "WAITING",
+                "Started": False,
+                "CompletesAt": None,
+                "CreatedAt": now,
+                "UpdatedAt": now,
+            }
+            job = self.jobs[job_id]
+        return _response(
+            Id=job_id, Arn=job["Arn"], Type=Type, State="WAITING", CreatedAt=now, UpdatedAt=now
+        )
+
+    def start_job(self, JobId, **kwargs):
+        self._admit("StartJob")
+        with self._lock:
+            job = self.jobs.get(JobId)
+            if job is None:
+                raise _error("ResourceNotFoundException", "StartJob")
+            if job["Started"]:
+                raise _error("ConflictException", "StartJob", "Job already started")
+            now = self.clock.now()
+            in_progress = sum(
+                1
+                for other in self.jobs.values()
+                if self._refresh(other, now)["State"] == "IN_PROGRESS"
+            )
+            if in_progress >= self.max_concurrent_jobs:
+                self.counter.count("StartJobLimitExceeded")
+                raise _error(
+                    "ServiceLimitExceededException",
+                    "StartJob",
+                    f"Limit of {self.max_concurrent_jobs} concurrent import jobs exceeded",
+                )
+            completes_at = now + self.job_latency + self.per_asset_latency * job["AssetCount"]
+            job.update(Started=True, State="IN_PROGRESS", CompletesAt=completes_at)
+            job["UpdatedAt"] = self.clock.timestamp(now)
+        return _response()
+
+    def _refresh(self, job, now):
+        if job["State"] == "IN_PROGRESS" and now >= job["CompletesAt"]:
+            job["State"] = "ERROR" if job["Fails"] else "COMPLETED"
+            job["UpdatedAt"] = self.clock.timestamp(job["CompletesAt"])
+            if not job["Fails"]:
+                self.revisions[job["RevisionId"]]["AssetCount"] += job["AssetCount"]
+        return job
+
+    def _revision_jobs(self, revision_id):
+        now = self.clock.now()
+        return [
+            self._refresh(job, now)
+            for job in self.jobs.values()
+            if job["RevisionId"] == revision_id
+        ]
+
+    def get_job(self, JobId, **kwargs):
+        self._admit("GetJob")
+        with self._lock:
+            job = self.jobs.get(JobId)
+            if job is None:
+                raise _error("ResourceNotFoundException", "GetJob")
+            self._refresh(job, self.clock.now())
+            return _response(
+                Id=job["Id"],
+                Arn=job["Arn"],
+                Type=job["Type"],
+                State=job["State"],
+                CreatedAt=job["CreatedAt"],
+                UpdatedAt=job["UpdatedAt"],
+            )
+
+    def imported_asset_count(self):
+        with self._lock:
+            now = self.clock.now()
+            for job in self.jobs.values():
+                self._refresh(job, now)
+            return sum(
+                revision["AssetCount"]
+                for revision in self.revisions.values()
+                if revision["Finalized"]
+            )
+
+
+# ---------------------------------------------------------------------------
+# AWS Marketplace Catalog
+# ---------------------------------------------------------------------------
+
+
+class FakeMarketplaceCatalog:
+    def __init__(self):
+        self.counter = CallCounter()
+
+    def describe_entity(self, Catalog, EntityId, **kwargs):
+        self.counter.count("DescribeEntity")
+        return _response(
+            EntityType="DataProduct@1.0",
+            EntityIdentifier=f"{EntityId}@1",
+            EntityArn=f"arn:aws:aws-marketplace:us-east-1:{ACCOUNT_ID}:AWSMarketplace/DataProduct/{EntityId}",
+            Details="{}",
+        )
+
+
+# ---------------------------------------------------------------------------
+# AWS Step Functions
+# ---------------------------------------------------------------------------
+
+
+class FakeStepFunctions:
+    """
+    Execution bookkeeping and task tokens for the interpreter.
+
+    ``start_execution`` only records the execution; the harness runs queued executions
+    with ``launcher``, which it sets to a callable taking the execution record.
+    """
+
+    def __init__(self):
+        self._lock = threading.Condition()
+        self.executions = {}
+        self._tokens = {}
+        self.launcher = None
+        self.counter = CallCounter()
+
+    def start_execution(self, stateMachineArn, input="{}", name=None, **kwargs):
+        self.counter.count("StartExecution")
+        execution, created = self.create_execution(stateMachineArn, input, name)
+        if created and self.launcher is not None:
+            self.launcher(execution)
+        return _response(
+            executionArn=execution["executionArn"], startDate=execution["startDate"]
+        )
+
+    def create_execution(self, stateMachineArn, input="{}", name=None):
+        """Records a new execution, returning it and whether it was created by this call"""
+        name = name or str(uuid.uuid4())
+        execution_arn = f"{stateMachineArn.replace(':stateMachine:', ':execution:')}:{name}"
+        with self._lock:
+            existing = self.executions.get(execution_arn)
+            if existing is not None:
+                if existing["input"] == input and existing["status"] == "RUNNING":
+                    return existing, False
+                raise _error("ExecutionAlreadyExists", "StartExecution", execution_arn)
+            execution = {
+                "executionArn": execution_arn,
+                "stateMachineArn": stateMachineArn,
+                "name": name,
+                "input": input,
+                "status": "RUNNING",
+                "startDate": datetime.now(timezone.utc),
+                "output": None,
+                "error": None,
+            }
+            self.executions[execution_arn] = execution
+        return execution, True
+
+    def describe_execution(self, executionArn, **kwargs):
+        self.counter.count("DescribeExecution")
+        with self._lock:
+            execution = self.executions.get(executionArn)
+            if execution is None:
+                raise _error("ExecutionDoesNotExist", "DescribeExecution")
+            return _response(**execution)
+
+    def list_executions(self, stateMachineArn, statusFilter=None, **kwargs):
+        self.counter.count("ListExecutions")
+        with self._lock:
+            executions = [
+                {k: execution[k] for k in ("executionArn", "stateMachineArn", "name", "status", "startDate")}
+                for execution in self.executions.values()
+                if execution["stateMachineArn"] == stateMachineArn
+                and (statusFilter is None or execution["status"] == statusFilter)
+            ]
+        return _response(executions=executions)
+
+    def get_paginator(self, operation_name):
+        if operation_name != "list_executions":
+            raise NotImplementedError(operation_name)
+        fake = self
+
+        class _ExecutionPaginator:
+            def paginate(self, **kwargs):
+                yield fake.list_executions(**kwargs)
+
+        return _ExecutionPaginator()
+
+    def finish_execution(self, execution_arn, status, output=None, error=None):
+        with self._lock:
+            execution = self.executions[execution_arn]
+            execution.update(status=status, output=output, error=error)
+            execution["stopDate"] = datetime.now(timezone.utc)
+            self._lock.notify_all()
+
+    def wait_for_executions(self, timeout=None):
+        """Blocks until every execution has finished"""
+        with self._lock:
+            return self._lock.wait_for(
+                lambda: all(e["status"] != "RUNNING" for e in self.executions.values()),
+                timeout=timeout,
+            )
+
+    def register_token(self, task_token):
+        with self._lock:
+            self._tokens[task_token] = None
+
+    def send_task_success(self, taskToken, output, **kwargs):
+        self.counter.count("SendTaskSuccess")
+        self._resolve(taskToken, ("SUCCESS", json.loads(output)))
+        return _response()
+
+    def send_task_failure(self, taskToken, error="", cause="", **kwargs):
+        self.counter.count("SendTaskFailure")
+        self._resolve(taskToken, ("FAILURE", (error, cause)))
+        return _response()
+
+    def _resolve(self, task_token, outcome):
+        with self._lock:
+            if task_token not in self._tokens or self._tokens[task_token] is not None:
+                raise _error("TaskTimedOut", "SendTaskSuccess", "Task token is no longer valid")
+            self._tokens[task_token] = outcome
+            self._lock.notify_all()
+
+    def wait_for_token(self, task_token, deadline, clock):
+        """Returns the outcome sent for a task token, or None once ``deadline`` passes"""
+        with self._lock:
+            while True:
+                outcome = self._tokens.get(task_token)
+                if outcome is not None:
+                    del self._tokens[task_token]
+                    return outcome
+                if deadline is not None and clock.now() >= deadline:
+                    self._tokens.pop(task_token, None)
+                    return None
+                self._lock.wait(timeout=clock.time_scale)
+
+
+# ---------------------------------------------------------------------------
+# Amazon SQS
+# ---------------------------------------------------------------------------
+
+
+class FakeSQS:
+    """
+    Standard queues with visibility timeouts on the shared clock.
+
+    ``receive`` returns messages in the shape of a Lambda SQS event record, which is how
+    the harness's event source mapping delivers them.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._ids = itertools.count()
+        self.counter = CallCounter()
+
+    def _queue(self, queue_url):
+        return self._queues.setdefault(queue_url, {})
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        self.counter.count("SendMessage")
+        message_id = str(uuid.uuid4())
+        with self._lock:
+            self._queue(QueueUrl)[message_id] = {
+                "messageId": message_id,
+                "body": MessageBody,
+                "receiveCount": 0,
+                "visibleAt": self.clock.now(),
+                "receiptHandle": None,
+            }
+        return _response(MessageId=message_id)
+
+    def receive(self, queue_url, queue_arn, max_messages, visibility_timeout):
+        self.counter.count("ReceiveMessage")
+        now = self.clock.now()
+        records = []
+        with self._lock:
+            for message in self._queue(queue_url).values():
+                if len(records) == max_messages:
+                    break
+                if message["visibleAt"] > now:
+                    continue
+                message["receiveCount"] += 1
+                message["visibleAt"] = now + visibility_timeout
+                message["receiptHandle"] = f"{message['messageId']}#{next(self._ids)}"
+                records.append(
+                    {
+                        "messageId": message["messageId"],
+                        "receiptHandle": message["receiptHandle"],
+                        "body": message["body"],
+                        "attributes": {
+                            "ApproximateReceiveCount": str(message["receiveCount"])
+                        },
+                        "eventSource": "aws:sqs",
+                        "eventSourceARN": queue_arn,
+                    }
+                )
+        return records
+
+    def _message(self, queue_url, receipt_handle, operation):
+        message = self._queue(queue_url).get(receipt_handle.split("#")[0])
+        if message is None or message["receiptHandle"] != receipt_handle:
+            raise _error("ReceiptHandleIsInvalid", operation)
+        return message
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout, **kwargs):
+        self.counter.count("ChangeMessageVisibility")
+        with self._lock:
+            message = self._message(QueueUrl, ReceiptHandle, "ChangeMessageVisibility")
+            message["visibleAt"] = self.clock.now() + VisibilityTimeout
+        return _response()
+
+    def delete_message(self, QueueUrl, ReceiptHandle, **kwargs):
+        self.counter.count("DeleteMessage")
+        with self._lock:
+            message = self._message(QueueUrl, ReceiptHandle, "DeleteMessage")
+            del self._queue(QueueUrl)[message["messageId"]]
+        return _response()
+
+    def message_count(self, queue_url):
+        with self._lock:
+            return len(self._queue(queue_url))
+
+
+# ---------------------------------------------------------------------------
+# HTTP endpoints
+# ---------------------------------------------------------------------------
+
+
+class LocalHttpEndpoint:
+    """
+    HTTP server on localhost that records every request it receives.
+
+    Stands in for the anonymous metrics endpoint and for the pre-signed URL a custom
+    resource responds to, so functions that POST or PUT over HTTP stay off the network.
+    """
+
+    def __init__(self, status=200, delay=0.0):
+        self.requests = []
+        self.status = status
+        self.delay = delay
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _record(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                endpoint.requests.append(
+                    {"method": self.command, "path": self.path, "body": body}
+                )
+                if endpoint.delay:
+                    time.sleep(endpoint.delay)
+                self.send_response(endpoint.status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            do_POST = do_PUT = _record
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,795 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Runs the solution end to end in one process.
+
+``LocalWorkflow`` reads ``source/template.yaml``, resolves the parameters, environment
+variables and state machine definitions the stack would deploy, loads every function's
+``app.lambda_handler`` and points the shared runtime's clients at the in-memory fakes.
+Uploading a manifest then invokes StartPublishingWorkflowFunction with the S3 event the
+bucket notification sends, and the resulting executions are run by the interpreter.
+Objects the functions write deliver the notifications their keys match as well.
+"""
+
+import importlib.util
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+from local_workflow import fakes
+from local_workflow.interpreter import StateMachine, StatesError, Stats
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "source")
+TEMPLATE_PATH = os.path.join(SOURCE_DIR, "template.yaml")
+SHARED_LAYER_PATH = os.path.join(SOURCE_DIR, "SharedLayer", "python")
+
+# Parameters without a default in the template, and a quieter log level than the
+# template's INFO so per-asset log lines do not dominate large runs
+DEFAULT_PARAMETERS = {
+    "ManifestBucket": "local-manifest-bucket",
+    "AssetBucket": "local-asset-bucket",
+    "ManifestBucketLoggingBucket": "local-logging-bucket",
+    "LoggingLevel": "WARNING",
+}
+
+# Anonymous usage metrics are off unless a run enables them, and then go to the local
+# HTTP stand-in
+DEFAULT_ENVIRONMENT = {"AnonymousUsage": "No"}
+
+# The scheduled sweep runs a single pass per invocation; the harness invokes it on the
+# schedule instead of letting it sleep inside the function
+CALLBACK_SWEEP_ENVIRONMENT = {"SWEEP_DURATION_SECONDS": "0"}
+CALLBACK_SWEEP_INTERVAL_SECONDS = 60
+
+PSEUDO_PARAMETERS = {
+    "AWS::Partition": "aws",
+    "AWS::Region": fakes.REGION,
+    "AWS::AccountId": fakes.ACCOUNT_ID,
+    "AWS::StackName": "local",
+    "AWS::URLSuffix": "amazonaws.com",
+}
+
+# Stands for a property removed with !Ref AWS::NoValue
+_NO_VALUE = object()
+
+SDK_ERROR_PREFIXES = {"dataexchange": "DataExchange", "s3": "S3", "sfn": "Sfn"}
+SDK_CLIENT_NAMES = {"sfn": "stepfunctions"}
+
+
+def _cfn_tag(loader, tag_suffix, node):
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+    if tag_suffix == "Ref":
+        return {"Ref": value}
+    if tag_suffix == "GetAtt" and isinstance(value, str):
+        value = value.split(".", 1)
+    return {f"Fn::{tag_suffix}": value}
+
+
+class _TemplateLoader(yaml.SafeLoader):
+    pass
+
+
+_TemplateLoader.add_multi_constructor("!", _cfn_tag)
+
+
+def load_template(path=TEMPLATE_PATH):
+    with open(path) as template_file:
+        return yaml.load(template_file, Loader=_TemplateLoader)
+
+
+def _snake_case(name):
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower()
+
+
+def _json_safe(value):
+    return json.loads(json.dumps(value, default=str))
+
+
+def _s3_record(bucket, key, etag):
+    """The record of an ObjectCreated:Put event as S3 sends it to a notification target"""
+    return {
+        "eventSource": "aws:s3",
+        "eventName": "ObjectCreated:Put",
+        "eventTime": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+        "s3": {
+            "bucket": {"name": bucket},
+            "object": {
+                "key": urllib.parse.quote_plus(key, safe="/"),
+                "eTag": etag.strip('"'),
+                "sequencer": f"{time.time_ns():X}",
+            },
+        },
+    }
+
+
+def _matches_filter(configuration, record):
+    """Whether a record's key passes a notification configuration's prefix and suffix rules"""
+    key = urllib.parse.unquote_plus(record["s3"]["object"]["key"])
+    for rule in configuration.get("Filter", {}).get("S3Key", {}).get("Rules", []):
+        name = rule["Name"].lower()
+        if name == "prefix" and not key.startswith(rule["Value"]):
+            return False
+        if name == "suffix" and not key.endswith(rule["Value"]):
+            return False
+    return True
+
+
+class LambdaContext:
+    def __init__(self, function_name, timeout_seconds):
+        self.function_name = function_name
+        self.function_version = "$LATEST"
+        self.invoked_function_arn = (
+            f"arn:aws:lambda:{fakes.REGION}:{fakes.ACCOUNT_ID}:function:{function_name}"
+        )
+        self.memory_limit_in_mb = 128
+        self.aws_request_id = str(uuid.uuid4())
+        self.log_group_name = f"/aws/lambda/{function_name}"
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+class LocalWorkflow:
+    """
+    The stack defined by the template, deployed against in-memory fakes.
+
+    Use it as a context manager: entering deploys the stack, i.e. loads the functions,
+    runs the custom resources and starts the HTTP stand-in and the callback sweep.
+    """
+
+    def __init__(
+        self,
+        parameters=None,
+        environment=None,
+        template_path=TEMPLATE_PATH,
+        time_scale=0.001,
+        job_latency=30.0,
+        per_asset_latency=0.1,
+        max_concurrent_jobs=10,
+        api_rate_limit=None,
+    ):
+        self.template = load_template(template_path)
+        self.parameters = self._resolve_parameters(parameters or {})
+        self.environment_overrides = dict(DEFAULT_ENVIRONMENT, **(environment or {}))
+        self.clock = fakes.Clock(time_scale)
+        self.stats = Stats()
+        self.s3 = fakes.FakeS3()
+        self.s3.listener = self._object_created
+        self.dataexchange = fakes.FakeDataExchange(
+            self.clock, job_latency, per_asset_latency, max_concurrent_jobs, api_rate_limit
+        )
+        self.marketplace = fakes.FakeMarketplaceCatalog()
+        self.stepfunctions = fakes.FakeStepFunctions()
+        self.stepfunctions.launcher = self._launch
+        self.sqs = fakes.FakeSQS(self.clock)
+        self.http = fakes.LocalHttpEndpoint()
+        self.clients = {
+            "s3": self.s3,
+            "dataexchange": self.dataexchange,
+            "marketplace-catalog": self.marketplace,
+            "stepfunctions": self.stepfunctions,
+            "sqs": self.sqs,
+        }
+        self.invocations = Counter()
+        self.invocation_seconds = Counter()
+        self._invocation_lock = threading.Lock()
+        self._custom_resources = {}
+        self._modules = {}
+        self._state_machines = {}
+        self._executor = ThreadPoolExecutor(max_workers=64)
+        self._stop = threading.Event()
+        self._sweeper = None
+        self._pollers = []
+        self._polling = Counter()
+        self._uploading = threading.local()
+        self._saved_environment = None
+        self.metric_records = []
+
+    # -- template ------------------------------------------------------------
+
+    def _resources(self, resource_type):
+        """The resources of a type that the stack creates with the given parameters"""
+        return {
+            logical_id: resource
+            for logical_id, resource in self.template["Resources"].items()
+            if resource["Type"] == resource_type
+            and ("Condition" not in resource or self._condition(resource["Condition"]))
+        }
+
+    def _resolve_parameters(self, overrides):
+        parameters = {}
+        for name, parameter in self.template["Parameters"].items():
+            value = overrides.get(name, DEFAULT_PARAMETERS.get(name, parameter.get("Default")))
+            if value is None:
+                raise ValueError(f"Parameter {name} has no default and was not provided")
+            if "AllowedValues" in parameter and str(value) not in map(str, parameter["AllowedValues"]):
+                raise ValueError(f"{value!r} is not an allowed value for {name}")
+            parameters[name] = str(value)
+        unknown = set(overrides) - set(parameters)
+        if unknown:
+            raise ValueError(f"Unknown parameters: {sorted(unknown)}")
+        return parameters
+
+    def function_arn(self, logical_id):
+        return f"arn:aws:lambda:{fakes.REGION}:{fakes.ACCOUNT_ID}:function:{logical_id}"
+
+    def state_machine_arn(self, logical_id):
+        return f"arn:aws:states:{fakes.REGION}:{fakes.ACCOUNT_ID}:stateMachine:{logical_id}"
+
+    def _ref(self, name):
+        if name == "AWS::NoValue":
+            return _NO_VALUE
+        if name in self.parameters:
+            return self.parameters[name]
+        if name in PSEUDO_PARAMETERS:
+            return PSEUDO_PARAMETERS[name]
+        resource = self.template["Resources"][name]
+        if resource["Type"] == "AWS::StepFunctions::StateMachine":
+            return self.state_machine_arn(name)
+        if resource["Type"] == "AWS::S3::Bucket":
+            return self.resolve(resource["Properties"]["BucketName"])
+        if resource["Type"] == "AWS::SQS::Queue":
+            return f"https://sqs.{fakes.REGION}.amazonaws.com/{fakes.ACCOUNT_ID}/{name}"
+        return name
+
+    def _get_att(self, logical_id, attribute):
+        resource_type = self.template["Resources"][logical_id]["Type"]
+        if resource_type == "AWS::Serverless::Function" and attribute == "Arn":
+            return self.function_arn(logical_id)
+        if resource_type == "AWS::StepFunctions::StateMachine":
+            return self.state_machine_arn(logical_id) if attribute == "Arn" else logical_id
+        if resource_type == "AWS::SQS::Queue":
+            if attribute == "Arn":
+                return f"arn:aws:sqs:{fakes.REGION}:{fakes.ACCOUNT_ID}:{logical_id}"
+            return logical_id
+        if resource_type.startswith("Custom::"):
+            return self._custom_resources[logical_id][attribute]
+        return f"arn:aws:local:{logical_id}:{attribute}"
+
+    def _condition(self, name):
+        return self.resolve(self.template["Conditions"][name])
+
+    def _sub(self, template, variables):
+        def replace(match):
+            name = match.group(1)
+            if name in variables:
+                return str(variables[name])
+            if "." in name:
+                return str(self._get_att(*name.split(".", 1)))
+            return str(self._ref(name))
+
+        return re.sub(r"\$\{([^}!]+)\}", replace, template)
+
+    def resolve(self, value):
+        """Evaluates the intrinsic functions the template uses"""
+        if isinstance(value, list):
+            return [item for item in map(self.resolve, value) if item is not _NO_VALUE]
+        if not isinstance(value, dict):
+            return value
+        if len(value) == 1:
+            (function, argument), = value.items()
+            if function == "Ref":
+                return self._ref(argument)
+            if function == "Fn::GetAtt":
+                return self._get_att(*argument)
+            if function == "Fn::Sub":
+                if isinstance(argument, str):
+                    return self._sub(argument, {})
+                template, variables = argument
+                return self._sub(template, self.resolve(variables))
+            if function == "Fn::FindInMap":
+                mapping, top, second = self.resolve(argument)
+                return self.template["Mappings"][mapping][top][second]
+            if function == "Fn::Equals":
+                left, right = self.resolve(argument)
+                return str(left) == str(right)
+            if function == "Fn::If":
+                condition, when_true, when_false = argument
+                return self.resolve(when_true if self._condition(condition) else when_false)
+            if function == "Fn::Not":
+                return not self.resolve(argument[0])
+        resolved = {key: self.resolve(item) for key, item in value.items()}
+        return {key: item for key, item in resolved.items() if item is not _NO_VALUE}
+
+    # -- deployment ----------------------------------------------------------
+
+    def __enter__(self):
+        self.http.__enter__()
+        self._saved_environment = dict(os.environ)
+        if SHARED_LAYER_PATH not in sys.path:
+            sys.path.insert(0, SHARED_LAYER_PATH)
+        from adx_coordinator import telemetry
+
+        # Before the custom resources run, since SolutionHelper sends a lifecycle metric
+        telemetry.use_endpoint(self.http.url)
+        functions = self._resources("AWS::Serverless::Function")
+
+        # Custom resources are created first since environments reference their outputs
+        os.environ.update(self._environment("SolutionHelper", functions["SolutionHelper"]))
+        for logical_id, resource in self.template["Resources"].items():
+            if resource["Type"].startswith("Custom::"):
+                self._create_custom_resource(logical_id, resource)
+
+        environment = {}
+        for logical_id, resource in functions.items():
+            environment.update(self._environment(logical_id, resource))
+        os.environ.update(environment)
+
+        from adx_coordinator import emf, ratelimit, runtime
+
+        for service_name, service_client in self.clients.items():
+            runtime.register_client(service_name, service_client)
+        runtime.configure_logging()
+        ratelimit.use_clock(self.clock.now, self.clock.sleep)
+        emf.use_sink(self.metric_records.append)
+
+        for logical_id, resource in self._resources("AWS::StepFunctions::StateMachine").items():
+            definition = json.loads(self.resolve(resource["Properties"]["DefinitionString"]))
+            self._state_machines[self.state_machine_arn(logical_id)] = StateMachine(
+                definition, self, self.clock, self.stats, arn=self.state_machine_arn(logical_id)
+            )
+
+        if self._callback_sweep_enabled():
+            self._sweeper = threading.Thread(target=self._sweep, daemon=True)
+            self._sweeper.start()
+
+        for logical_id, mapping in self._resources("AWS::Lambda::EventSourceMapping").items():
+            poller = threading.Thread(
+                target=self._poll_queue, args=(logical_id, mapping), daemon=True
+            )
+            poller.start()
+            self._pollers.append(poller)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+        for poller in self._pollers:
+            poller.join()
+        self._executor.shutdown(wait=True)
+        self.http.__exit__(*exc_info)
+        os.environ.clear()
+        os.environ.update(self._saved_environment)
+
+        from adx_coordinator import emf, telemetry
+
+        emf.use_sink(None)
+        telemetry.use_endpoint(None)
+
+    def _environment(self, logical_id, resource):
+        global_variables = (
+            self.template.get("Globals", {})
+            .get("Function", {})
+            .get("Environment", {})
+            .get("Variables", {})
+        )
+        variables = self.resolve(
+            dict(
+                global_variables,
+                **resource["Properties"].get("Environment", {}).get("Variables", {}),
+            )
+        )
+        environment = {name: str(value) for name, value in variables.items()}
+        environment.update(self.environment_overrides)
+        if logical_id == "JobCompletionCallbackFunction":
+            environment.update(CALLBACK_SWEEP_ENVIRONMENT)
+        return environment
+
+    def _create_custom_resource(self, logical_id, resource):
+        properties = self.resolve(resource["Properties"])
+        function_id = properties["ServiceToken"].rsplit(":", 1)[1]
+        event = {
+            "RequestType": "Create",
+            "ResponseURL": self.http.url,
+            "StackId": "local",
+            "RequestId": str(uuid.uuid4()),
+            "LogicalResourceId": logical_id,
+            "ResourceType": resource["Type"],
+            "ResourceProperties": properties,
+        }
+        self._custom_resources[logical_id] = self.invoke(function_id, event) or {}
+
+    def _module(self, logical_id):
+        module = self._modules.get(logical_id)
+        if module is None:
+            code_uri = self.template["Resources"][logical_id]["Properties"]["CodeUri"]
+            path = os.path.join(SOURCE_DIR, code_uri, "app.py")
+            spec = importlib.util.spec_from_file_location(f"{logical_id}.app", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            self._modules[logical_id] = module
+        return module
+
+    def _callback_sweep_enabled(self):
+        for resource in self._resources("AWS::Serverless::Function").values():
+            for event in resource["Properties"].get("Events", {}).values():
+                if event["Type"] == "Schedule":
+                    return self.resolve(event["Properties"].get("State")) == "ENABLED"
+        return False
+
+    def _sweep(self):
+        while not self._stop.is_set():
+            self.clock.sleep(CALLBACK_SWEEP_INTERVAL_SECONDS)
+            try:
+                self.invoke(
+                    "JobCompletionCallbackFunction",
+                    {"detail-type": "Scheduled Event", "source": "aws.events", "detail": {}},
+                )
+            except Exception:
+                logging.exception("Scheduled job completion sweep failed")
+
+    def _poll_queue(self, logical_id, mapping):
+        """Delivers queued messages to a function like an SQS event source mapping"""
+        properties = mapping["Properties"]
+        queue_id = properties["EventSourceArn"]["Fn::GetAtt"][0]
+        queue_url = self._ref(queue_id)
+        queue_arn = self._get_att(queue_id, "Arn")
+        function_id = self.resolve(properties["FunctionName"])
+        batch_size = int(properties.get("BatchSize", 10))
+        batching_window = int(properties.get("MaximumBatchingWindowInSeconds", 0))
+        visibility_timeout = int(
+            self.template["Resources"][queue_id]["Properties"].get("VisibilityTimeout", 30)
+        )
+        while not self._stop.is_set():
+            records = self.sqs.receive(queue_url, queue_arn, batch_size, visibility_timeout)
+            if not records:
+                self.clock.sleep(1)
+                continue
+            with self._invocation_lock:
+                self._polling[logical_id] += 1
+            try:
+                if len(records) < batch_size and batching_window:
+                    self.clock.sleep(batching_window)
+                    records += self.sqs.receive(
+                        queue_url, queue_arn, batch_size - len(records), visibility_timeout
+                    )
+                try:
+                    response = self.invoke(function_id, {"Records": records})
+                except (Exception, SystemExit):
+                    # The whole batch becomes visible again after the visibility timeout
+                    logging.exception(f"{function_id} failed to process a queue batch")
+                    continue
+                failed = {
+                    failure["itemIdentifier"]
+                    for failure in (response or {}).get("batchItemFailures", [])
+                }
+                for record in records:
+                    if record["messageId"] not in failed:
+                        self.sqs.delete_message(
+                            QueueUrl=queue_url, ReceiptHandle=record["receiptHandle"]
+                        )
+            finally:
+                with self._invocation_lock:
+                    self._polling[logical_id] -= 1
+
+    def _queue_urls(self):
+        return [
+            self._ref(mapping["Properties"]["EventSourceArn"]["Fn::GetAtt"][0])
+            for mapping in self._resources("AWS::Lambda::EventSourceMapping").values()
+        ]
+
+    def wait_until_idle(self, timeout=None):
+        """Blocks until no message is queued or being delivered and no execution is running"""
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            queued = sum(self.sqs.message_count(url) for url in self._queue_urls())
+            with self._invocation_lock:
+                polling = sum(self._polling.values())
+            if not queued and not polling and self.stepfunctions.wait_for_executions(0):
+                return True
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            self.clock.sleep(1)
+
+    # -- invocations ---------------------------------------------------------
+
+    def invoke(self, logical_id, event):
+        """Invokes a function's handler with a JSON copy of the event"""
+        module = self._module(logical_id)
+        timeout = int(self.template.get("Globals", {}).get("Function", {}).get("Timeout", 3))
+        started = time.monotonic()
+        try:
+            return module.lambda_handler(
+                json.loads(json.dumps(event)), LambdaContext(logical_id, timeout)
+            )
+        finally:
+            with self._invocation_lock:
+                self.invocations[logical_id] += 1
+                self.invocation_seconds[logical_id] += time.monotonic() - started
+
+    def _invoke_task(self, logical_id, payload):
+        try:
+            return _json_safe(self.invoke(logical_id, payload))
+        except (Exception, SystemExit) as error:
+            raise StatesError(type(error).__name__, str(error))
+
+    def run_task(self, resource, task_input, context, timeout=None):
+        """Runs a Task state's resource; called by the interpreter"""
+        if resource.startswith("arn:aws:lambda:"):
+            return self._invoke_task(resource.rsplit(":", 1)[1], task_input)
+
+        if resource.startswith("arn:aws:states:::lambda:invoke"):
+            function_id = task_input["FunctionName"].rsplit(":", 1)[1]
+            if not resource.endswith(".waitForTaskToken"):
+                return {
+                    "StatusCode": 200,
+                    "Payload": self._invoke_task(function_id, task_input.get("Payload", {})),
+                }
+            token = context["Task"]["Token"]
+            self.stepfunctions.register_token(token)
+            self._invoke_task(function_id, task_input.get("Payload", {}))
+            return self._wait_for_token(token, timeout)
+
+        if resource.startswith("arn:aws:states:::states:startExecution"):
+            return self._start_execution(resource, task_input)
+
+        if resource.startswith("arn:aws:states:::aws-sdk:"):
+            service, action = resource[len("arn:aws:states:::aws-sdk:"):].split(":")
+            return self._call_sdk(service, action, task_input)
+
+        raise StatesError("States.Runtime", f"Unsupported resource {resource}")
+
+    def _wait_for_token(self, token, timeout):
+        deadline = self.clock.now() + timeout if timeout else None
+        outcome = self.stepfunctions.wait_for_token(token, deadline, self.clock)
+        if outcome is None:
+            raise StatesError("States.Timeout", "Task timed out waiting for its token")
+        status, result = outcome
+        if status == "FAILURE":
+            raise StatesError(*result)
+        return result
+
+    def _start_execution(self, resource, task_input):
+        state_machine_arn = task_input["StateMachineArn"]
+        execution_input = task_input.get("Input", {})
+        if not isinstance(execution_input, str):
+            execution_input = json.dumps(execution_input)
+        if not resource.endswith((".sync", ".sync:2")):
+            try:
+                response = self.stepfunctions.start_execution(
+                    stateMachineArn=state_machine_arn,
+                    input=execution_input,
+                    name=task_input.get("Name"),
+                )
+            except fakes.ClientError as error:
+                code = error.response["Error"]["Code"]
+                raise StatesError(f"StepFunctions.{code}Exception", str(error))
+            return {"ExecutionArn": response["executionArn"], "StartDate": str(response["startDate"])}
+
+        execution, _ = self.stepfunctions.create_execution(
+            state_machine_arn, execution_input, task_input.get("Name")
+        )
+        self._run_execution(execution)
+        if execution["status"] != "SUCCEEDED":
+            error, cause = execution["error"]
+            raise StatesError("States.TaskFailed", f"{error}: {cause}")
+        output = execution["output"]
+        return {
+            "ExecutionArn": execution["executionArn"],
+            "Status": execution["status"],
+            "Output": output if resource.endswith(":2") else json.dumps(output),
+        }
+
+    def _call_sdk(self, service, action, parameters):
+        client = self.clients[SDK_CLIENT_NAMES.get(service, service)]
+        try:
+            response = getattr(client, _snake_case(action))(**parameters)
+        except fakes.ClientError as error:
+            code = error.response["Error"]["Code"]
+            prefix = SDK_ERROR_PREFIXES.get(service, service.capitalize())
+            raise StatesError(f"{prefix}.{code}", str(error))
+        response = dict(response)
+        response.pop("ResponseMetadata", None)
+        return _json_safe(response)
+
+    # -- executions ----------------------------------------------------------
+
+    def _launch(self, execution):
+        self._executor.submit(self._run_execution, execution)
+
+    def _run_execution(self, execution):
+        machine = self._state_machines[execution["stateMachineArn"]]
+        try:
+            output = machine.execute(json.loads(execution["input"]), name=execution["name"])
+        except StatesError as error:
+            logging.warning(
+                f"Execution {execution['name']} failed with {error.error}: {error.cause}"
+            )
+            self.stepfunctions.finish_execution(
+                execution["executionArn"], "FAILED", error=(error.error, error.cause)
+            )
+        except Exception as error:
+            logging.exception(f"Execution {execution['name']} failed")
+            self.stepfunctions.finish_execution(
+                execution["executionArn"], "FAILED", error=(type(error).__name__, str(error))
+            )
+        else:
+            self.stepfunctions.finish_execution(execution["executionArn"], "SUCCEEDED", output=output)
+
+    # -- publishing ----------------------------------------------------------
+
+    def upload_manifests(self, manifests):
+        """
+        Uploads manifests, given as (key, manifest) pairs, and delivers their S3 events
+        the way the bucket's notification configuration does.
+
+        A Lambda destination receives one event with a record per manifest and its
+        response is returned; a queue destination gets one message per manifest.
+        """
+        bucket = self.parameters["ManifestBucket"]
+        records = []
+        self._uploading.active = True
+        try:
+            for key, manifest in manifests:
+                body = manifest if isinstance(manifest, (bytes, str)) else json.dumps(manifest)
+                response = self.s3.put_object(Body=body, Bucket=bucket, Key=key)
+                records.append(_s3_record(bucket, key, response["ETag"]))
+        finally:
+            self._uploading.active = False
+        return self._notify(bucket, records)
+
+    def _object_created(self, bucket, key, etag):
+        """
+        Delivers the S3 event of an object written by a function, e.g. a checkpoint in
+        the manifest bucket, so a key matching the notification filter starts a publish
+        like it would in the deployed stack. Lambda destinations are invoked
+        asynchronously, as S3 does.
+        """
+        if getattr(self._uploading, "active", False):
+            return
+        with self._invocation_lock:
+            self._polling["S3Notification"] += 1
+        record = _s3_record(bucket, key, etag)
+        self._executor.submit(self._deliver_notification, bucket, record)
+
+    def _deliver_notification(self, bucket, record):
+        try:
+            self._notify(bucket, [record])
+        except (Exception, SystemExit):
+            key = record["s3"]["object"]["key"]
+            logging.exception(f"Notification for s3://{bucket}/{key} failed")
+        finally:
+            with self._invocation_lock:
+                self._polling["S3Notification"] -= 1
+
+    def _notify(self, bucket, records):
+        notifications = self._bucket_notifications(bucket)
+        for queue in notifications.get("QueueConfigurations", []):
+            queue_id = queue["Queue"].rsplit(":", 1)[1]
+            for record in records:
+                if _matches_filter(queue, record):
+                    self.sqs.send_message(
+                        QueueUrl=self._ref(queue_id),
+                        MessageBody=json.dumps({"Records": [record]}),
+                    )
+        for function in notifications.get("LambdaConfigurations", []):
+            matching = [record for record in records if _matches_filter(function, record)]
+            if matching:
+                function_id = function["Function"].rsplit(":", 1)[1]
+                return self.invoke(function_id, {"Records": matching})
+        return None
+
+    def _bucket_notifications(self, bucket):
+        for logical_id, resource in self._resources("AWS::S3::Bucket").items():
+            if self._ref(logical_id) == bucket:
+                return self.resolve(resource["Properties"].get("NotificationConfiguration", {}))
+        return {}
+
+    def upload_manifest(self, manifest, key="manifests/local.json"):
+        """Uploads a manifest and delivers the S3 event the bucket notification would send"""
+        return self.upload_manifests([(key, manifest)])
+
+    def publish_manifests(self, manifests, timeout=None):
+        """Uploads manifests in one event, waits for every execution and returns a report"""
+        started = time.monotonic()
+        simulated_start = self.clock.now()
+        starter_response = self.upload_manifests(manifests)
+        if not self.wait_until_idle(timeout):
+            raise TimeoutError("Executions did not finish in time")
+        return self.report(
+            starter_response,
+            wall_seconds=time.monotonic() - started,
+            simulated_seconds=self.clock.now() - simulated_start,
+        )
+
+    def publish(self, manifest, key="manifests/local.json", timeout=None):
+        """Uploads a manifest, waits for every execution to finish and returns a report"""
+        return self.publish_manifests([(key, manifest)], timeout)
+
+    def report(self, starter_response=None, wall_seconds=None, simulated_seconds=None):
+        executions = list(self.stepfunctions.executions.values())
+        failed = [
+            {"name": e["name"], "error": e["error"]}
+            for e in executions
+            if e["status"] == "FAILED"
+        ]
+        return {
+            "StarterResponse": starter_response,
+            "WallSeconds": wall_seconds,
+            "SimulatedSeconds": simulated_seconds,
+            "Executions": Counter(e["status"] for e in executions),
+            "FailedExecutions": failed,
+            "StateTransitions": self.stats.state_transitions,
+            "MaxStatePayloadBytes": self.stats.max_payload_bytes,
+            "LambdaInvocations": dict(self.invocations),
+            "LambdaSeconds": {k: round(v, 3) for k, v in self.invocation_seconds.items()},
+            "S3BytesRead": self.s3.bytes_read,
+            "S3BytesWritten": self.s3.bytes_written,
+            "ApiCalls": {
+                "s3": dict(self.s3.counter.calls),
+                "dataexchange": dict(self.dataexchange.counter.calls),
+                "marketplace-catalog": dict(self.marketplace.counter.calls),
+                "stepfunctions": dict(self.stepfunctions.counter.calls),
+                "sqs": dict(self.sqs.counter.calls),
+            },
+            "Revisions": len(self.dataexchange.revisions),
+            "RevisionsFinalized": sum(
+                1 for revision in self.dataexchange.revisions.values() if revision["Finalized"]
+            ),
+            "ImportJobs": len(self.dataexchange.jobs),
+            "AssetsImported": self.dataexchange.imported_asset_count(),
+            "MetricsRequests": sum(
+                1 for request in self.http.requests if request["method"] == "POST"
+            ),
+            "Stages": self.stage_metrics(),
+        }
+
+    def stage_metrics(self):
+        """Summarizes the EMF records emitted so far by stage and metric"""
+        values_by_stage = {}
+        for record in self.metric_records:
+            stage_values = values_by_stage.setdefault(record["Stage"], {})
+            for directive in record["_aws"]["CloudWatchMetrics"]:
+                for metric in directive["Metrics"]:
+                    values = record[metric["Name"]]
+                    stage_values.setdefault(metric["Name"], []).extend(
+                        values if isinstance(values, list) else [values]
+                    )
+        return {
+            stage: {
+                name: {
+                    "Count": len(values),
+                    "Sum": round(sum(values), 3),
+                    "Mean": round(sum(values) / len(values), 3),
+                    "Max": round(max(values), 3),
+                }
+                for name, values in stage_values.items()
+            }
+            for stage, stage_values in values_by_stage.items()
+        }
+
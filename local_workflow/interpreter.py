@@ -0,0 +1,467 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+In-process interpreter for the subset of the Amazon States Language used by the
+solution's state machines.
+
+Task resources are dispatched to a ``ServiceResolver`` supplied by the harness, Wait
+states sleep on a scaled ``Clock``, and every state entered is counted so runs can be
+compared by state transitions as well as wall time.
+"""
+
+import copy
+import json
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Step Functions rejects state input/output larger than 256 KB
+MAX_PAYLOAD_BYTES = 256 * 1024
+# Used for Map states without a MaxConcurrency, which Step Functions runs up to 40 at a time
+DEFAULT_MAP_CONCURRENCY = 40
+
+
+class StatesError(Exception):
+    """A Step Functions error, matched by name against Retry and Catch rules"""
+
+    def __init__(self, error, cause=""):
+        super().__init__(f"{error}: {cause}")
+        self.error = error
+        self.cause = cause
+
+
+class Stats:
+    """Thread-safe counters collected while executions run"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state_transitions = 0
+        self.max_payload_bytes = 0
+        self.executions = 0
+
+    def add_transition(self, payload_bytes):
+        with self._lock:
+            self.state_transitions += 1
+            self.max_payload_bytes = max(self.max_payload_bytes, payload_bytes)
+
+    def add_execution(self):
+        with self._lock:
+            self.executions += 1
+
+
+# ---------------------------------------------------------------------------
+# Paths and intrinsic functions
+# ---------------------------------------------------------------------------
+
+_PATH_TOKEN = re.compile(r"\.([^.\[]+)|\[(\d+)\]")
+
+
+def _path_tokens(path):
+    if path.startswith("$$"):
+        path = path[2:]
+    elif path.startswith("$"):
+        path = path[1:]
+    else:
+        raise StatesError("States.Runtime", f"Invalid path {path!r}")
+    tokens = []
+    position = 0
+    while position < len(path):
+        match = _PATH_TOKEN.match(path, position)
+        if not match:
+            raise StatesError("States.Runtime", f"Unsupported path {path!r}")
+        tokens.append(match.group(1) if match.group(1) is not None else int(match.group(2)))
+        position = match.end()
+    return tokens
+
+
+_MISSING = object()
+
+
+def get_path(data, path, context, default=_MISSING):
+    """Resolves a reference path against the state data, or against the context for '$$'"""
+    value = context if path.startswith("$$") else data
+    for token in _path_tokens(path):
+        try:
+            value = value[token]
+        except (KeyError, IndexError, TypeError):
+            if default is not _MISSING:
+                return default
+            raise StatesError("States.Runtime", f"Path {path!r} not found in input")
+    return value
+
+
+def set_path(data, path, value):
+    """Returns a copy of ``data`` with ``value`` stored at a ResultPath"""
+    tokens = _path_tokens(path)
+    if not tokens:
+        return value
+    data = copy.deepcopy(data) if isinstance(data, dict) else {}
+    target = data
+    for token in tokens[:-1]:
+        if not isinstance(target.get(token), dict):
+            target[token] = {}
+        target = target[token]
+    target[tokens[-1]] = value
+    return data
+
+
+def _split_arguments(text):
+    arguments, depth, quoted, current = [], 0, False, ""
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if quoted:
+            current += char
+            if char == "\\":
+                current += text[index + 1]
+                index += 1
+            elif char == "'":
+                quoted = False
+        elif char == "'":
+            quoted = True
+            current += char
+        elif char == "(":
+            depth += 1
+            current += char
+        elif char == ")":
+            depth -= 1
+            current += char
+        elif char == "," and depth == 0:
+            arguments.append(current.strip())
+            current = ""
+        else:
+            current += char
+        index += 1
+    if current.strip():
+        arguments.append(current.strip())
+    return arguments
+
+
+def _evaluate_argument(argument, data, context):
+    if argument.startswith("'"):
+        return argument[1:-1].replace("\\'", "'")
+    if argument.startswith("$"):
+        return get_path(data, argument, context)
+    if argument.startswith("States."):
+        return evaluate_intrinsic(argument, data, context)
+    if argument == "null":
+        return None
+    if argument in ("true", "false"):
+        return argument == "true"
+    return json.loads(argument)
+
+
+def evaluate_intrinsic(expression, data, context):
+    """Evaluates the intrinsic functions used by the state machines"""
+    match = re.fullmatch(r"(States\.\w+)\((.*)\)", expression.strip(), re.S)
+    if not match:
+        raise StatesError("States.Runtime", f"Invalid intrinsic {expression!r}")
+    name = match.group(1)
+    arguments = [
+        _evaluate_argument(argument, data, context)
+        for argument in _split_arguments(match.group(2))
+    ]
+    if name == "States.Format":
+        template, values = arguments[0], iter(arguments[1:])
+        return re.sub(r"\{\}", lambda _: str(next(values)), template)
+    if name == "States.ArrayRange":
+        start, end, step = (int(argument) for argument in arguments)
+        values = list(range(start, end + (1 if step > 0 else -1), step))
+        if len(values) > 1000:
+            raise StatesError("States.Runtime", "States.ArrayRange is limited to 1000 items")
+        return values
+    if name == "States.ArrayGetItem":
+        return arguments[0][int(arguments[1])]
+    if name == "States.ArrayLength":
+        return len(arguments[0])
+    if name == "States.MathAdd":
+        return int(arguments[0]) + int(arguments[1])
+    if name == "States.JsonToString":
+        return json.dumps(arguments[0], separators=(",", ":"))
+    if name == "States.StringToJson":
+        return json.loads(arguments[0])
+    if name == "States.UUID":
+        return str(uuid.uuid4())
+    raise StatesError("States.Runtime", f"Unsupported intrinsic {name}")
+
+
+def resolve_parameters(template, data, context):
+    """Builds a Parameters/ItemSelector/ResultSelector payload"""
+    if isinstance(template, dict):
+        resolved = {}
+        for key, value in template.items():
+            if key.endswith(".$"):
+                if value.startswith("States."):
+                    resolved[key[:-2]] = evaluate_intrinsic(value, data, context)
+                else:
+                    resolved[key[:-2]] = copy.deepcopy(get_path(data, value, context))
+            else:
+                resolved[key] = resolve_parameters(value, data, context)
+        return resolved
+    if isinstance(template, list):
+        return [resolve_parameters(value, data, context) for value in template]
+    return template
+
+
+# ---------------------------------------------------------------------------
+# Choice rules
+# ---------------------------------------------------------------------------
+
+_COMPARATORS = {
+    "StringEquals": lambda a, b: isinstance(a, str) and a == b,
+    "NumericEquals": lambda a, b: _is_number(a) and a == b,
+    "NumericGreaterThan": lambda a, b: _is_number(a) and a > b,
+    "NumericGreaterThanEquals": lambda a, b: _is_number(a) and a >= b,
+    "NumericLessThan": lambda a, b: _is_number(a) and a < b,
+    "NumericLessThanEquals": lambda a, b: _is_number(a) and a <= b,
+    "BooleanEquals": lambda a, b: isinstance(a, bool) and a == b,
+}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def evaluate_rule(rule, data, context):
+    if "And" in rule:
+        return all(evaluate_rule(sub_rule, data, context) for sub_rule in rule["And"])
+    if "Or" in rule:
+        return any(evaluate_rule(sub_rule, data, context) for sub_rule in rule["Or"])
+    if "Not" in rule:
+        return not evaluate_rule(rule["Not"], data, context)
+
+    variable = rule["Variable"]
+    if "IsPresent" in rule:
+        absent = object()
+        present = get_path(data, variable, context, default=absent) is not absent
+        return present == rule["IsPresent"]
+    value = get_path(data, variable, context)
+    if "IsNull" in rule:
+        return (value is None) == rule["IsNull"]
+    for name, comparator in _COMPARATORS.items():
+        if name in rule:
+            return comparator(value, rule[name])
+        if f"{name}Path" in rule:
+            return comparator(value, get_path(data, rule[f"{name}Path"], context))
+    raise StatesError("States.Runtime", f"Unsupported choice rule {rule}")
+
+
+# ---------------------------------------------------------------------------
+# State machine
+# ---------------------------------------------------------------------------
+
+
+def _matches(error_equals, error):
+    if "States.ALL" in error_equals or error in error_equals:
+        return True
+    return "States.TaskFailed" in error_equals and error != "States.Timeout"
+
+
+class StateMachine:
+    """Runs one state machine definition (or a Map iterator) against a resolver"""
+
+    def __init__(self, definition, resolver, clock, stats, arn="arn:local:stateMachine"):
+        self.definition = definition
+        self.resolver = resolver
+        self.clock = clock
+        self.stats = stats
+        self.arn = arn
+
+    def execute(self, execution_input, name=None):
+        """Runs a full execution and returns its output"""
+        name = name or str(uuid.uuid4())
+        context = {
+            "Execution": {
+                "Id": f"{self.arn.replace(':stateMachine:', ':execution:')}:{name}",
+                "Name": name,
+                "Input": execution_input,
+                "StartTime": self.clock.now(),
+            },
+            "StateMachine": {"Id": self.arn},
+        }
+        self.stats.add_execution()
+        timeout = self.definition.get("TimeoutSeconds")
+        deadline = self.clock.now() + timeout if timeout else None
+        return self._run(self.definition, execution_input, context, deadline)
+
+    def _run(self, definition, data, context, deadline):
+        state_name = definition["StartAt"]
+        while True:
+            if deadline is not None and self.clock.now() > deadline:
+                raise StatesError("States.Timeout", "Execution timed out")
+            state = definition["States"][state_name]
+            payload = json.dumps(data)
+            if len(payload) > MAX_PAYLOAD_BYTES:
+                raise StatesError(
+                    "States.DataLimitExceeded",
+                    f"Input of state {state_name!r} is {len(payload)} bytes",
+                )
+            self.stats.add_transition(len(payload))
+            state_context = dict(context, State={"Name": state_name})
+
+            state_type = state["Type"]
+            if state_type == "Choice":
+                state_name = self._choose(state, data, state_context)
+                continue
+            if state_type == "Succeed":
+                return data
+            if state_type == "Fail":
+                raise StatesError(state.get("Error", "States.Fail"), state.get("Cause", ""))
+
+            try:
+                data = self._run_state(state, data, state_context, deadline)
+            except StatesError as error:
+                catcher = next(
+                    (
+                        catcher
+                        for catcher in state.get("Catch", [])
+                        if _matches(catcher["ErrorEquals"], error.error)
+                    ),
+                    None,
+                )
+                if catcher is None:
+                    raise
+                error_output = {"Error": error.error, "Cause": error.cause}
+                result_path = catcher.get("ResultPath", "$")
+                if result_path is not None:
+                    data = set_path(data, result_path, error_output)
+                state_name = catcher["Next"]
+                continue
+
+            if state.get("End"):
+                return data
+            state_name = state["Next"]
+
+    def _choose(self, state, data, context):
+        for rule in state["Choices"]:
+            if evaluate_rule(rule, data, context):
+                return rule["Next"]
+        if "Default" in state:
+            return state["Default"]
+        raise StatesError("States.NoChoiceMatched", "No choice rule matched")
+
+    def _run_state(self, state, data, context, deadline):
+        state_input = data
+        if "InputPath" in state:
+            state_input = (
+                {} if state["InputPath"] is None else get_path(data, state["InputPath"], context)
+            )
+
+        state_type = state["Type"]
+        if state_type == "Pass":
+            if "Parameters" in state:
+                result = resolve_parameters(state["Parameters"], state_input, context)
+            else:
+                result = state.get("Result", state_input)
+        elif state_type == "Wait":
+            if "SecondsPath" in state:
+                seconds = get_path(state_input, state["SecondsPath"], context)
+            else:
+                seconds = state["Seconds"]
+            self.clock.sleep(seconds)
+            result = state_input
+        elif state_type == "Task":
+            result = self._run_task(state, state_input, context)
+        elif state_type == "Map":
+            result = self._run_map(state, state_input, context, deadline)
+        else:
+            raise StatesError("States.Runtime", f"Unsupported state type {state_type}")
+
+        if state_type in ("Task", "Map") and "ResultSelector" in state:
+            result = resolve_parameters(state["ResultSelector"], result, context)
+
+        result_path = state.get("ResultPath", "$")
+        if result_path is None:
+            output = data
+        else:
+            output = set_path(data, result_path, result)
+        if state.get("OutputPath"):
+            output = get_path(output, state["OutputPath"], context)
+        return json.loads(json.dumps(output))
+
+    def _run_task(self, state, state_input, context):
+        retriers = state.get("Retry", [])
+        attempts = [0] * len(retriers)
+        while True:
+            task_context = dict(context)
+            if state["Resource"].endswith(".waitForTaskToken"):
+                task_context["Task"] = {"Token": str(uuid.uuid4())}
+            if "Parameters" in state:
+                task_input = resolve_parameters(state["Parameters"], state_input, task_context)
+            else:
+                task_input = state_input
+            try:
+                return self.resolver.run_task(
+                    state["Resource"],
+                    task_input,
+                    task_context,
+                    timeout=state.get("TimeoutSeconds"),
+                )
+            except StatesError as error:
+                retry_index = next(
+                    (
+                        index
+                        for index, retrier in enumerate(retriers)
+                        if _matches(retrier["ErrorEquals"], error.error)
+                    ),
+                    None,
+                )
+                if retry_index is None:
+                    raise
+                retrier = retriers[retry_index]
+                if attempts[retry_index] >= retrier.get("MaxAttempts", 3):
+                    raise
+                delay = retrier.get("IntervalSeconds", 1) * retrier.get(
+                    "BackoffRate", 2.0
+                ) ** attempts[retry_index]
+                if "MaxDelaySeconds" in retrier:
+                    delay = min(delay, retrier["MaxDelaySeconds"])
+                attempts[retry_index] += 1
+                self.clock.sleep(delay)
+
+    def _run_map(self, state, state_input, context, deadline):
+        items = get_path(state_input, state.get("ItemsPath", "$"), context)
+        selector = state.get("ItemSelector", state.get("Parameters"))
+        iterator = state.get("ItemProcessor", state.get("Iterator"))
+        max_concurrency = state.get("MaxConcurrency", 0) or DEFAULT_MAP_CONCURRENCY
+        failed = threading.Event()
+
+        def run_item(index_and_item):
+            index, item = index_and_item
+            if failed.is_set():
+                raise StatesError("States.Runtime", "Map state cancelled")
+            item_context = dict(context, Map={"Item": {"Index": index, "Value": item}})
+            item_input = (
+                resolve_parameters(selector, state_input, item_context)
+                if selector is not None
+                else item
+            )
+            try:
+                return self._run(iterator, item_input, item_context, deadline)
+            except Exception:
+                failed.set()
+                raise
+
+        if max_concurrency == 1:
+            return [run_item(index_and_item) for index_and_item in enumerate(items)]
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            return list(executor.map(run_item, enumerate(items)))
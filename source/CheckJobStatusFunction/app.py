@@ -22,33 +22,116 @@ import logging
 import os
 from datetime import datetime
 
-import boto3
+from adx_coordinator import checkpoint, emf, jobs, ratelimit, runtime
+
+
+def check_revision_jobs(dataexchange, s3, event):
+    """
+    Checks every in-flight import job of a revision in one call, starts queued jobs as
+    slots free up, and returns aggregate job counts for the revision.
+    """
+    bucket = event["Bucket"]
+    key = event["Key"]
+    revision_index = event["RevisionMapIndex"]
+    product_id = event["ProductId"]
+    dataset_id = event["DatasetId"]
+    revision_id = event["RevisionId"]
+    revision_jobs = event["Jobs"]
+    max_concurrent_jobs = int(
+        os.getenv("MAX_CONCURRENT_JOBS", str(jobs.MAX_CONCURRENT_JOBS))
+    )
+
+    stage = emf.Stage("CheckRevisionJobs", product_id, dataset_id)
+    api_counters = ratelimit.counters()
+    checked_jobs = jobs.refresh_job_states(dataexchange, revision_jobs)
+    num_checked = len(checked_jobs)
+    for job, job_response in checked_jobs:
+        if job["State"] == "COMPLETED":
+            checkpoint.mark_job_completed(
+                s3, bucket, key, revision_index, job["JobMapIndex"]
+            )
+        if jobs.is_terminal(job["State"]):
+            stage.put(
+                "JobQueueToCompleteSeconds",
+                jobs.queue_to_complete_seconds(job_response),
+                emf.UNIT_SECONDS,
+            )
+    num_started = jobs.start_queued_jobs(dataexchange, revision_jobs, max_concurrent_jobs)
+    summary = jobs.summarize_jobs(revision_jobs, previous=event)
+
+    # Newly started jobs restart the backoff so they are checked promptly
+    poll_attempt = 0 if num_started else event.get("PollAttempt", 0) + 1
+
+    stage.set_property("RevisionId", revision_id)
+    stage.put("JobsChecked", num_checked)
+    stage.put("ThrottleCount", ratelimit.counters_since(api_counters)["ThrottleCount"])
+    stage.emit()
+
+    metrics = {
+        "Version": os.getenv("Version"),
+        "TimeStamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f"),
+        "ProductId": product_id,
+        "DatasetId": dataset_id,
+        "RevisionId": revision_id,
+        "JobsChecked": num_checked,
+        "JobsStarted": num_started,
+        **summary,
+        **ratelimit.counters_since(api_counters),
+    }
+    logging.info(f"Metrics:{metrics}")
+
+    return {
+        "StatusCode": 200,
+        "Bucket": bucket,
+        "Key": key,
+        "ProductId": product_id,
+        "DatasetId": dataset_id,
+        "RevisionId": revision_id,
+        "RevisionMapIndex": revision_index,
+        "Jobs": jobs.unfinished_jobs(revision_jobs),
+        **summary,
+        "PollAttempt": poll_attempt,
+        "WaitSeconds": jobs.revision_poll_wait_seconds(revision_jobs, poll_attempt),
+    }
 
 
 def lambda_handler(event, context):
     """This function checks and returns the import assets job status"""
     try:
-        global log_level
-        log_level = str(os.environ.get("LOG_LEVEL")).upper()
-        valid_log_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
-        if log_level not in valid_log_levels:
-            log_level = "ERROR"
+        logging.debug(runtime.lazy(lambda: f"{event=}"))
 
-        logging.getLogger().setLevel(log_level)
+        dataexchange = runtime.client("dataexchange")
+        s3 = runtime.client("s3")
 
-        logging.debug(f"{event=}")
-
-        dataexchange = boto3.client(service_name="dataexchange")
+        if "Jobs" in event:
+            return check_revision_jobs(dataexchange, s3, event)
 
+        bucket = event["Bucket"]
+        key = event["Key"]
+        revision_index = event["RevisionMapIndex"]
+        job_index = event["JobMapIndex"]
         product_id = event["ProductId"]
         dataset_id = event["DatasetId"]
         revision_id = event["RevisionId"]
         job_id = event["JobId"]
+        job_asset_count = event.get("JobAssetCount", 0)
+        poll_attempt = event.get("PollAttempt", 0) + 1
 
-        job_response = dataexchange.get_job(JobId=job_id)
-        logging.debug(f"get job = {job_response}")
+        stage = emf.Stage("CheckJobStatus", product_id, dataset_id)
+        api_counters = ratelimit.counters()
+        job_response = ratelimit.call(dataexchange.get_job, JobId=job_id)
+        logging.debug(runtime.lazy(lambda: f"get job = {job_response}"))
 
         job_status = job_response["State"]
+        if job_status == "COMPLETED":
+            checkpoint.mark_job_completed(s3, bucket, key, revision_index, job_index)
+        if jobs.is_terminal(job_status):
+            stage.put(
+                "JobQueueToCompleteSeconds",
+                jobs.queue_to_complete_seconds(job_response),
+                emf.UNIT_SECONDS,
+            )
+        wait_seconds = jobs.poll_wait_seconds(job_asset_count, poll_attempt)
 
         metrics = {
             "Version": os.getenv("Version"),
@@ -58,18 +141,31 @@ def lambda_handler(event, context):
             "RevisionId": revision_id,
             "JobId": job_id,
             "JobStatus": job_status,
+            "PollAttempt": poll_attempt,
+            **ratelimit.counters_since(api_counters),
         }
         logging.info(f"Metrics:{metrics}")
 
+        stage.set_property("JobId", job_id)
+        stage.set_property("JobStatus", job_status)
+        stage.emit()
+
     except Exception as e:
         logging.error(e)
         raise e
 
     return {
         "StatusCode": 200,
+        "Bucket": bucket,
+        "Key": key,
         "ProductId": product_id,
         "DatasetId": dataset_id,
         "RevisionId": revision_id,
+        "RevisionMapIndex": revision_index,
+        "JobMapIndex": job_index,
         "JobId": job_id,
         "JobStatus": job_status,
+        "JobAssetCount": job_asset_count,
+        "PollAttempt": poll_attempt,
+        "WaitSeconds": wait_seconds,
     }
@@ -18,13 +18,152 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 ##############################################################################
 
-import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-import boto3
-import urllib3
+from botocore.exceptions import ClientError
+
+from adx_coordinator import checkpoint, emf, jobs, manifest, ratelimit, runtime
+
+# States of a checkpointed job that let a resumed execution keep using it
+RESUMABLE_JOB_STATES = ("WAITING", "IN_PROGRESS", "COMPLETED")
+
+
+def resume_job(dataexchange, s3, bucket, key, revision_index, job_index):
+    """
+    Returns the job an earlier execution created for this job index, or None when there
+    is none or it failed, in which case a new job has to be created.
+    """
+    record = checkpoint.load_job(s3, bucket, key, revision_index, job_index)
+    if record is None:
+        return None
+    job_id = record["JobId"]
+    try:
+        job_state = ratelimit.call(dataexchange.get_job, JobId=job_id)["State"]
+    except ClientError as error:
+        if error.response["Error"]["Code"] != "ResourceNotFoundException":
+            raise
+        job_state = None
+    if job_state not in RESUMABLE_JOB_STATES:
+        logging.info(f"Checkpointed {job_id=} ended with {job_state=}, creating a new job")
+        return None
+
+    logging.info(f"Resuming with checkpointed {job_id=} in {job_state=}")
+    if job_state == "COMPLETED":
+        checkpoint.mark_job_completed(s3, bucket, key, revision_index, job_index)
+    return {
+        "JobId": job_id,
+        "JobMapIndex": job_index,
+        "JobAssetCount": record["JobAssetCount"],
+        "State": job_state,
+        "Started": job_state != "WAITING",
+    }
+
+
+def create_job(
+    dataexchange, s3, bucket, key, dataset_id, revision_id, revision_index, job_index
+):
+    """Creates the import job of a job index and records it in the checkpoint"""
+    job_assets = manifest.read_job_assets(s3, bucket, key, revision_index, job_index)
+    logging.debug(
+        runtime.lazy(lambda: f"Job Assets from manifest file: {job_assets=}")
+    )
+    logging.info(f"Total Job Assets: {len(job_assets)}")
+    job_id = jobs.create_import_job(dataexchange, dataset_id, revision_id, job_assets)
+    checkpoint.save_job(
+        s3, bucket, key, revision_index, job_index, job_id, len(job_assets)
+    )
+    return {
+        "JobId": job_id,
+        "JobMapIndex": job_index,
+        "JobAssetCount": len(job_assets),
+        "State": "WAITING",
+        "Started": False,
+    }
+
+
+def create_and_start_revision_jobs(dataexchange, s3, event):
+    """
+    Creates every import job of a revision and starts as many as ADX runs concurrently.
+
+    The remaining jobs are started by CheckJobStatusFunction as running jobs finish.
+    Only the jobs in JobMapInput are handled, and jobs checkpointed by an earlier
+    execution are reused rather than created again.
+    """
+    bucket = event["Bucket"]
+    key = event["Key"]
+    product_id = event["ProductId"]
+    dataset_id = event["DatasetId"]
+    revision_id = event["RevisionId"]
+    revision_index = event["RevisionMapIndex"]
+    num_jobs = event["NumJobs"]
+    job_indexes = event.get("JobMapInput", range(num_jobs))
+    max_concurrent_jobs = int(
+        os.getenv("MAX_CONCURRENT_JOBS", str(jobs.MAX_CONCURRENT_JOBS))
+    )
+
+    logging.info(
+        f"Creating {len(job_indexes)} of {num_jobs} import jobs for {revision_id=}"
+    )
+    stage = emf.Stage("CreateRevisionImportJobs", product_id, dataset_id)
+    api_counters = ratelimit.counters()
+
+    def resume_or_create_job(job_index):
+        job = resume_job(dataexchange, s3, bucket, key, revision_index, job_index)
+        if job is None:
+            job = create_job(
+                dataexchange,
+                s3,
+                bucket,
+                key,
+                dataset_id,
+                revision_id,
+                revision_index,
+                job_index,
+            )
+        return job
+
+    with ThreadPoolExecutor(max_workers=jobs.MAX_CONCURRENT_JOBS) as executor:
+        revision_jobs = list(executor.map(resume_or_create_job, job_indexes))
+
+    jobs.start_queued_jobs(dataexchange, revision_jobs, max_concurrent_jobs)
+    summary = jobs.summarize_jobs(revision_jobs)
+
+    metrics = {
+        "Version": os.getenv("Version"),
+        "TimeStamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f"),
+        "ProductId": product_id,
+        "DatasetId": dataset_id,
+        "RevisionId": revision_id,
+        "RevisionMapIndex": revision_index,
+        "RevisionJobCount": num_jobs,
+        **summary,
+        **ratelimit.counters_since(api_counters),
+    }
+    logging.info(f"Metrics:{metrics}")
+
+    stage.set_property("RevisionId", revision_id)
+    for job in revision_jobs:
+        stage.put("AssetsPerJob", job["JobAssetCount"])
+    stage.put("ThrottleCount", ratelimit.counters_since(api_counters)["ThrottleCount"])
+    stage.emit()
+
+    return {
+        "StatusCode": 200,
+        "Message": f"{len(revision_jobs)} import jobs created for RevisionId: {revision_id} and {summary['JobsInProgress']} started",
+        "Bucket": bucket,
+        "Key": key,
+        "ProductId": product_id,
+        "DatasetId": dataset_id,
+        "RevisionId": revision_id,
+        "RevisionMapIndex": revision_index,
+        "Jobs": jobs.unfinished_jobs(revision_jobs),
+        **summary,
+        "PollAttempt": 0,
+        "WaitSeconds": jobs.revision_poll_wait_seconds(revision_jobs, 0),
+    }
 
 
 def lambda_handler(event, context):
@@ -33,17 +172,16 @@ def lambda_handler(event, context):
     and starts the job to add it to AWS Data Exchange
     """
     try:
-        global log_level
-        log_level = str(os.getenv("LOG_LEVEL")).upper()
-        valid_log_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
-        if log_level not in valid_log_levels:
-            log_level = "ERROR"
+        logging.debug(runtime.lazy(lambda: f"{event=}"))
 
-        logging.getLogger().setLevel(log_level)
+        dataexchange = runtime.client("dataexchange")
+        s3 = runtime.client("s3")
 
-        logging.debug(f"{event=}")
+        if "JobMapIndex" not in event:
+            return create_and_start_revision_jobs(dataexchange, s3, event)
 
-        dataexchange = boto3.client(service_name="dataexchange")
+        stage = emf.Stage("CreateImportJob", event["ProductId"], event["DatasetId"])
+        api_counters = ratelimit.counters()
 
         bucket = event["Bucket"]
         key = event["Key"]
@@ -57,39 +195,54 @@ def lambda_handler(event, context):
             f"{bucket=}\n{key=}\n{product_id=}\n{dataset_id=}\n{revision_index=}\n{job_index=}"
         )
         logging.info("Creating and starting and import job")
-        s3 = boto3.client("s3")
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        manifest_dict = json.loads(obj["Body"].read())
-        job_assets = manifest_dict["asset_list_nested"][revision_index][job_index]
-        num_job_assets = len(job_assets)
-
-        logging.debug(f"Job Assets from manifest file: {job_assets=}")
-        logging.info(f"Total Job Assets: {num_job_assets}")
-
-        revision_details = {
-            "ImportAssetsFromS3": {
-                "AssetSources": job_assets,
-                "DataSetId": dataset_id,
-                "RevisionId": revision_id,
-            }
-        }
-        logging.debug(f"{revision_details=}")
-
-        create_job_response = dataexchange.create_job(
-            Type="IMPORT_ASSETS_FROM_S3", Details=revision_details
+        job = resume_job(dataexchange, s3, bucket, key, revision_index, job_index)
+        if job is None:
+            job = create_job(
+                dataexchange,
+                s3,
+                bucket,
+                key,
+                dataset_id,
+                revision_id,
+                revision_index,
+                job_index,
+            )
+        job_id = job["JobId"]
+        num_job_assets = job["JobAssetCount"]
+        job_status = job["State"]
+        job_started = job["Started"]
+        service_integration = os.getenv(
+            "JOB_SERVICE_INTEGRATION", jobs.SERVICE_INTEGRATION_LAMBDA
         )
-        job_arn = create_job_response["Arn"]
-        job_id = job_arn.split("/")[1]
 
         logging.info(f"{job_id=}")
 
-        start_job_response = dataexchange.start_job(JobId=job_id)
-        http_response = start_job_response["ResponseMetadata"]["HTTPStatusCode"]
-        logging.debug(f"HTTPResponse={http_response}")
+        # With START_AND_GET_JOB the state machine starts the job itself
+        if (
+            not job_started
+            and service_integration != jobs.SERVICE_INTEGRATION_START_AND_GET_JOB
+        ):
+            start_job_response = ratelimit.call(dataexchange.start_job, JobId=job_id)
+            http_response = start_job_response["ResponseMetadata"]["HTTPStatusCode"]
+            logging.debug(f"HTTPResponse={http_response}")
 
-        get_job_response = dataexchange.get_job(JobId=job_id)
-        logging.debug(f"get job = {get_job_response}")
-        job_status = get_job_response["State"]
+            get_job_response = ratelimit.call(dataexchange.get_job, JobId=job_id)
+            logging.debug(runtime.lazy(lambda: f"get job = {get_job_response}"))
+            job_status = get_job_response["State"]
+            job_started = True
+
+        completion_mode = os.getenv("JOB_COMPLETION_MODE", jobs.COMPLETION_MODE_POLL)
+        wait_seconds = jobs.poll_wait_seconds(num_job_assets, 0)
+        status_integration = {
+            "JobStarted": job_started,
+            "JobServiceIntegration": service_integration,
+        }
+        if service_integration != jobs.SERVICE_INTEGRATION_LAMBDA:
+            # Fields the state machine polls and records completion with
+            status_integration.update(
+                Poll=jobs.poll_schedule(num_job_assets),
+                CompletedMarkerKey=checkpoint.completed_key(key, revision_index, job_index),
+            )
 
         metrics = {
             "Version": os.getenv("Version"),
@@ -100,29 +253,15 @@ def lambda_handler(event, context):
             "JobId": job_id,
             "RevisionMapIndex": revision_index,
             "JobMapIndex": job_index,
+            **ratelimit.counters_since(api_counters),
         }
         logging.info(f"Metrics:{metrics}")
 
-        send_metrics = os.environ.get("AnonymousUsage")
-        logging.info(f"!! {send_metrics=} !!")
-
-        if send_metrics == "Yes":
-            logging.info("Sending anonymous metrics...")
-            metric_data = {
-                "Version": os.environ.get("Version"),
-                "AssetCount": num_job_assets,
-            }
-            solution_data = {
-                "Solution": os.environ.get("SolutionId"),
-                "UUID": os.environ.get("UUID"),
-                "TimeStamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f"),
-                "Data": metric_data,
-            }
-            http = urllib3.PoolManager()
-            metric_url = "https://metrics.awssolutionsbuilder.com/generic"
-            encoded_data = json.dumps(solution_data).encode("utf-8")
-            headers = {"Content-Type": "application/json"}
-            http.request("POST", metric_url, body=encoded_data, headers=headers)
+        stage.set_property("RevisionId", revision_id)
+        stage.set_property("JobId", job_id)
+        stage.put("AssetsPerJob", num_job_assets)
+        stage.put("ThrottleCount", ratelimit.counters_since(api_counters)["ThrottleCount"])
+        stage.emit()
 
     except Exception as e:
         logging.error(e)
@@ -131,6 +270,8 @@ def lambda_handler(event, context):
     return {
         "StatusCode": 200,
         "Message": f"New import job created for RevisionId: {revision_id} JobId: {job_id} and started for {num_job_assets} assets",
+        "Bucket": bucket,
+        "Key": key,
         "ProductId": product_id,
         "DatasetId": dataset_id,
         "RevisionId": revision_id,
@@ -139,4 +280,8 @@ def lambda_handler(event, context):
         "JobId": job_id,
         "JobStatus": job_status,
         "JobAssetCount": num_job_assets,
+        "CompletionMode": completion_mode,
+        "PollAttempt": 0,
+        "WaitSeconds": wait_seconds,
+        **status_integration,
     }
@@ -18,37 +18,51 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 ##############################################################################
 
-import json
 import logging
 import os
 from datetime import datetime
 
-import boto3
+from botocore.exceptions import ClientError
 
+from adx_coordinator import checkpoint, emf, jobs, manifest, runtime
 
-def lambda_handler(event, context):
+
+def resume_revision(dataexchange, s3, bucket, key, dataset_id, revision_index):
     """
-    This function creates a new revision for the dataset and prepares input for the import job map
+    Returns the revision an earlier execution created for this revision index, and
+    whether it is already finalized, or (None, False) when there is none to reuse.
     """
+    revision_id = checkpoint.load_revision_id(s3, bucket, key, revision_index)
+    if revision_id is None:
+        return None, False
     try:
-        global log_level
-        log_level = str(os.getenv("LOG_LEVEL")).upper()
-        valid_log_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
-        if log_level not in valid_log_levels:
-            log_level = "ERROR"
+        revision = dataexchange.get_revision(
+            DataSetId=dataset_id, RevisionId=revision_id
+        )
+    except ClientError as error:
+        if error.response["Error"]["Code"] != "ResourceNotFoundException":
+            raise
+        logging.info(f"Checkpointed {revision_id=} no longer exists, creating a new revision")
+        return None, False
+    return revision_id, revision["Finalized"]
 
-        logging.getLogger().setLevel(log_level)
 
-        logging.debug(f"{event=}")
+def lambda_handler(event, context):
+    """
+    This function creates a new revision for the dataset and prepares input for the import job map
+    """
+    try:
+        logging.debug(runtime.lazy(lambda: f"{event=}"))
 
-        dataexchange = boto3.client(service_name="dataexchange")
-        s3 = boto3.client(service_name="s3")
+        dataexchange = runtime.client("dataexchange")
+        s3 = runtime.client("s3")
 
         bucket = event["Bucket"]
         key = event["Key"]
         product_id = event["ProductId"]
         dataset_id = event["DatasetId"]
         revision_index = event["RevisionMapIndex"]
+        stage = emf.Stage("CreateRevision", product_id, dataset_id)
 
         logging.debug(
             f"{bucket=}\n{key=}\n{product_id=}\n{dataset_id=}\n{revision_index=}"
@@ -56,32 +70,49 @@ def lambda_handler(event, context):
         logging.info(
             f"Creating the input list to create a dataset revision with {revision_index=}"
         )
-        s3 = boto3.client("s3")
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        manifest_dict = json.loads(obj["Body"].read())
-        num_jobs = len(manifest_dict["asset_list_nested"][revision_index])
-        job_map_input_list = list(range(num_jobs))
+        if "NumJobs" in event:
+            # The publish plan carries the counts, the index is not read again
+            num_jobs = event["NumJobs"]
+            num_revision_assets = event["NumRevisionAssets"]
+            comment = event.get("Comment")
+        else:
+            manifest_dict = manifest.read_index(s3, bucket, key)
+            job_asset_counts = manifest.job_asset_counts(manifest_dict, revision_index)
+            num_jobs = len(job_asset_counts)
+            num_revision_assets = sum(job_asset_counts)
+            comment = manifest_dict.get("comment")
 
         # Get comment from manifest if exists
         default_comment = "Published by data platform/publish-adx."
-        if "comment" in manifest_dict:
-            comment = manifest_dict["comment"]
+        if comment:
             logging.info(f"Retrieved comment {comment=}")
         else:
             logging.info(f"Using default comment {default_comment=}")
             comment = default_comment
 
-        num_revision_assets = 0
-        for job_index in range(num_jobs):
-            num_job_assets = len(
-                manifest_dict["asset_list_nested"][revision_index][job_index]
-            )
-            num_revision_assets += num_job_assets
-
         logging.debug(f"{dataset_id=}")
-        revision = dataexchange.create_revision(DataSetId=dataset_id, Comment=comment)
-        revision_id = revision["Id"]
+        revision_id, revision_finalized = resume_revision(
+            dataexchange, s3, bucket, key, dataset_id, revision_index
+        )
+        if revision_id is None:
+            revision = dataexchange.create_revision(
+                DataSetId=dataset_id, Comment=comment
+            )
+            revision_id = revision["Id"]
+            checkpoint.save_revision(s3, bucket, key, revision_index, revision_id)
+            completed_jobs = set()
+        elif revision_finalized:
+            logging.info(f"Resuming with {revision_id=}, which is already finalized")
+            completed_jobs = set(range(num_jobs))
+        else:
+            completed_jobs = checkpoint.completed_jobs(s3, bucket, key, revision_index)
+            logging.info(
+                f"Resuming with open {revision_id=}, {len(completed_jobs)} of {num_jobs} jobs completed"
+            )
         logging.info(f"{revision_id=}")
+        job_map_input_list = [
+            job_index for job_index in range(num_jobs) if job_index not in completed_jobs
+        ]
 
         metrics = {
             "Version": os.getenv("Version"),
@@ -92,10 +123,18 @@ def lambda_handler(event, context):
             "RevisionMapIndex": revision_index,
             "RevisionAssetCount": num_revision_assets,
             "RevisionJobCount": num_jobs,
-            "JobMapInput": job_map_input_list,
+            "RevisionJobsCompleted": len(completed_jobs),
+            "RevisionFinalized": revision_finalized,
+            "JobMapInputCount": len(job_map_input_list),
         }
         logging.info(f"Metrics:{metrics}")
 
+        stage.set_property("RevisionId", revision_id)
+        stage.put("RevisionAssetCount", num_revision_assets)
+        stage.put("RevisionJobCount", num_jobs)
+        stage.put("RevisionJobsCompleted", len(completed_jobs))
+        stage.emit()
+
     except Exception as e:
         logging.error(e)
         raise e
@@ -109,7 +148,13 @@ def lambda_handler(event, context):
         "DatasetId": dataset_id,
         "RevisionId": revision_id,
         "RevisionMapIndex": revision_index,
+        "RevisionFinalized": revision_finalized,
+        "PublishId": event.get("PublishId"),
+        "RevisionCount": event.get("RevisionCount"),
         "NumJobs": num_jobs,
         "NumRevisionAssets": num_revision_assets,
         "JobMapInput": job_map_input_list,
+        "JobOrchestration": os.getenv(
+            "JOB_ORCHESTRATION", jobs.ORCHESTRATION_PER_JOB
+        ),
     }
@@ -22,43 +22,98 @@ import logging
 import os
 from datetime import datetime
 
-import boto3
-from botocore.config import Config
+from adx_coordinator import delta, emf, manifest, progress, runtime, telemetry
+
+
+class RevisionNotReady(Exception):
+    """Raised while the previous revision of the manifest has not been finalized yet"""
+
+
+def record_progress(s3, event):
+    """Counts the revision as finalized in the progress record of its publish"""
+    publish_id = event.get("PublishId")
+    if not publish_id:
+        return
+    revisions_finalized = event["RevisionMapIndex"] + 1
+    fields = {
+        "RevisionsFinalized": revisions_finalized,
+        "LastRevisionId": event["RevisionId"],
+    }
+    if revisions_finalized == event.get("RevisionCount"):
+        fields["Status"] = progress.STATUS_SUCCEEDED
+    progress.update_progress(s3, event["Bucket"], publish_id, **fields)
 
 
 def lambda_handler(event, context):
     """This job finalizes the current revision and adds it to ADX product"""
     try:
-        global log_level
-        log_level = str(os.environ.get("LOG_LEVEL")).upper()
-        valid_log_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
-        if log_level not in valid_log_levels:
-            log_level = "ERROR"
-
-        logging.getLogger().setLevel(log_level)
-
-        logging.debug(f"{event=}")
+        logging.debug(runtime.lazy(lambda: f"{event=}"))
 
         product_id = event["ProductId"]
         dataset_id = event["DatasetId"]
         revision_id = event["RevisionId"]
         revision_index = event["RevisionMapIndex"]
-
-        dataexchange = boto3.client(service_name="dataexchange")
-
-        finalize_response = dataexchange.update_revision(
-            RevisionId=revision_id, DataSetId=dataset_id, Finalized=True
-        )
-        marketplace_config = Config(region_name="us-east-1")
-        marketplace = boto3.client(
-            service_name="marketplace-catalog", config=marketplace_config
-        )
-        logging.debug(f"{finalize_response=}")
+        bucket = event["Bucket"]
+        key = event["Key"]
+        stage = emf.Stage("FinalizeRevision", product_id, dataset_id)
+
+        # Revisions may be imported concurrently but are finalized in manifest order;
+        # the state machine retries this step until the previous revision is finalized
+        s3 = runtime.client("s3")
+        if revision_index > 0 and not manifest.is_revision_finalized(
+            s3, bucket, key, revision_index - 1
+        ):
+            raise RevisionNotReady(
+                f"Waiting for revision {revision_index - 1} to be finalized before {revision_index=}"
+            )
+
+        # A resumed execution passes through revisions an earlier execution finalized
+        if manifest.is_revision_finalized(s3, bucket, key, revision_index):
+            logging.info(f"{revision_id=} was finalized by an earlier execution")
+            record_progress(s3, event)
+            return {
+                "StatusCode": 200,
+                "Message": "Revision already finalized",
+                "ProductId": product_id,
+                "DatasetId": dataset_id,
+                "RevisionId": revision_id,
+                "RevisionMapIndex": revision_index,
+            }
+
+        dataexchange = runtime.client("dataexchange")
+
+        if event.get("RevisionFinalized"):
+            finalize_response = dataexchange.get_revision(
+                RevisionId=revision_id, DataSetId=dataset_id
+            )
+        else:
+            finalize_response = dataexchange.update_revision(
+                RevisionId=revision_id, DataSetId=dataset_id, Finalized=True
+            )
+        marketplace = runtime.client("marketplace-catalog")
+        logging.debug(runtime.lazy(lambda: f"{finalize_response=}"))
+        if os.environ.get("DELTA_PUBLISHING", "No") == "Yes":
+            delta.commit_revision(s3, bucket, key, revision_index, dataset_id, revision_id)
+        # Progress is recorded before the marker that lets the next revision finalize
+        record_progress(s3, event)
+        manifest.mark_revision_finalized(s3, bucket, key, revision_index, revision_id)
+        # Sent once per revision, after the marker so a retried step does not send again.
+        # It overlaps the catalog lookup below and is flushed, with the send's timeout as
+        # the bound, before the handler returns and the environment is frozen
+        if telemetry.enabled():
+            telemetry.send_in_background(
+                telemetry.solution_data(
+                    {
+                        "Version": os.environ.get("Version"),
+                        "AssetCount": event.get("NumRevisionAssets", 0),
+                    }
+                )
+            )
 
         product_details = marketplace.describe_entity(
             EntityId=product_id, Catalog="AWSMarketplace"
         )
-        logging.debug(f"describe_entity={product_details}")
+        logging.debug(runtime.lazy(lambda: f"describe_entity={product_details}"))
 
         entity_id = product_details["EntityIdentifier"]
         revision_arns = finalize_response["Arn"]
@@ -111,9 +166,27 @@ def lambda_handler(event, context):
         }
         logging.info(f"Metrics:{metrics}")
 
+        # Throughput over the revision's lifetime, from its creation to its finalization
+        revision_seconds = (
+            finalize_response["UpdatedAt"] - finalize_response["CreatedAt"]
+        ).total_seconds()
+        revision_asset_count = event.get("NumRevisionAssets", 0)
+        stage.set_property("RevisionId", revision_id)
+        stage.put("RevisionSeconds", revision_seconds, emf.UNIT_SECONDS)
+        stage.put("RevisionAssetCount", revision_asset_count)
+        if revision_seconds > 0:
+            stage.put(
+                "RevisionAssetsPerSecond",
+                revision_asset_count / revision_seconds,
+                emf.UNIT_COUNT_PER_SECOND,
+            )
+        stage.emit()
+
     except Exception as e:
         logging.error(e)
         raise e
+    finally:
+        telemetry.flush()
     return {
         "StatusCode": 200,
         "Message": "Revision Finalized",
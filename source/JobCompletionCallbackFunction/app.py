@@ -0,0 +1,193 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+
+from adx_coordinator import checkpoint, jobs, manifest, ratelimit, runtime
+
+TOKEN_PREFIX = "job-tokens/"
+
+
+def token_key(job_id):
+    return f"{TOKEN_PREFIX}{job_id}{manifest.INTERNAL_SUFFIX}"
+
+
+def resume_workflow(sfn, task_token, job, job_status):
+    """Resumes the waiting CreateAndStartJobStepFunction execution with the job's final status"""
+    output = dict(job, JobStatus=job_status)
+    try:
+        sfn.send_task_success(taskToken=task_token, output=json.dumps(output))
+    except ClientError as error:
+        if error.response["Error"]["Code"] not in ("TaskTimedOut", "InvalidToken"):
+            raise
+        logging.warning(
+            f"Task token for JobId={job['JobId']} is no longer valid, "
+            "the execution already fell back to polling"
+        )
+
+
+def record_completion(s3, job, job_status):
+    """Records a completed job in the checkpoint of the manifest it was created for"""
+    if job_status == "COMPLETED" and "JobMapIndex" in job and "Bucket" in job:
+        checkpoint.mark_job_completed(
+            s3, job["Bucket"], job["Key"], job["RevisionMapIndex"], job["JobMapIndex"]
+        )
+
+
+def register(s3, sfn, dataexchange, bucket, event):
+    """Stores the task token of a job, or resumes right away if the job already finished"""
+    job = event["Job"]
+    job_id = job["JobId"]
+    job_status = ratelimit.call(dataexchange.get_job, JobId=job_id)["State"]
+    if jobs.is_terminal(job_status):
+        logging.info(f"{job_id=} already finished with {job_status=}")
+        record_completion(s3, job, job_status)
+        resume_workflow(sfn, event["TaskToken"], job, job_status)
+        return job_status
+
+    record = {"TaskToken": event["TaskToken"], "Job": job}
+    s3.put_object(
+        Body=json.dumps(record).encode("utf-8"), Bucket=bucket, Key=token_key(job_id)
+    )
+    logging.info(f"Registered task token for {job_id=}")
+    return job_status
+
+
+def complete(s3, sfn, bucket, job_id, job_status):
+    """Resumes the execution waiting on a job if a task token is registered for it"""
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=token_key(job_id))
+    except ClientError as error:
+        if error.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        logging.info(f"No task token registered for {job_id=}")
+        return False
+
+    record = manifest.read_json(obj)
+    record_completion(s3, record["Job"], job_status)
+    resume_workflow(sfn, record["TaskToken"], record["Job"], job_status)
+    s3.delete_object(Bucket=bucket, Key=token_key(job_id))
+    return True
+
+
+def sweep_waits(window_seconds):
+    """
+    Returns the waits between the passes of one scheduled sweep.
+
+    Passes are spaced like the status checks of a full import job in POLL mode, and
+    stop before the window, the interval of the schedule, runs out.
+    """
+    waits = []
+    elapsed = 0
+    for wait in jobs.poll_schedule(jobs.MAX_ASSETS_PER_JOB)["Schedule"]:
+        if elapsed + wait >= window_seconds:
+            break
+        waits.append(wait)
+        elapsed += wait
+    return waits
+
+
+def sweep(s3, sfn, dataexchange, bucket):
+    """Checks every job with a registered task token and resumes the finished ones"""
+    paginator = s3.get_paginator("list_objects_v2")
+    job_ids = [
+        obj["Key"][len(TOKEN_PREFIX): -len(manifest.INTERNAL_SUFFIX)]
+        for page in paginator.paginate(Bucket=bucket, Prefix=TOKEN_PREFIX)
+        for obj in page.get("Contents", [])
+    ]
+    if not job_ids:
+        return 0, 0
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        job_states = list(
+            executor.map(
+                lambda job_id: ratelimit.call(dataexchange.get_job, JobId=job_id)["State"],
+                job_ids,
+            )
+        )
+
+    resumed = 0
+    for job_id, job_status in zip(job_ids, job_states):
+        if jobs.is_terminal(job_status) and complete(s3, sfn, bucket, job_id, job_status):
+            resumed += 1
+    return len(job_ids), resumed
+
+
+def lambda_handler(event, context):
+    """
+    This function resumes CreateAndStartJobStepFunction executions waiting on a task token.
+
+    It handles two kinds of events: a registration from the state machine carrying the
+    task token of a started job, and a scheduled sweep that checks all jobs with a
+    registered token. ADX does not emit events when an import job changes state, so
+    every completion after registration is found by the sweep.
+    """
+    try:
+        logging.debug(runtime.lazy(lambda: f"{event=}"))
+
+        bucket = os.environ["TOKEN_BUCKET"]
+        s3 = runtime.client("s3")
+        sfn = runtime.client("stepfunctions")
+        dataexchange = runtime.client("dataexchange")
+
+        api_counters = ratelimit.counters()
+        metrics = {
+            "Version": os.getenv("Version"),
+            "TimeStamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f"),
+        }
+
+        if "TaskToken" in event:
+            metrics["JobId"] = event["Job"]["JobId"]
+            metrics["JobStatus"] = register(s3, sfn, dataexchange, bucket, event)
+
+        elif event.get("detail-type") == "Scheduled Event":
+            # The schedule runs every MAX_POLL_WAIT_SECONDS, the longest poll wait
+            window_seconds = int(
+                os.environ.get("SWEEP_DURATION_SECONDS", jobs.MAX_POLL_WAIT_SECONDS)
+            )
+            pending, resumed = sweep(s3, sfn, dataexchange, bucket)
+            resumed_now = resumed
+            for wait in sweep_waits(window_seconds):
+                if pending == resumed_now:
+                    break
+                time.sleep(wait)
+                pending, resumed_now = sweep(s3, sfn, dataexchange, bucket)
+                resumed += resumed_now
+            metrics["PendingJobCount"] = pending - resumed_now
+            metrics["ResumedJobCount"] = resumed
+
+        else:
+            logging.info("Ignoring an event that is neither a registration nor a sweep")
+
+        metrics.update(ratelimit.counters_since(api_counters))
+        logging.info(f"Metrics:{metrics}")
+
+    except Exception as e:
+        logging.error(e)
+        raise e
+
+    return {"StatusCode": 200, "Message": "Job completion event processed"}
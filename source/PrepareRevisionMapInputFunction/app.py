@@ -18,65 +18,83 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 ##############################################################################
 
-import json
 import logging
 import os
 from datetime import datetime
 
-import boto3
+from adx_coordinator import emf, manifest, progress, runtime
 
 
 def lambda_handler(event, context):
     """
-    This function prepares input for the revision map state
+    This function prepares input for the revision map state.
+
+    Each execution publishes at most REVISIONS_PER_EXECUTION revisions, starting at
+    StartRevisionIndex, and hands the remaining revisions to a chained execution.
+    The first execution of a publish is started with its plan by
+    StartPublishingWorkflowFunction and skips this state, which only plans chained
+    segments and executions started with just the manifest Bucket and Key.
     """
     try:
-        global log_level
-        log_level = str(os.getenv("LOG_LEVEL")).upper()
-        valid_log_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
-        if log_level not in valid_log_levels:
-            log_level = "ERROR"
-
-        logging.getLogger().setLevel(log_level)
+        logging.debug(runtime.lazy(lambda: f"{event=}"))
 
-        logging.debug(f"{event=}")
-
-        bucket = event["Bucket"]
-        key = event["Key"]
-        s3 = boto3.client("s3")
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        manifest_dict = json.loads(obj["Body"].read())
+        execution_input = event.get("Input", event)
+        bucket = execution_input["Bucket"]
+        key = execution_input["Key"]
+        start_revision_index = execution_input.get("StartRevisionIndex", 0)
+        publish_id = execution_input.get("PublishId", event.get("ExecutionName"))
+        stage = emf.Stage("PrepareRevisionMapInput")
+        s3 = runtime.client("s3")
+        manifest_dict = manifest.read_index(s3, bucket, key)
 
         product_id = manifest_dict["product_id"]
         dataset_id = manifest_dict["dataset_id"]
+        stage.set_dataset(product_id, dataset_id)
 
         logging.debug(f"{bucket=}\n{key=}\n{product_id=}\n{dataset_id=}")
 
-        num_revisions = len(manifest_dict["asset_list_nested"])
-
-        num_jobs = 0
-        num_revision_assets = 0
+        num_revisions = manifest.revision_count(manifest_dict)
+        plan = progress.segment_plan(
+            publish_id,
+            [
+                manifest.job_asset_counts(manifest_dict, revision_index)
+                for revision_index in range(num_revisions)
+            ],
+            start_revision_index,
+            progress.revisions_per_execution(),
+        )
+        revision_map_input_list = plan["RevisionMapInput"]
+        num_jobs = plan["TotalJobCount"]
         if num_revisions:
-            logging.info(f"Creating the input list to create {num_revisions} revisions")
-            revision_map_input_list = list(range(num_revisions))
-
-            for revisions_index in range(num_revisions):
-                num_revision_assets = len(
-                    manifest_dict["asset_list_nested"][revisions_index]
-                )
-                num_jobs += num_revision_assets
+            logging.info(
+                f"Creating the input list to create revisions {start_revision_index} to "
+                f"{start_revision_index + len(revision_map_input_list) - 1} of {num_revisions}"
+            )
 
             metrics = {
                 "Version": os.getenv("Version"),
                 "TimeStamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f"),
                 "ProductId": product_id,
                 "DatasetId": dataset_id,
-                "RevisionAssetCount": num_revision_assets,
                 "TotalJobCount": num_jobs,
-                "RevisionMapInput": revision_map_input_list,
+                "PublishId": publish_id,
+                "Segment": plan["Segment"],
+                "SegmentCount": plan["SegmentCount"],
+                "StartRevisionIndex": start_revision_index,
+                "RevisionMapInputCount": len(revision_map_input_list),
             }
             logging.info(f"Metrics:{metrics}")
 
+        if publish_id:
+            progress.start_segment(
+                s3, bucket, key, event.get("ExecutionName"), product_id, dataset_id, plan
+            )
+
+        stage.set_property("PublishId", publish_id)
+        stage.put("RevisionCount", len(revision_map_input_list))
+        stage.put("JobCount", num_jobs)
+        stage.emit()
+
     except Exception as e:
         logging.error(e)
         raise e
@@ -84,13 +102,12 @@ def lambda_handler(event, context):
     return {
         "StatusCode": 200,
         "Message": "Input generated for {} revisions and {} jobs".format(
-            num_revisions, num_jobs
+            len(revision_map_input_list), num_jobs
         ),
         "Bucket": bucket,
         "Key": key,
         "ProductId": product_id,
         "DatasetId": dataset_id,
-        "RevisionCount": num_revisions,
-        "TotalJobCount": num_jobs,
-        "RevisionMapInput": revision_map_input_list,
+        "Comment": manifest_dict.get("comment"),
+        **plan,
     }
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Admission control for queued manifest ingestion.
+
+Manifests buffered in the ingestion queue only start a PublishRevisionsStepFunction
+execution while the import jobs that running executions may have in flight stay within
+a budget, so a backfill does not overrun the account's concurrent import job quota.
+"""
+
+from adx_coordinator import jobs
+
+DEFAULT_IN_FLIGHT_JOB_BUDGET = 10
+# Deferred messages become visible again after this long
+ADMISSION_RETRY_SECONDS = 60
+
+
+def running_executions(sfn, state_machine_arn):
+    paginator = sfn.get_paginator("list_executions")
+    return sum(
+        len(page["executions"])
+        for page in paginator.paginate(
+            stateMachineArn=state_machine_arn, statusFilter="RUNNING"
+        )
+    )
+
+
+def jobs_per_execution(revision_concurrency, max_concurrent_jobs=jobs.MAX_CONCURRENT_JOBS):
+    """Upper bound on the import jobs one execution runs at the same time"""
+    return max(1, revision_concurrency * max_concurrent_jobs)
+
+
+def admission_slots(running, budget, per_execution):
+    """
+    Returns how many more executions fit in the in-flight job budget.
+
+    One execution is always admitted when none is running, even if the budget is smaller
+    than what a single execution may use, so the queue cannot stall.
+    """
+    if not running:
+        return max(1, budget // per_execution)
+    return max(0, (budget - running * per_execution) // per_execution)
@@ -0,0 +1,442 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Expansion of the ``asset_list`` of a manifest into individual S3 assets.
+
+Assets are produced lazily, one listing page at a time, so that callers can chunk and
+persist them without holding the whole dataset in memory. Entries with an ``Inventory``
+location are expanded from an S3 Inventory report instead of being listed.
+"""
+
+import heapq
+import logging
+import os
+import queue
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from adx_coordinator import inventory
+
+# Number of listing pages a worker may buffer ahead of the consumer
+MAX_BUFFERED_PAGES = 4
+# Objects per page read from an inventory data file, as in a listing page
+INVENTORY_PAGE_SIZE = 1000
+
+PACKING_SEQUENTIAL = "SEQUENTIAL"
+PACKING_SIZE_BALANCED = "SIZE_BALANCED"
+
+_DONE = object()
+
+# Fraction of listed keys that are also logged one by one; every prefix is always
+# summarized in a single line
+ASSET_LOG_SAMPLE_RATE = float(os.getenv("ASSET_LOG_SAMPLE_RATE", "0"))
+_SAMPLE_BUCKETS = 1_000_000
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def is_sampled(key, sample_rate=None):
+    """Returns whether a key is logged individually; the choice is stable per key"""
+    if sample_rate is None:
+        sample_rate = ASSET_LOG_SAMPLE_RATE
+    if sample_rate <= 0:
+        return False
+    bucket = zlib.crc32(key.encode("utf-8")) % _SAMPLE_BUCKETS
+    return bucket < sample_rate * _SAMPLE_BUCKETS
+
+
+class PrefixSummary:
+    """Counts what the listing of one prefix produced, for a single log line per prefix"""
+
+    def __init__(self, bucket, prefix, source="ListObjectsV2"):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.source = source
+        self.pages = 0
+        self.assets = 0
+        self.bytes = 0
+        self.skipped_empty = 0
+        self.first_key = None
+        self.last_key = None
+
+    def add(self, file):
+        """Counts a listed object and returns whether it is an asset"""
+        if file["Size"] == 0:
+            self.skipped_empty += 1
+            return False
+        self.assets += 1
+        self.bytes += file["Size"]
+        if self.first_key is None:
+            self.first_key = file["Key"]
+        self.last_key = file["Key"]
+        if is_sampled(file["Key"]):
+            logging.info(f"Adding key to manifest: s3://{self.bucket}/{file['Key']}")
+        return True
+
+    def log(self):
+        logging.info(
+            f"Listed s3://{self.bucket}/{self.prefix} from {self.source}: "
+            f"{self.assets} assets, "
+            f"{self.bytes} bytes in {self.pages} pages, "
+            f"{self.skipped_empty} empty objects skipped, "
+            f"first_key={self.first_key} last_key={self.last_key}"
+        )
+
+
+def _iter_prefix_pages(s3, asset_bucket, prefix):
+    """Yields the non-empty objects under a prefix as one asset list per listing page"""
+    paginator = s3.get_paginator("list_objects_v2")
+    response_iterator = paginator.paginate(
+        Bucket=asset_bucket,
+        Prefix=prefix,
+        PaginationConfig={"PageSize": 1000},
+    )
+    summary = PrefixSummary(asset_bucket, prefix)
+    for page in response_iterator:
+        summary.pages += 1
+        logging.debug(f"Finding keys in {prefix=}, page {summary.pages}")
+        if "Contents" not in page:
+            raise ValueError("Failed - no resources found in the prefix")
+        page_assets = [
+            {
+                "Bucket": asset_bucket,
+                "Key": file["Key"],
+                "Size": file["Size"],
+                "ETag": file["ETag"],
+            }
+            for file in page["Contents"]
+            if summary.add(file)
+        ]
+        yield page_assets
+    summary.log()
+
+
+def _asset(asset_bucket, file):
+    asset = {"Bucket": asset_bucket, "Key": file["Key"], "Size": file["Size"]}
+    if "ETag" in file:
+        asset["ETag"] = file["ETag"]
+    return asset
+
+
+def _iter_inventory_pages(
+    s3, asset_bucket, prefix, inventory_report, data_file_key, summary
+):
+    """
+    Yields the non-empty objects under a prefix listed in one inventory data file.
+
+    ``summary`` is shared with the unit that checks the prefix had rows at all.
+    """
+    objects = inventory.iter_objects(s3, inventory_report, data_file_key, prefix)
+    for page in iter_chunks(objects, INVENTORY_PAGE_SIZE):
+        summary.pages += 1
+        yield [_asset(asset_bucket, file) for file in page if summary.add(file)]
+    summary.log()
+
+
+def _require_inventory_rows(summaries):
+    """
+    Raises, when consumed, if no data file of an inventory had a row under the prefix.
+
+    It is consumed after the pages of every data file, so all the counts are final.
+    """
+    if not any(summary.assets or summary.skipped_empty for summary in summaries):
+        raise ValueError("Failed - no resources found in the prefix")
+    yield from ()
+
+
+def _iter_inventory_units(s3, asset_bucket, prefix, location):
+    """
+    Splits a prefix into one unit per data file of its inventory report.
+
+    Assets are produced in the order of the report's files and of their rows, which is
+    not key order, but is the same every time the same report is read. A last unit fails
+    the listing when the report holds no row under the prefix, as listing it would.
+    """
+    inventory_report = inventory.read_inventory_manifest(s3, location)
+    if inventory_report["sourceBucket"] != asset_bucket:
+        raise ValueError(
+            f"Inventory {location['Key']} is for bucket {inventory_report['sourceBucket']}, "
+            f"not {asset_bucket}"
+        )
+    data_file_keys = inventory.data_file_keys(inventory_report)
+    logging.info(
+        f"Reading {prefix=} from {len(data_file_keys)} inventory files of {location['Key']}"
+    )
+    summaries = []
+    for data_file_key in data_file_keys:
+        summary = PrefixSummary(asset_bucket, prefix, source=data_file_key)
+        summaries.append(summary)
+        yield (
+            lambda data_file_key=data_file_key, summary=summary: _iter_inventory_pages(
+                s3, asset_bucket, prefix, inventory_report, data_file_key, summary
+            )
+        )
+    yield (lambda: [_require_inventory_rows(summaries)])
+
+
+def _iter_fan_out_units(s3, asset_bucket, prefix):
+    """
+    Splits a prefix into independently listable units using a delimiter listing.
+
+    Each sub-prefix becomes its own unit, and runs of objects stored directly under the
+    prefix are grouped into static units. Units are returned in key order, so listing
+    them one after the other yields the same order as a single recursive listing.
+    """
+    paginator = s3.get_paginator("list_objects_v2")
+    response_iterator = paginator.paginate(
+        Bucket=asset_bucket,
+        Prefix=prefix,
+        Delimiter="/",
+        PaginationConfig={"PageSize": 1000},
+    )
+    entries = []
+    summary = PrefixSummary(asset_bucket, prefix)
+    for page in response_iterator:
+        summary.pages += 1
+        entries.extend(
+            (common_prefix["Prefix"], None)
+            for common_prefix in page.get("CommonPrefixes", [])
+        )
+        entries.extend((file["Key"], file) for file in page.get("Contents", []))
+    if not entries:
+        raise ValueError("Failed - no resources found in the prefix")
+
+    logging.info(f"Fanning out listing of {prefix=} over {len(entries)} entries")
+    entries.sort(key=lambda entry: entry[0])
+
+    files = []
+    for name, file in entries:
+        if file is not None:
+            if summary.add(file):
+                files.append(
+                    {
+                        "Bucket": asset_bucket,
+                        "Key": name,
+                        "Size": file["Size"],
+                        "ETag": file["ETag"],
+                    }
+                )
+            continue
+        if files:
+            yield (lambda page_assets=files: [page_assets])
+            files = []
+        yield (lambda sub_prefix=name: _iter_prefix_pages(s3, asset_bucket, sub_prefix))
+    if files:
+        yield (lambda page_assets=files: [page_assets])
+    if summary.assets or summary.skipped_empty:
+        summary.log()
+
+
+def _iter_listing_units(s3, asset_list, fan_out):
+    """
+    Yields, in manifest order, callables that each return an iterable of asset pages.
+
+    Consecutive explicit keys are grouped into a single unit.
+    """
+    explicit_assets = []
+    for entry in asset_list:
+        asset_bucket = entry["Bucket"]
+        prefix = entry["Key"]
+        inventory_location = entry.get("Inventory")
+        if not inventory_location and not prefix.endswith("/"):
+            explicit_assets.append({"Bucket": asset_bucket, "Key": prefix})
+            continue
+        if explicit_assets:
+            yield (lambda page_assets=explicit_assets: [page_assets])
+            explicit_assets = []
+        if inventory_location:
+            yield from _iter_inventory_units(s3, asset_bucket, prefix, inventory_location)
+        elif fan_out:
+            yield from _iter_fan_out_units(s3, asset_bucket, prefix)
+        else:
+            yield (
+                lambda asset_bucket=asset_bucket, prefix=prefix: _iter_prefix_pages(
+                    s3, asset_bucket, prefix
+                )
+            )
+    if explicit_assets:
+        yield (lambda page_assets=explicit_assets: [page_assets])
+
+
+def _put(pages, item, stop):
+    while not stop.is_set():
+        try:
+            pages.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _produce(unit, pages, stop):
+    try:
+        for page_assets in unit():
+            if stop.is_set():
+                return
+            _put(pages, page_assets, stop)
+    except Exception as error:
+        _put(pages, _Failure(error), stop)
+    else:
+        _put(pages, _DONE, stop)
+
+
+def iter_ordered(units, max_workers):
+    """
+    Runs up to ``max_workers`` units concurrently and yields their items in unit order.
+
+    Each running unit buffers at most MAX_BUFFERED_PAGES items ahead of the consumer,
+    so memory stays bounded no matter how large a single unit is.
+    """
+    units = iter(units)
+    if max_workers <= 1:
+        for unit in units:
+            yield from unit()
+        return
+
+    stop = threading.Event()
+    window = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def submit_next():
+            unit = next(units, None)
+            if unit is None:
+                return False
+            pages = queue.Queue(maxsize=MAX_BUFFERED_PAGES)
+            executor.submit(_produce, unit, pages, stop)
+            window.append(pages)
+            return True
+
+        try:
+            while len(window) < max_workers and submit_next():
+                pass
+            while window:
+                item = window[0].get()
+                if item is _DONE:
+                    window.popleft()
+                    submit_next()
+                elif isinstance(item, _Failure):
+                    raise item.error
+                else:
+                    yield item
+        finally:
+            stop.set()
+
+
+def iter_assets(s3, asset_list, max_workers=1, fan_out=False):
+    """
+    Yields the assets of a manifest asset_list, expanding entries ending in '/'.
+
+    Entries (and, with ``fan_out``, the sub-prefixes of each entry) are listed by up to
+    ``max_workers`` threads, while assets are still yielded in manifest and key order.
+    The data files of an entry's inventory report are read by the same threads.
+    """
+    units = _iter_listing_units(s3, asset_list, fan_out)
+    for page_assets in iter_ordered(units, max_workers):
+        yield from page_assets
+
+
+def iter_chunks(items, size):
+    """Groups an iterable into lists of at most ``size`` items"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def fill_metadata(s3, assets, max_workers=1, fields=("Size", "ETag")):
+    """
+    Looks up the Size and ETag of assets that were listed explicitly in the manifest.
+
+    Only assets missing one of ``fields`` are looked up, so assets expanded from a
+    listing or an inventory without ETags are not requested again when only their Size
+    is needed.
+    """
+    unknown = [asset for asset in assets if any(field not in asset for field in fields)]
+    if not unknown:
+        return assets
+
+    def head(asset):
+        return s3.head_object(Bucket=asset["Bucket"], Key=asset["Key"])
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for asset, response in zip(unknown, executor.map(head, unknown)):
+            asset["Size"] = response["ContentLength"]
+            asset["ETag"] = response["ETag"]
+    return assets
+
+
+def pack_jobs(revision_assets, assets_per_job=100):
+    """
+    Splits the assets of a revision into the minimum number of jobs while balancing the
+    total bytes per job.
+
+    Assets are placed largest first into the job with the fewest bytes that still has
+    room (longest-processing-time-first), then each job is restored to listing order.
+    """
+    num_jobs = -(-len(revision_assets) // assets_per_job)
+    jobs = [[] for _ in range(num_jobs)]
+    open_jobs = [(0, job_index) for job_index in range(num_jobs)]
+
+    by_size = sorted(
+        range(len(revision_assets)), key=lambda position: -revision_assets[position]["Size"]
+    )
+    for position in by_size:
+        job_bytes, job_index = heapq.heappop(open_jobs)
+        jobs[job_index].append(position)
+        if len(jobs[job_index]) < assets_per_job:
+            heapq.heappush(
+                open_jobs, (job_bytes + revision_assets[position]["Size"], job_index)
+            )
+
+    return [
+        [revision_assets[position] for position in sorted(job)] for job in jobs
+    ]
+
+
+def iter_revisions(
+    assets,
+    assets_per_revision,
+    assets_per_job=100,
+    packing=PACKING_SEQUENTIAL,
+    s3=None,
+    max_workers=1,
+):
+    """
+    Chunks a stream of assets into revisions, each a list of import job asset lists.
+
+    Revisions always take assets in listing order. With PACKING_SIZE_BALANCED the assets
+    of each revision are distributed over its jobs by size instead of in fixed slices.
+    Only the revision currently being filled is held in memory.
+    """
+    for revision_assets in iter_chunks(assets, assets_per_revision):
+        if packing == PACKING_SIZE_BALANCED:
+            fill_metadata(s3, revision_assets, max_workers, fields=("Size",))
+            yield pack_jobs(revision_assets, assets_per_job)
+        else:
+            yield list(iter_chunks(revision_assets, assets_per_job))
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Checkpoints that let a retried publish resume where its failed execution stopped.
+
+For every revision index the checkpoint records the RevisionId created for it, and for
+every job index the JobId created for it and whether that job completed. Together with
+the finalized markers written by FinalizeAndUpdateCatalogFunction this is enough for a
+later execution with the same input to reuse open revisions, skip completed jobs and
+only redo the work that failed. Checkpoints live next to the manifest shards. For every
+new upload of the manifest StartPublishingWorkflowFunction clears them together with
+everything else the earlier publish left under the shard prefix.
+"""
+
+import json
+import logging
+
+from botocore.exceptions import ClientError
+
+from adx_coordinator import manifest
+
+
+def checkpoint_prefix(index_key):
+    return f"{manifest.shard_prefix(index_key)}checkpoint/"
+
+
+def revision_prefix(index_key, revision_index):
+    return f"{checkpoint_prefix(index_key)}revision-{revision_index:05d}/"
+
+
+def revision_key(index_key, revision_index):
+    return f"{revision_prefix(index_key, revision_index)}revision{manifest.INTERNAL_SUFFIX}"
+
+
+def job_key(index_key, revision_index, job_index):
+    return f"{revision_prefix(index_key, revision_index)}jobs/job-{job_index:05d}{manifest.INTERNAL_SUFFIX}"
+
+
+def completed_prefix(index_key, revision_index):
+    return f"{revision_prefix(index_key, revision_index)}completed/"
+
+
+def completed_key(index_key, revision_index, job_index):
+    return f"{completed_prefix(index_key, revision_index)}job-{job_index:05d}"
+
+
+def _read(s3, bucket, key):
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as error:
+        if error.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return None
+    return manifest.read_json(obj)
+
+
+def _write(s3, bucket, key, record):
+    s3.put_object(Body=json.dumps(record).encode("utf-8"), Bucket=bucket, Key=key)
+
+
+def save_revision(s3, bucket, index_key, revision_index, revision_id):
+    """Records the revision created for a revision index"""
+    _write(
+        s3, bucket, revision_key(index_key, revision_index), {"RevisionId": revision_id}
+    )
+
+
+def load_revision_id(s3, bucket, index_key, revision_index):
+    """Returns the RevisionId recorded for a revision index, or None"""
+    record = _read(s3, bucket, revision_key(index_key, revision_index))
+    return record["RevisionId"] if record else None
+
+
+def save_job(s3, bucket, index_key, revision_index, job_index, job_id, job_asset_count):
+    """Records the import job created for a job index"""
+    _write(
+        s3,
+        bucket,
+        job_key(index_key, revision_index, job_index),
+        {"JobId": job_id, "JobAssetCount": job_asset_count},
+    )
+
+
+def load_job(s3, bucket, index_key, revision_index, job_index):
+    """Returns the JobId and JobAssetCount recorded for a job index, or None"""
+    return _read(s3, bucket, job_key(index_key, revision_index, job_index))
+
+
+def mark_job_completed(s3, bucket, index_key, revision_index, job_index):
+    s3.put_object(
+        Body=b"", Bucket=bucket, Key=completed_key(index_key, revision_index, job_index)
+    )
+
+
+def completed_jobs(s3, bucket, index_key, revision_index):
+    """Returns the indexes of the jobs of a revision that completed, with one listing"""
+    prefix = completed_prefix(index_key, revision_index)
+    paginator = s3.get_paginator("list_objects_v2")
+    return {
+        int(obj["Key"][len(prefix) + len("job-"):])
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+        for obj in page.get("Contents", [])
+    }
+
+
+def clear(s3, bucket, index_key):
+    """
+    Removes what an earlier publish of the manifest left under its shard prefix: the
+    checkpoints, finalized markers, job shards or packs, delta assets and quarantine record
+    """
+    deleted = manifest.delete_prefix(s3, bucket, manifest.shard_prefix(index_key))
+    if deleted:
+        logging.info(f"Deleted {deleted} objects of an earlier publish of {index_key}")
@@ -0,0 +1,214 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Incremental publishing: only assets that are new or whose ETag changed since they were
+last published are imported.
+
+A state index per dataset records, for every published asset, its ETag, size and the
+revision it was published in. The index is split into STATE_INDEX_SHARDS shard objects
+by the bucket and parent prefix of each key. Listings return the keys of a prefix one
+after the other, so StartPublishingWorkflowFunction filters them against the few shards
+it keeps loaded at a time, and memory stays bounded however large the dataset is. It
+also writes the metadata of each revision's assets, per import job, next to its shards.
+FinalizeAndUpdateCatalogFunction merges the assets of the jobs that completed into the
+shards they belong to once the revision is finalized, using a conditional write per
+shard so concurrent updates are never lost. Assets of failed jobs are left out, so the
+next publish finds them changed and imports them again.
+"""
+
+import json
+import logging
+import zlib
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+from adx_coordinator import assets, checkpoint, manifest
+
+STATE_INDEX_PREFIX = "delta-index/"
+STATE_INDEX_SHARDS = 256
+# Shards kept in memory while filtering a listing
+MAX_LOADED_SHARDS = 4
+
+# Assets whose metadata is looked up together when the listing did not provide it
+LOOKUP_BATCH_SIZE = 1000
+MAX_COMMIT_ATTEMPTS = 10
+
+
+def shard_number(bucket, key):
+    """Returns the state index shard of an asset, shared by every key of its prefix"""
+    parent = key.rpartition("/")[0]
+    return zlib.crc32(f"{bucket}/{parent}".encode("utf-8")) % STATE_INDEX_SHARDS
+
+
+def state_index_key(dataset_id, shard):
+    return f"{STATE_INDEX_PREFIX}{dataset_id}/shard-{shard:03d}{manifest.INTERNAL_SUFFIX}"
+
+
+def revision_assets_key(index_key, revision_index):
+    return (
+        f"{manifest.shard_prefix(index_key)}revision-{revision_index:05d}/"
+        f"delta{manifest.INTERNAL_SUFFIX}"
+    )
+
+
+def _read_state_shard(s3, bucket, dataset_id, shard):
+    """Returns the published assets of one shard, keyed by bucket then key, and its ETag"""
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=state_index_key(dataset_id, shard))
+    except ClientError as error:
+        if error.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return {}, None
+    return manifest.read_json(obj)["assets"], obj["ETag"]
+
+
+class PublishedAssets:
+    """The state index of a dataset, whose shards are read as lookups need them"""
+
+    def __init__(self, s3, bucket, dataset_id, max_loaded_shards=MAX_LOADED_SHARDS):
+        self.s3 = s3
+        self.bucket = bucket
+        self.dataset_id = dataset_id
+        self.max_loaded_shards = max_loaded_shards
+        self.shards_read = 0
+        self._shards = OrderedDict()
+
+    def get(self, asset_bucket, key):
+        """Returns the [ETag, Size, RevisionId] entry of a published asset, or None"""
+        shard = shard_number(asset_bucket, key)
+        if shard in self._shards:
+            self._shards.move_to_end(shard)
+        else:
+            self._shards[shard], _ = _read_state_shard(
+                self.s3, self.bucket, self.dataset_id, shard
+            )
+            self.shards_read += 1
+            if len(self._shards) > self.max_loaded_shards:
+                self._shards.popitem(last=False)
+        return self._shards[shard].get(asset_bucket, {}).get(key)
+
+
+def load_published_assets(s3, bucket, dataset_id):
+    return PublishedAssets(s3, bucket, dataset_id)
+
+
+def is_changed(published, asset):
+    entry = published.get(asset["Bucket"], asset["Key"])
+    return entry is None or entry[0] != asset["ETag"]
+
+
+def iter_changed_assets(s3, asset_stream, published, max_workers=1):
+    """Yields only the assets that are new or changed since they were last published"""
+    for batch in assets.iter_chunks(asset_stream, LOOKUP_BATCH_SIZE):
+        assets.fill_metadata(s3, batch, max_workers)
+        for asset in batch:
+            if is_changed(published, asset):
+                yield asset
+    logging.info(
+        f"Filtered the listing against {published.shards_read} state index shard reads "
+        f"of dataset_id={published.dataset_id}"
+    )
+
+
+def write_revision_assets(s3, bucket, index_key, revision_index, jobs):
+    """
+    Records the metadata of the assets of a revision by import job, to be committed once
+    the revision is finalized
+    """
+    job_entries = [
+        [[asset["Bucket"], asset["Key"], asset["ETag"], asset["Size"]] for asset in job_assets]
+        for job_assets in jobs
+    ]
+    data = json.dumps({"jobs": job_entries}).encode("utf-8")
+    s3.put_object(
+        Body=data, Bucket=bucket, Key=revision_assets_key(index_key, revision_index)
+    )
+
+
+def _commit_shard(s3, bucket, dataset_id, shard, entries, revision_id):
+    """Merges entries into one shard of the state index with a conditional put"""
+    for attempt in range(MAX_COMMIT_ATTEMPTS):
+        published, etag = _read_state_shard(s3, bucket, dataset_id, shard)
+        for asset_bucket, key, asset_etag, size in entries:
+            published.setdefault(asset_bucket, {})[key] = [asset_etag, size, revision_id]
+
+        data = json.dumps({"dataset_id": dataset_id, "assets": published}).encode("utf-8")
+        condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+        try:
+            s3.put_object(
+                Body=data, Bucket=bucket, Key=state_index_key(dataset_id, shard), **condition
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] not in (
+                "PreconditionFailed",
+                "ConditionalRequestConflict",
+            ):
+                raise
+            logging.info(f"State index {shard=} changed concurrently, retrying merge {attempt=}")
+            continue
+        return
+
+    raise RuntimeError(
+        f"Could not update state index {shard=} of {dataset_id=} after "
+        f"{MAX_COMMIT_ATTEMPTS} attempts"
+    )
+
+
+def commit_revision(s3, bucket, index_key, revision_index, dataset_id, revision_id):
+    """
+    Merges the assets of a finalized revision into the dataset's state index.
+
+    Only the assets of jobs with a completed marker in the checkpoint are merged; those
+    of jobs that ended in ERROR, CANCELLED or TIMED_OUT never reached the revision.
+    Only the shards holding the merged assets are read and replaced, each with a
+    conditional put that is retried against the latest shard whenever another writer
+    updated it in the meantime.
+    """
+    try:
+        obj = s3.get_object(
+            Bucket=bucket, Key=revision_assets_key(index_key, revision_index)
+        )
+    except ClientError as error:
+        if error.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        logging.info(f"No delta assets recorded for {revision_index=}")
+        return 0
+    job_entries = manifest.read_json(obj)["jobs"]
+    completed = checkpoint.completed_jobs(s3, bucket, index_key, revision_index)
+    if len(completed) < len(job_entries):
+        logging.warning(
+            f"Not committing the assets of {len(job_entries) - len(completed)} of "
+            f"{len(job_entries)} jobs of {revision_id=} that did not complete"
+        )
+    entries_by_shard = {}
+    for job_index in sorted(completed):
+        for entry in job_entries[job_index]:
+            entries_by_shard.setdefault(shard_number(entry[0], entry[1]), []).append(entry)
+
+    for shard, entries in sorted(entries_by_shard.items()):
+        _commit_shard(s3, bucket, dataset_id, shard, entries, revision_id)
+    entry_count = sum(len(entries) for entries in entries_by_shard.values())
+    logging.info(
+        f"Committed {entry_count} assets of {revision_id=} to "
+        f"{len(entries_by_shard)} state index shards"
+    )
+    return entry_count
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+CloudWatch Embedded Metric Format (EMF) records for each stage of the workflow.
+
+Every function describes its invocation as a stage and emits one EMF record for it,
+with the ProductId, DatasetId and Stage dimensions. CloudWatch Logs extracts the
+metrics from the record, so stage durations, bytes read, job latencies and revision
+throughput can be graphed without parsing the ``Metrics:`` log lines.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+from adx_coordinator import manifest
+
+NAMESPACE = "ADXPublisherCoordinator"
+DIMENSIONS = ["ProductId", "DatasetId", "Stage"]
+
+UNIT_COUNT = "Count"
+UNIT_SECONDS = "Seconds"
+UNIT_BYTES = "Bytes"
+UNIT_COUNT_PER_SECOND = "Count/Second"
+
+# EMF accepts at most 100 values for one metric in a record
+MAX_VALUES_PER_METRIC = 100
+
+
+def _write_stdout(record):
+    # The Lambda log format prefixes records written through logging, which would keep
+    # CloudWatch from recognizing them as EMF
+    sys.stdout.write(json.dumps(record) + "\n")
+    sys.stdout.flush()
+
+
+_sink = _write_stdout
+_sink_lock = threading.Lock()
+
+
+def use_sink(sink):
+    """
+    Replaces where EMF records are written, e.g. to collect them in a local run.
+    ``None`` restores writing to stdout.
+    """
+    global _sink
+    with _sink_lock:
+        _sink = sink or _write_stdout
+
+
+def enabled():
+    return os.getenv("EMBEDDED_METRICS", "Yes") == "Yes"
+
+
+class Stage:
+    """
+    Collects the metrics of one stage invocation and emits them as a single EMF record.
+
+    The record always includes the wall time of the stage since it was created
+    (``StageSeconds``) and the manifest bytes read from S3 during it (``S3BytesRead``).
+    """
+
+    def __init__(self, stage, product_id=None, dataset_id=None):
+        self.stage = stage
+        self.product_id = product_id
+        self.dataset_id = dataset_id
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+        self._started = time.monotonic()
+        self._bytes_read = manifest.bytes_read()
+
+    def set_dataset(self, product_id, dataset_id):
+        self.product_id = product_id
+        self.dataset_id = dataset_id
+
+    def put(self, name, value, unit=UNIT_COUNT):
+        """Adds a value of a metric; a metric put several times keeps every value"""
+        values = self.values.setdefault(name, [])
+        if len(values) < MAX_VALUES_PER_METRIC:
+            values.append(value)
+        self.units[name] = unit
+
+    def set_property(self, name, value):
+        """Adds a field that is searchable in the log record but is not a metric"""
+        self.properties[name] = value
+
+    def emit(self):
+        self.put("StageSeconds", round(time.monotonic() - self._started, 3), UNIT_SECONDS)
+        self.put("S3BytesRead", manifest.bytes_read() - self._bytes_read, UNIT_BYTES)
+        if not enabled():
+            return None
+
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [DIMENSIONS],
+                        "Metrics": [
+                            {"Name": name, "Unit": self.units[name]} for name in self.values
+                        ],
+                    }
+                ],
+            },
+            **self.properties,
+            "ProductId": self.product_id or "unknown",
+            "DatasetId": self.dataset_id or "unknown",
+            "Stage": self.stage,
+        }
+        for name, values in self.values.items():
+            record[name] = values[0] if len(values) == 1 else values
+        with _sink_lock:
+            _sink(record)
+        return record
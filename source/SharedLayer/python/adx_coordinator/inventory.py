@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Reading of S3 Inventory reports, so that a prefix can be expanded without listing it.
+
+A manifest asset_list entry with an ``Inventory`` location takes its assets from the
+inventory report whose ``manifest.json`` is stored there, instead of from
+ListObjectsV2. CSV reports are streamed; Parquet and ORC reports are read with
+pyarrow, which must then be added to the shared layer.
+"""
+
+import csv
+import gzip
+import io
+from urllib.parse import unquote_plus
+
+from adx_coordinator import manifest
+
+INVENTORY_FORMAT_CSV = "CSV"
+INVENTORY_FORMAT_PARQUET = "Parquet"
+INVENTORY_FORMAT_ORC = "ORC"
+
+# Fields of the Parquet and ORC schemas, named as in the CSV fileSchema
+_COLUMNAR_FIELDS = {
+    "bucket": "Bucket",
+    "key": "Key",
+    "size": "Size",
+    "e_tag": "ETag",
+    "is_latest": "IsLatest",
+    "is_delete_marker": "IsDeleteMarker",
+}
+
+
+def read_inventory_manifest(s3, location):
+    """Reads the manifest.json of an inventory report"""
+    obj = s3.get_object(Bucket=location["Bucket"], Key=location["Key"])
+    inventory = manifest.read_json(obj)
+    file_format = inventory.get("fileFormat")
+    if file_format not in (
+        INVENTORY_FORMAT_CSV,
+        INVENTORY_FORMAT_PARQUET,
+        INVENTORY_FORMAT_ORC,
+    ):
+        raise ValueError(f"Unsupported inventory {file_format=} in {location['Key']}")
+    if file_format == INVENTORY_FORMAT_CSV:
+        fields = csv_fields(inventory)
+        if "Key" not in fields or "Size" not in fields:
+            raise ValueError(
+                f"Inventory {location['Key']} must include the Key and Size fields"
+            )
+    return inventory
+
+
+def destination_bucket(inventory):
+    """Returns the name of the bucket the report files are stored in"""
+    return inventory["destinationBucket"].split(":::")[-1]
+
+
+def data_file_keys(inventory):
+    return [file["key"] for file in inventory["files"]]
+
+
+def csv_fields(inventory):
+    return [field.strip() for field in inventory["fileSchema"].split(",")]
+
+
+def _iter_csv_rows(body, fields):
+    with gzip.open(body, "rt", encoding="utf-8", newline="") as text:
+        for values in csv.reader(text):
+            row = dict(zip(fields, values))
+            # Keys are URL-encoded in CSV reports
+            row["Key"] = unquote_plus(row["Key"])
+            row["Size"] = int(row["Size"] or 0)
+            yield row
+
+
+def _iter_columnar_rows(data, file_format, data_file_key):
+    try:
+        if file_format == INVENTORY_FORMAT_PARQUET:
+            from pyarrow import parquet
+
+            table = parquet.read_table(io.BytesIO(data))
+        else:
+            from pyarrow import orc
+
+            table = orc.ORCFile(io.BytesIO(data)).read()
+    except ImportError:
+        raise ValueError(f"Reading {file_format} inventory reports requires pyarrow")
+
+    # Without sizes every object would look empty and be skipped like a folder marker
+    if "key" not in table.column_names or "size" not in table.column_names:
+        raise ValueError(f"Inventory {data_file_key} must include the Key and Size fields")
+    names = [name for name in table.column_names if name in _COLUMNAR_FIELDS]
+    for batch in table.to_batches():
+        columns = [batch.column(name).to_pylist() for name in names]
+        for values in zip(*columns):
+            row = {_COLUMNAR_FIELDS[name]: value for name, value in zip(names, values)}
+            row["Size"] = row["Size"] or 0
+            yield row
+
+
+def _is_current(row):
+    """Skips noncurrent versions and delete markers of versioned inventories"""
+    if str(row.get("IsDeleteMarker", "false")).lower() == "true":
+        return False
+    return str(row.get("IsLatest", "true")).lower() == "true"
+
+
+def iter_objects(s3, inventory, data_file_key, prefix):
+    """
+    Yields the current objects of one inventory data file whose key starts with
+    ``prefix``, as ListObjectsV2 would return them.
+    """
+    obj = s3.get_object(Bucket=destination_bucket(inventory), Key=data_file_key)
+    file_format = inventory["fileFormat"]
+    if file_format == INVENTORY_FORMAT_CSV:
+        rows = _iter_csv_rows(obj["Body"], csv_fields(inventory))
+    else:
+        rows = _iter_columnar_rows(obj["Body"].read(), file_format, data_file_key)
+
+    for row in rows:
+        if not row["Key"].startswith(prefix) or not _is_current(row):
+            continue
+        listed = {"Key": row["Key"], "Size": row["Size"]}
+        if row.get("ETag"):
+            # Listings return quoted ETags, which delta publishing compares against
+            etag = row["ETag"].strip('"')
+            listed["ETag"] = f'"{etag}"'
+        yield listed
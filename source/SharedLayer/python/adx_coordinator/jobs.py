@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Helpers shared by the functions that start and track AWS Data Exchange import jobs.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from adx_coordinator import ratelimit
+
+COMPLETION_MODE_POLL = "POLL"
+COMPLETION_MODE_CALLBACK = "CALLBACK"
+
+ORCHESTRATION_PER_JOB = "PER_JOB"
+ORCHESTRATION_PER_REVISION = "PER_REVISION"
+
+# Which import job calls of CreateAndStartJobStepFunction go through direct Step
+# Functions service integrations instead of Lambda functions
+SERVICE_INTEGRATION_LAMBDA = "LAMBDA"
+SERVICE_INTEGRATION_GET_JOB = "GET_JOB"
+SERVICE_INTEGRATION_START_AND_GET_JOB = "START_AND_GET_JOB"
+
+# ADX runs at most 10 concurrent import jobs, matching the job Map's MaxConcurrency
+MAX_CONCURRENT_JOBS = 10
+MAX_ASSETS_PER_JOB = 100
+
+TERMINAL_JOB_STATES = ("COMPLETED", "ERROR", "CANCELLED", "TIMED_OUT")
+
+MIN_POLL_WAIT_SECONDS = 5
+MAX_POLL_WAIT_SECONDS = 60
+# Extra initial wait per asset in the job; a full 100-asset job starts at 10 seconds
+ASSETS_PER_POLL_WAIT_SECOND = 20
+POLL_WAIT_GROWTH = 1.5
+
+
+def is_terminal(job_status):
+    return job_status in TERMINAL_JOB_STATES
+
+
+def poll_wait_seconds(asset_count, poll_attempt):
+    """
+    Returns how long to wait before the next status check of an import job.
+
+    The first wait grows with the number of assets in the job, and each further
+    attempt backs off geometrically up to MAX_POLL_WAIT_SECONDS.
+    """
+    base = MIN_POLL_WAIT_SECONDS + asset_count // ASSETS_PER_POLL_WAIT_SECOND
+    return int(min(MAX_POLL_WAIT_SECONDS, base * POLL_WAIT_GROWTH ** poll_attempt))
+
+
+def poll_schedule(asset_count):
+    """
+    Returns the poll state of a job whose status is checked by the state machine.
+
+    ``Schedule`` lists the wait before each status check, from the first one up to
+    the first that reaches MAX_POLL_WAIT_SECONDS, which is then used for every later
+    check; the state machine advances ``Attempt`` and ``WaitSeconds`` itself.
+    """
+    schedule = [poll_wait_seconds(asset_count, 0)]
+    while schedule[-1] < MAX_POLL_WAIT_SECONDS:
+        schedule.append(poll_wait_seconds(asset_count, len(schedule)))
+    return {
+        "Attempt": 0,
+        "WaitSeconds": schedule[0],
+        "Schedule": schedule,
+        "LastAttempt": len(schedule) - 1,
+    }
+
+
+def create_import_job(dataexchange, dataset_id, revision_id, job_assets):
+    """Creates an IMPORT_ASSETS_FROM_S3 job for the assets and returns its JobId"""
+    revision_details = {
+        "ImportAssetsFromS3": {
+            "AssetSources": job_assets,
+            "DataSetId": dataset_id,
+            "RevisionId": revision_id,
+        }
+    }
+    create_job_response = ratelimit.call(
+        dataexchange.create_job, Type="IMPORT_ASSETS_FROM_S3", Details=revision_details
+    )
+    return create_job_response["Arn"].split("/")[1]
+
+
+def _in_flight(revision_jobs):
+    return [
+        job for job in revision_jobs if job["Started"] and not is_terminal(job["State"])
+    ]
+
+
+def queue_to_complete_seconds(get_job_response):
+    """Returns the seconds from creating a finished job to its last state change"""
+    created_at = get_job_response["CreatedAt"]
+    updated_at = get_job_response["UpdatedAt"]
+    return max(0.0, (updated_at - created_at).total_seconds())
+
+
+def refresh_job_states(dataexchange, revision_jobs):
+    """
+    Calls get_job concurrently for every started, unfinished job and updates its State.
+
+    Returns the checked jobs, each paired with its get_job response.
+    """
+    outstanding = _in_flight(revision_jobs)
+    responses = []
+    if outstanding:
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS) as executor:
+            responses = list(
+                executor.map(
+                    lambda job: ratelimit.call(dataexchange.get_job, JobId=job["JobId"]),
+                    outstanding,
+                )
+            )
+        for job, response in zip(outstanding, responses):
+            job["State"] = response["State"]
+    return list(zip(outstanding, responses))
+
+
+def start_queued_jobs(dataexchange, revision_jobs, max_concurrent_jobs):
+    """Starts created jobs, in job index order, while fewer than the limit are running"""
+    free_slots = max(0, max_concurrent_jobs - len(_in_flight(revision_jobs)))
+    queued = [job for job in revision_jobs if not job["Started"]][:free_slots]
+    for job in queued:
+        ratelimit.call(dataexchange.start_job, JobId=job["JobId"])
+        job["Started"] = True
+        job["State"] = "IN_PROGRESS"
+    return len(queued)
+
+
+def summarize_jobs(revision_jobs, previous=None):
+    """
+    Returns aggregate job counts for a revision.
+
+    ``previous`` holds the counts returned by the last check, which include the
+    finished jobs already dropped from ``revision_jobs`` by ``unfinished_jobs``.
+    """
+    previous = previous or {}
+    in_progress = len(_in_flight(revision_jobs))
+    queued = sum(1 for job in revision_jobs if not job["Started"])
+    return {
+        "JobsCompleted": previous.get("JobsCompleted", 0)
+        + sum(1 for job in revision_jobs if job["State"] == "COMPLETED"),
+        "JobsErrored": previous.get("JobsErrored", 0)
+        + sum(
+            1
+            for job in revision_jobs
+            if is_terminal(job["State"]) and job["State"] != "COMPLETED"
+        ),
+        "JobsInProgress": in_progress,
+        "JobsQueued": queued,
+        "JobsPending": in_progress + queued,
+    }
+
+
+def unfinished_jobs(revision_jobs):
+    """
+    Returns the jobs that still have to be started or checked.
+
+    Only these are carried in the state payload, so it shrinks as a revision's jobs
+    finish; the finished ones are counted by ``summarize_jobs``.
+    """
+    return [job for job in revision_jobs if not is_terminal(job["State"])]
+
+
+def revision_poll_wait_seconds(revision_jobs, poll_attempt):
+    """Returns the wait before the next status check, based on the largest running job"""
+    asset_count = max(
+        (job["JobAssetCount"] for job in _in_flight(revision_jobs)), default=0
+    )
+    return poll_wait_seconds(asset_count, poll_attempt)
@@ -0,0 +1,430 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Reading and writing of the nested manifest produced by StartPublishingWorkflowFunction.
+
+The nested manifest is stored as a small index object (the ``.manifest`` key) plus one
+shard object per revision/job slice, so that each import job only downloads the assets
+it needs. Index objects written before sharding was introduced embed the whole
+``asset_list_nested`` and are still accepted by every reader in this module.
+
+With the packed format, selected by ``MANIFEST_FORMAT=PACKED``, each revision is instead
+written as a single pack object. A pack starts with a table of byte offsets, one per
+import job, followed by one zlib-compressed block per job. Each block holds a table of
+the distinct buckets of the job and its keys front-coded against the previous key, so
+a job is read with two small ranged GETs instead of downloading a JSON shard.
+"""
+
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+
+from botocore.exceptions import ClientError
+
+# The manifest bucket starts a publish for every new object whose key ends in .json, so
+# the objects the solution writes there use this suffix instead
+INTERNAL_SUFFIX = ".manifest"
+
+MANIFEST_FORMAT_SHARDED = "sharded"
+MANIFEST_FORMAT_PACKED = "packed"
+
+PACK_MAGIC = b"ADXP"
+PACK_VERSION = 1
+# Magic, version and job count, followed by job count + 1 little-endian offsets
+_PACK_HEADER = struct.Struct("<4sBI")
+_PACK_OFFSET = struct.Struct("<Q")
+
+_bytes_read = 0
+_bytes_read_lock = threading.Lock()
+
+# The format of every index read by read_job_assets, by (bucket, index key)
+_index_formats = {}
+_index_formats_lock = threading.Lock()
+
+
+def read_json(obj):
+    """Parses the JSON body of a get_object response and counts the bytes read"""
+    global _bytes_read
+    body = obj["Body"].read()
+    with _bytes_read_lock:
+        _bytes_read += len(body)
+    return json.loads(body)
+
+
+def bytes_read():
+    """Returns the bytes of manifest objects read by the container so far"""
+    with _bytes_read_lock:
+        return _bytes_read
+
+
+def shard_prefix(index_key):
+    """Returns the key prefix under which the shards of an index are stored"""
+    return f"{index_key}.d/"
+
+
+def job_shard_key(index_key, revision_index, job_index):
+    """Returns the key of the shard holding the assets of one import job"""
+    return (
+        f"{shard_prefix(index_key)}revision-{revision_index:05d}/"
+        f"job-{job_index:05d}{INTERNAL_SUFFIX}"
+    )
+
+
+def write_job_shard(s3, bucket, index_key, revision_index, job_index, job_assets):
+    """Writes the asset list of one import job, as ADX AssetSources, to its own shard"""
+    shard_key = job_shard_key(index_key, revision_index, job_index)
+    asset_sources = [
+        {"Bucket": asset["Bucket"], "Key": asset["Key"]} for asset in job_assets
+    ]
+    data = json.dumps(asset_sources).encode("utf-8")
+    s3.put_object(Body=data, Bucket=bucket, Key=shard_key)
+    return shard_key
+
+
+def configured_format():
+    """Returns the format new nested manifests are written in"""
+    if os.environ.get("MANIFEST_FORMAT", "SHARDED") == "PACKED":
+        return MANIFEST_FORMAT_PACKED
+    return MANIFEST_FORMAT_SHARDED
+
+
+def pack_key(index_key, revision_index):
+    """Returns the key of the pack holding the assets of every import job of a revision"""
+    return f"{shard_prefix(index_key)}revision-{revision_index:05d}.pack"
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def encode_job_block(job_assets):
+    """
+    Encodes the AssetSources of one import job as a compressed block.
+
+    The block holds the bucket table, then one column each for the bucket index, the
+    length of the prefix shared with the previous key and the length of the remaining
+    suffix, then the concatenated key suffixes.
+    """
+    buckets = {}
+    bucket_column = bytearray()
+    shared_column = bytearray()
+    suffix_column = bytearray()
+    suffixes = bytearray()
+    previous = b""
+    for asset in job_assets:
+        bucket_index = buckets.setdefault(asset["Bucket"], len(buckets))
+        key = asset["Key"].encode("utf-8")
+        shared = 0
+        limit = min(len(key), len(previous))
+        while shared < limit and key[shared] == previous[shared]:
+            shared += 1
+        _write_varint(bucket_column, bucket_index)
+        _write_varint(shared_column, shared)
+        _write_varint(suffix_column, len(key) - shared)
+        suffixes += key[shared:]
+        previous = key
+
+    block = bytearray()
+    _write_varint(block, len(buckets))
+    for bucket in buckets:
+        encoded = bucket.encode("utf-8")
+        _write_varint(block, len(encoded))
+        block += encoded
+    _write_varint(block, len(job_assets))
+    block += bucket_column + shared_column + suffix_column + suffixes
+    return zlib.compress(bytes(block))
+
+
+def decode_job_block(data):
+    """Decodes a block written by ``encode_job_block`` into ADX AssetSources"""
+    block = zlib.decompress(data)
+    bucket_count, position = _read_varint(block, 0)
+    buckets = []
+    for _ in range(bucket_count):
+        length, position = _read_varint(block, position)
+        buckets.append(block[position: position + length].decode("utf-8"))
+        position += length
+    asset_count, position = _read_varint(block, position)
+    columns = []
+    for _ in range(3):
+        column = []
+        for _ in range(asset_count):
+            value, position = _read_varint(block, position)
+            column.append(value)
+        columns.append(column)
+
+    asset_sources = []
+    previous = b""
+    for bucket_index, shared, suffix_length in zip(*columns):
+        key = previous[:shared] + block[position: position + suffix_length]
+        position += suffix_length
+        asset_sources.append({"Bucket": buckets[bucket_index], "Key": key.decode("utf-8")})
+        previous = key
+    return asset_sources
+
+
+def write_revision_pack(s3, bucket, index_key, revision_index, jobs):
+    """Writes the asset lists of every import job of a revision as one pack object"""
+    blocks = [encode_job_block(job_assets) for job_assets in jobs]
+    header = _PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(blocks))
+    offset = _PACK_HEADER.size + _PACK_OFFSET.size * (len(blocks) + 1)
+    offsets = [offset]
+    for block in blocks:
+        offset += len(block)
+        offsets.append(offset)
+    data = b"".join(
+        [header] + [_PACK_OFFSET.pack(offset) for offset in offsets] + blocks
+    )
+    key = pack_key(index_key, revision_index)
+    s3.put_object(Body=data, Bucket=bucket, Key=key)
+    return key
+
+
+def _read_range(s3, bucket, key, start, end):
+    """Reads the bytes from ``start`` up to, but excluding, ``end``"""
+    global _bytes_read
+    obj = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+    data = obj["Body"].read()
+    with _bytes_read_lock:
+        _bytes_read += len(data)
+    return data
+
+
+def read_packed_job_assets(s3, bucket, index_key, revision_index, job_index):
+    """Reads the assets of one import job from its revision pack with two ranged GETs"""
+    key = pack_key(index_key, revision_index)
+    position = _PACK_HEADER.size + _PACK_OFFSET.size * job_index
+    start, end = struct.unpack(
+        "<QQ", _read_range(s3, bucket, key, position, position + 2 * _PACK_OFFSET.size)
+    )
+    return decode_job_block(_read_range(s3, bucket, key, start, end))
+
+
+def write_index(
+    s3,
+    bucket,
+    index_key,
+    product_id,
+    dataset_id,
+    revisions,
+    comment=None,
+    manifest_format=MANIFEST_FORMAT_SHARDED,
+):
+    """
+    Writes the index object of a sharded manifest.
+
+    ``revisions`` holds, per revision, a dict with the asset count of each import job
+    (``job_asset_counts``) and, when asset sizes are known, its total bytes (``job_bytes``).
+    """
+    index = {
+        "product_id": product_id,
+        "dataset_id": dataset_id,
+        "format": manifest_format,
+        "shard_prefix": shard_prefix(index_key),
+        "revisions": revisions,
+    }
+    if comment is not None:
+        index["comment"] = comment
+
+    data = json.dumps(index).encode("utf-8")
+    s3.put_object(Body=data, Bucket=bucket, Key=index_key)
+    return index
+
+
+class ManifestWriter:
+    """
+    Writes a sharded manifest one revision at a time.
+
+    Job shards, or the revision pack with the packed format, are written as soon as
+    their revision is added; the index, which only holds per-job asset counts, is
+    written by ``close`` once every revision is known.
+    """
+
+    def __init__(self, s3, bucket, index_key, manifest_format=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.index_key = index_key
+        self.manifest_format = manifest_format or configured_format()
+        self.revisions = []
+
+    @property
+    def asset_count(self):
+        return sum(sum(revision["job_asset_counts"]) for revision in self.revisions)
+
+    def add_revision(self, jobs):
+        """Writes the job shards of the next revision and returns its index"""
+        revision_index = len(self.revisions)
+        if self.manifest_format == MANIFEST_FORMAT_PACKED:
+            write_revision_pack(self.s3, self.bucket, self.index_key, revision_index, jobs)
+        else:
+            for job_index, job_assets in enumerate(jobs):
+                write_job_shard(
+                    self.s3,
+                    self.bucket,
+                    self.index_key,
+                    revision_index,
+                    job_index,
+                    job_assets,
+                )
+        revision = {"job_asset_counts": [len(job_assets) for job_assets in jobs]}
+        if all("Size" in asset for job_assets in jobs for asset in job_assets):
+            revision["job_bytes"] = [
+                sum(asset["Size"] for asset in job_assets) for job_assets in jobs
+            ]
+        self.revisions.append(revision)
+        return revision_index
+
+    def close(self, product_id, dataset_id, comment=None):
+        return write_index(
+            self.s3,
+            self.bucket,
+            self.index_key,
+            product_id,
+            dataset_id,
+            self.revisions,
+            comment=comment,
+            manifest_format=self.manifest_format,
+        )
+
+
+def read_index(s3, bucket, index_key):
+    """Reads the index object (or a legacy single-file nested manifest)"""
+    obj = s3.get_object(Bucket=bucket, Key=index_key)
+    return read_json(obj)
+
+
+def is_sharded(index):
+    """Returns whether the index lists its revisions instead of embedding the assets"""
+    return index.get("format") in (MANIFEST_FORMAT_SHARDED, MANIFEST_FORMAT_PACKED)
+
+
+def revision_count(index):
+    if is_sharded(index):
+        return len(index["revisions"])
+    return len(index["asset_list_nested"])
+
+
+def job_asset_counts(index, revision_index):
+    """Returns the asset count of every import job of a revision"""
+    if is_sharded(index):
+        return index["revisions"][revision_index]["job_asset_counts"]
+    return [len(job) for job in index["asset_list_nested"][revision_index]]
+
+
+def finalized_marker_prefix(index_key):
+    return f"{shard_prefix(index_key)}finalized/"
+
+
+def finalized_marker_key(index_key, revision_index):
+    return f"{finalized_marker_prefix(index_key)}revision-{revision_index:05d}{INTERNAL_SUFFIX}"
+
+
+def delete_prefix(s3, bucket, prefix):
+    """
+    Deletes every object under a prefix with one DeleteObjects request per listing page
+    of up to 1000 keys, and returns how many were deleted
+    """
+    deleted = 0
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+        Bucket=bucket, Prefix=prefix, PaginationConfig={"PageSize": 1000}
+    ):
+        objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+        if not objects:
+            continue
+        response = s3.delete_objects(
+            Bucket=bucket, Delete={"Objects": objects, "Quiet": True}
+        )
+        errors = response.get("Errors", [])
+        if errors:
+            raise RuntimeError(
+                f"Could not delete {len(errors)} objects under s3://{bucket}/{prefix}, "
+                f"e.g. {errors[0]['Key']}: {errors[0]['Code']}"
+            )
+        deleted += len(objects)
+    return deleted
+
+
+def mark_revision_finalized(s3, bucket, index_key, revision_index, revision_id):
+    """Records that a revision of the manifest was finalized"""
+    data = json.dumps({"RevisionId": revision_id}).encode("utf-8")
+    s3.put_object(
+        Body=data, Bucket=bucket, Key=finalized_marker_key(index_key, revision_index)
+    )
+
+
+def is_revision_finalized(s3, bucket, index_key, revision_index):
+    try:
+        s3.head_object(Bucket=bucket, Key=finalized_marker_key(index_key, revision_index))
+    except ClientError as error:
+        if error.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return False
+    return True
+
+
+def read_job_assets(s3, bucket, index_key, revision_index, job_index):
+    """
+    Reads the assets of a single import job.
+
+    The format recorded in the index decides whether the job's shard or its block of
+    the revision pack is downloaded. The index is read once per container and
+    manifest; legacy single-file manifests return the job's assets from it directly.
+    """
+    with _index_formats_lock:
+        manifest_format = _index_formats.get((bucket, index_key))
+    if manifest_format is None:
+        index = read_index(s3, bucket, index_key)
+        if not is_sharded(index):
+            logging.info(f"Reading {revision_index=} {job_index=} from legacy nested manifest")
+            return index["asset_list_nested"][revision_index][job_index]
+        manifest_format = index["format"]
+        with _index_formats_lock:
+            _index_formats[(bucket, index_key)] = manifest_format
+    if manifest_format == MANIFEST_FORMAT_PACKED:
+        return read_packed_job_assets(s3, bucket, index_key, revision_index, job_index)
+    return read_job_shard(s3, bucket, index_key, revision_index, job_index)
+
+
+def read_job_shard(s3, bucket, index_key, revision_index, job_index):
+    """Reads the assets of one import job from its shard"""
+    obj = s3.get_object(
+        Bucket=bucket, Key=job_shard_key(index_key, revision_index, job_index)
+    )
+    return read_json(obj)
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Progress of a publish that may span several chained PublishRevisionsStepFunction
+executions.
+
+A publish is identified by its PublishId, the name of its first execution. Each segment
+execution publishes a slice of the manifest's revisions and starts the next segment with
+the remaining revision indexes. The progress record of a publish, stored under
+``publish-progress/`` in the manifest bucket, lists its segment executions and counts
+the revisions finalized so far.
+
+Each segment execution is started with a publish plan: the revisions it creates, with
+the job and asset count of each, so that no state has to read the nested manifest
+index just to count them.
+"""
+
+import json
+import os
+
+from botocore.exceptions import ClientError
+
+from adx_coordinator import manifest
+
+PROGRESS_PREFIX = "publish-progress/"
+
+# Step Functions execution names are at most 80 characters
+MAX_EXECUTION_NAME_LENGTH = 80
+
+DEFAULT_REVISIONS_PER_EXECUTION = 10
+
+STATUS_IN_PROGRESS = "IN_PROGRESS"
+STATUS_SUCCEEDED = "SUCCEEDED"
+
+
+def progress_key(publish_id):
+    return f"{PROGRESS_PREFIX}{publish_id}{manifest.INTERNAL_SUFFIX}"
+
+
+def segment_execution_name(publish_id, segment):
+    """Returns the execution name of a segment; the first segment keeps the PublishId"""
+    if segment == 0:
+        return publish_id
+    suffix = f"-{segment:04d}"
+    return f"{publish_id[:MAX_EXECUTION_NAME_LENGTH - len(suffix)]}{suffix}"
+
+
+def segments(revision_count, revisions_per_execution):
+    """Returns the number of segment executions a manifest is published in"""
+    return max(1, -(-revision_count // revisions_per_execution))
+
+
+def revisions_per_execution():
+    return int(
+        os.getenv("REVISIONS_PER_EXECUTION", str(DEFAULT_REVISIONS_PER_EXECUTION))
+    )
+
+
+def segment_plan(publish_id, job_asset_counts, start_revision_index, per_execution):
+    """
+    Returns the publish plan of the segment starting at ``start_revision_index``.
+
+    ``job_asset_counts`` holds the asset count of every import job of every revision
+    of the manifest. Each item of ``RevisionMapInput`` is the input of one revision of
+    the segment; ``NextSegment`` is empty for the last segment.
+    """
+    revision_count = len(job_asset_counts)
+    end_revision_index = min(revision_count, start_revision_index + per_execution)
+    segment = start_revision_index // per_execution
+    next_segment = {}
+    if end_revision_index < revision_count:
+        next_segment = {
+            "StartRevisionIndex": end_revision_index,
+            "ExecutionName": segment_execution_name(publish_id, segment + 1),
+        }
+    return {
+        "PublishId": publish_id,
+        "RevisionCount": revision_count,
+        "TotalJobCount": sum(len(counts) for counts in job_asset_counts),
+        "Segment": segment,
+        "SegmentCount": segments(revision_count, per_execution),
+        "RevisionMapInput": [
+            {
+                "RevisionMapIndex": revision_index,
+                "NumJobs": len(job_asset_counts[revision_index]),
+                "NumRevisionAssets": sum(job_asset_counts[revision_index]),
+            }
+            for revision_index in range(start_revision_index, end_revision_index)
+        ],
+        "HasNextSegment": bool(next_segment),
+        "NextSegment": next_segment,
+    }
+
+
+def read_progress(s3, bucket, publish_id):
+    """Returns the progress record of a publish, or None"""
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=progress_key(publish_id))
+    except ClientError as error:
+        if error.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return None
+    return manifest.read_json(obj)
+
+
+def update_progress(s3, bucket, publish_id, **fields):
+    """
+    Merges fields into the progress record of a publish.
+
+    Segments run one after the other and revisions are finalized in manifest order, so
+    the record is never updated by two writers at the same time.
+    """
+    record = read_progress(s3, bucket, publish_id) or {"PublishId": publish_id}
+    record.update(fields)
+    s3.put_object(
+        Body=json.dumps(record).encode("utf-8"),
+        Bucket=bucket,
+        Key=progress_key(publish_id),
+    )
+    return record
+
+
+def start_segment(s3, bucket, key, execution_name, product_id, dataset_id, plan):
+    """Records a segment execution, and the plan it runs, in the progress record"""
+    record = read_progress(s3, bucket, plan["PublishId"]) or {}
+    executions = record.get("Executions", [])
+    if execution_name and execution_name not in executions:
+        executions.append(execution_name)
+    return update_progress(
+        s3,
+        bucket,
+        plan["PublishId"],
+        Bucket=bucket,
+        Key=key,
+        ProductId=product_id,
+        DatasetId=dataset_id,
+        Status=STATUS_IN_PROGRESS,
+        RevisionCount=plan["RevisionCount"],
+        RevisionsFinalized=record.get("RevisionsFinalized", 0),
+        Segment=plan["Segment"],
+        SegmentCount=plan["SegmentCount"],
+        Executions=executions,
+    )
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Client-side rate limiting of the AWS Data Exchange job APIs.
+
+Every call to create_job, start_job and get_job takes a token from a bucket kept per API
+for the life of the container, so concurrent threads and warm invocations share it.
+A throttled call halves the bucket's rate and is retried after a jittered backoff; each
+successful call raises the rate again by a small step, up to the configured rate.
+"""
+
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+# ADX allows 10 requests per second per account for each job API
+DEFAULT_REQUESTS_PER_SECOND = 10.0
+MIN_REQUESTS_PER_SECOND = 0.5
+RATE_DECREASE_FACTOR = 0.5
+RATE_INCREASE_STEP = 0.1
+
+MAX_THROTTLE_RETRIES = 8
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 20.0
+
+THROTTLING_ERROR_CODES = (
+    "ThrottlingException",
+    "Throttling",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+)
+
+_monotonic = time.monotonic
+_sleep = time.sleep
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+
+def use_clock(monotonic, sleep):
+    """
+    Replaces the time source of the buckets and backoffs, e.g. with a simulated clock.
+
+    Existing buckets are dropped since their timestamps come from the previous clock.
+    """
+    global _monotonic, _sleep
+    with _buckets_lock:
+        _monotonic = monotonic
+        _sleep = sleep
+        _buckets.clear()
+
+
+class TokenBucket:
+    """Token bucket whose rate adapts to throttling (additive increase, multiplicative decrease)"""
+
+    def __init__(self, max_rate):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.tokens = max_rate
+        self.updated = _monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Takes a token, sleeping until one is available; returns the seconds waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill(_monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            _sleep(wait)
+            waited += wait
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(MIN_REQUESTS_PER_SECOND, self.rate * RATE_DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE_STEP)
+
+
+def bucket(api):
+    try:
+        return _buckets[api]
+    except KeyError:
+        pass
+    with _buckets_lock:
+        if api not in _buckets:
+            _buckets[api] = TokenBucket(
+                float(
+                    os.environ.get(
+                        "ADX_REQUESTS_PER_SECOND", str(DEFAULT_REQUESTS_PER_SECOND)
+                    )
+                )
+            )
+        return _buckets[api]
+
+
+def _count(**amounts):
+    with _counters_lock:
+        _counters.update(amounts)
+
+
+def backoff_seconds(attempt):
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def call(operation, **kwargs):
+    """
+    Calls a client method, e.g. ``call(dataexchange.get_job, JobId=job_id)``, through the
+    token bucket of its API, retrying it while it is throttled.
+    """
+    api_bucket = bucket(operation.__name__)
+    attempt = 0
+    while True:
+        waited = api_bucket.acquire()
+        try:
+            response = operation(**kwargs)
+        except ClientError as error:
+            if error.response["Error"]["Code"] not in THROTTLING_ERROR_CODES:
+                raise
+            api_bucket.throttled()
+            _count(ThrottleCount=1)
+            if attempt >= MAX_THROTTLE_RETRIES:
+                raise
+            _sleep(backoff_seconds(attempt))
+            attempt += 1
+            _count(RetryCount=1)
+            continue
+        api_bucket.succeeded()
+        # Retries botocore made itself, e.g. after connection errors
+        sdk_retries = response.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        _count(RetryCount=sdk_retries, RateLimitedSeconds=waited)
+        return response
+
+
+def counters():
+    """Returns a copy of the throttle and retry counters of the container"""
+    with _counters_lock:
+        return Counter(_counters)
+
+
+def counters_since(start):
+    """Returns the counters accumulated since ``start``, a result of ``counters()``"""
+    current = counters()
+    return {
+        name: round(current[name] - start[name], 3)
+        for name in ("ThrottleCount", "RetryCount", "RateLimitedSeconds")
+    }
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Per-container runtime state shared by every function of the solution.
+
+Logging is configured once when the module is first imported, and AWS clients are built
+lazily on first use and then reused by every warm invocation of the container. Clients
+come from a botocore session rather than boto3, whose resource and transfer modules
+none of the functions use but every cold start would import.
+"""
+
+import logging
+import os
+import threading
+
+import botocore.session
+from botocore.config import Config
+
+VALID_LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+
+# marketplace-catalog is only available in us-east-1
+SERVICE_REGIONS = {"marketplace-catalog": "us-east-1"}
+
+# Throttling of the ADX job APIs is handled by ratelimit, so botocore retries ADX calls
+# only a few times and without its own adaptive rate limiter
+SERVICE_RETRIES = {"dataexchange": {"mode": "standard", "max_attempts": 3}}
+
+_session = None
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def configure_logging(default_level="ERROR"):
+    """Sets the root log level from LOG_LEVEL, falling back to ``default_level``"""
+    log_level = str(os.environ.get("LOG_LEVEL")).upper()
+    if log_level not in VALID_LOG_LEVELS:
+        log_level = default_level
+    logging.getLogger().setLevel(log_level)
+    return log_level
+
+
+class _LazyMessage:
+    def __init__(self, build):
+        self.build = build
+
+    def __str__(self):
+        return str(self.build())
+
+
+def lazy(build):
+    """
+    Defers building a log message until a handler actually formats it.
+
+    ``logging.debug(runtime.lazy(lambda: f"{event=}"))`` only renders the event when
+    DEBUG is enabled, while a plain f-string is rendered on every call.
+    """
+    return _LazyMessage(build)
+
+
+def client_config(service_name):
+    return Config(
+        region_name=SERVICE_REGIONS.get(service_name),
+        max_pool_connections=int(os.environ.get("MAX_POOL_CONNECTIONS", "50")),
+        retries=SERVICE_RETRIES.get(
+            service_name,
+            {
+                "mode": "adaptive",
+                "max_attempts": int(os.environ.get("MAX_RETRY_ATTEMPTS", "10")),
+            },
+        ),
+        tcp_keepalive=True,
+    )
+
+
+def client(service_name):
+    """Returns the container's client for a service, building it on first use"""
+    global _session
+    try:
+        return _clients[service_name]
+    except KeyError:
+        pass
+    with _clients_lock:
+        if service_name not in _clients:
+            if _session is None:
+                _session = botocore.session.get_session()
+            _clients[service_name] = _session.create_client(
+                service_name, config=client_config(service_name)
+            )
+        return _clients[service_name]
+
+
+def register_client(service_name, service_client):
+    """Makes ``service_client`` the container's client for a service, e.g. a local stand-in"""
+    with _clients_lock:
+        _clients[service_name] = service_client
+
+
+log_level = configure_logging()
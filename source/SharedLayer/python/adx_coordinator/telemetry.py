@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Anonymous usage metrics of the solution.
+
+Usage is reported once per finalized revision rather than once per import job. Sends run
+on background threads with a strict timeout and never raise, so a slow or unreachable
+metrics endpoint can neither delay nor fail a publish. A handler starts a send with
+``send_in_background`` as soon as the data is known, overlaps it with the rest of its
+work and calls ``flush`` before it returns. Lambda freezes the container once the handler
+returns, so a send that is not flushed is usually never delivered.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+METRICS_URL = "https://metrics.awssolutionsbuilder.com/generic"
+
+# Bounds connecting and the whole request; a metric that does not make it is dropped
+TIMEOUT_SECONDS = 2.0
+
+_endpoint = METRICS_URL
+_http = None
+_http_lock = threading.Lock()
+_pending = []
+_pending_lock = threading.Lock()
+
+
+def use_endpoint(url):
+    """
+    Replaces where metrics are sent, e.g. with a local HTTP stand-in. ``None`` restores
+    METRICS_URL.
+    """
+    global _endpoint
+    _endpoint = url or METRICS_URL
+
+
+def enabled():
+    return os.environ.get("AnonymousUsage") == "Yes"
+
+
+def solution_data(data, solution_id=None, uuid=None):
+    """Wraps ``data`` in the record the metrics endpoint expects"""
+    return {
+        "Solution": solution_id or os.environ.get("SolutionId"),
+        "UUID": uuid or os.environ.get("UUID"),
+        "TimeStamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f"),
+        "Data": data,
+    }
+
+
+def _pool_manager():
+    global _http
+    with _http_lock:
+        if _http is None:
+            # The HTTP client is only imported once a metric is actually sent
+            import urllib3
+
+            _http = urllib3.PoolManager(
+                timeout=urllib3.Timeout(total=TIMEOUT_SECONDS), retries=False
+            )
+        return _http
+
+
+def send(record):
+    """POSTs ``record`` and returns the response status, or None when it was not sent"""
+    try:
+        response = _pool_manager().request(
+            "POST",
+            _endpoint,
+            body=json.dumps(record).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        logging.debug(f"Anonymous metrics sent, status={response.status}")
+        return response.status
+    except Exception as e:
+        logging.warning(f"Anonymous metrics not sent: {e!r}")
+        return None
+
+
+def send_in_background(record):
+    """Starts sending ``record`` on a daemon thread that ``flush`` waits for"""
+    thread = threading.Thread(target=send, args=(record,), daemon=True)
+    with _pending_lock:
+        # Sends that were never flushed are forgotten once they finished
+        _pending[:] = [pending for pending in _pending if pending.is_alive()]
+        _pending.append(thread)
+    thread.start()
+
+
+def flush(timeout=TIMEOUT_SECONDS):
+    """
+    Waits at most ``timeout`` seconds in total for the background sends and returns how
+    many are still running, which are then abandoned
+    """
+    deadline = time.monotonic() + timeout
+    with _pending_lock:
+        pending = _pending[:]
+        _pending.clear()
+    for thread in pending:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    return sum(thread.is_alive() for thread in pending)
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##############################################################################
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+##############################################################################
+
+"""
+Pre-validation of assets before any revision is created.
+
+Assets that ADX would fail to import are otherwise only found when their import job
+ends in ERROR, after the revision was already started. Explicitly listed assets are
+checked with HEAD requests, and objects encrypted with KMS additionally with a one
+byte ranged GET, since HEAD succeeds without kms:Decrypt. Assets expanded from a
+prefix already carry the size returned by the listing, so only their size is checked.
+
+HEAD results are kept for a short time per container, keyed by bucket and key, and
+are reused as long as the ETag of the asset still matches.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from adx_coordinator import assets, manifest
+
+VALIDATION_NONE = "NONE"
+VALIDATION_REJECT = "REJECT"
+VALIDATION_QUARANTINE = "QUARANTINE"
+
+# ADX quota on the size of a single asset imported from S3
+MAX_ASSET_BYTES = 100 * 1024 ** 3
+# Assets whose metadata is checked together
+VALIDATION_BATCH_SIZE = 1000
+HEAD_CACHE_SECONDS = int(os.getenv("HEAD_CACHE_SECONDS", "300"))
+
+REASON_NOT_FOUND = "NotFound"
+REASON_ACCESS_DENIED = "AccessDenied"
+REASON_KMS_ACCESS_DENIED = "KmsAccessDenied"
+REASON_TOO_LARGE = "TooLarge"
+
+_KMS_ENCRYPTION = ("aws:kms", "aws:kms:dsse")
+
+_head_cache = {}
+_head_cache_lock = threading.Lock()
+
+
+def quarantine_key(index_key):
+    return f"{manifest.shard_prefix(index_key)}quarantine{manifest.INTERNAL_SUFFIX}"
+
+
+def _cached(asset):
+    with _head_cache_lock:
+        entry = _head_cache.get((asset["Bucket"], asset["Key"]))
+    if entry is None or entry["ExpiresAt"] < time.monotonic():
+        return None
+    if "ETag" in asset and entry.get("ETag") != asset["ETag"]:
+        return None
+    return entry
+
+
+def _head(s3, asset):
+    """Returns the metadata of an asset, or the reason it cannot be imported"""
+    entry = _cached(asset)
+    if entry is not None:
+        return entry
+
+    entry = {}
+    try:
+        response = s3.head_object(Bucket=asset["Bucket"], Key=asset["Key"])
+        entry.update(Size=response["ContentLength"], ETag=response["ETag"])
+        if response.get("ServerSideEncryption") in _KMS_ENCRYPTION:
+            probe = s3.get_object(
+                Bucket=asset["Bucket"], Key=asset["Key"], Range="bytes=0-0"
+            )
+            # Reading the byte returns the connection to the client's pool right away
+            try:
+                probe["Body"].read()
+            finally:
+                probe["Body"].close()
+    except ClientError as error:
+        code = error.response["Error"]["Code"]
+        if code in ("NoSuchKey", "404"):
+            entry["Reason"] = REASON_NOT_FOUND
+        elif code in ("AccessDenied", "403"):
+            # Only the ranged GET of a KMS-encrypted object fails after a HEAD succeeded
+            entry["Reason"] = (
+                REASON_KMS_ACCESS_DENIED if "ETag" in entry else REASON_ACCESS_DENIED
+            )
+        else:
+            raise
+
+    entry["ExpiresAt"] = time.monotonic() + HEAD_CACHE_SECONDS
+    with _head_cache_lock:
+        _head_cache[(asset["Bucket"], asset["Key"])] = entry
+    return entry
+
+
+def check(s3, asset):
+    """Fills the Size and ETag of an asset and returns why it is invalid, if it is"""
+    if "Size" not in asset:
+        entry = _head(s3, asset)
+        if "Reason" in entry:
+            return entry["Reason"]
+        asset["Size"] = entry["Size"]
+        asset["ETag"] = entry["ETag"]
+    if asset["Size"] > MAX_ASSET_BYTES:
+        return REASON_TOO_LARGE
+    return None
+
+
+class Validator:
+    """
+    Filters a stream of assets down to the ones ADX can import.
+
+    Invalid assets are collected in ``rejected`` with their reason; with
+    VALIDATION_REJECT the caller fails the manifest once the stream is consumed, with
+    VALIDATION_QUARANTINE they are left out and recorded next to the nested manifest.
+    """
+
+    def __init__(self, s3, mode, max_workers=1):
+        self.s3 = s3
+        self.mode = mode
+        self.max_workers = max(1, max_workers)
+        self.rejected = []
+
+    def iter_valid_assets(self, asset_stream):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for batch in assets.iter_chunks(asset_stream, VALIDATION_BATCH_SIZE):
+                reasons = executor.map(lambda asset: check(self.s3, asset), batch)
+                for asset, reason in zip(batch, reasons):
+                    if reason is None:
+                        yield asset
+                    else:
+                        self.rejected.append(
+                            {"Bucket": asset["Bucket"], "Key": asset["Key"], "Reason": reason}
+                        )
+
+    def summary(self, limit=10):
+        described = ", ".join(
+            f"s3://{asset['Bucket']}/{asset['Key']} ({asset['Reason']})"
+            for asset in self.rejected[:limit]
+        )
+        if len(self.rejected) > limit:
+            described += f" and {len(self.rejected) - limit} more"
+        return f"{len(self.rejected)} assets cannot be imported: {described}"
+
+    def write_quarantine(self, bucket, index_key):
+        """Records the quarantined assets of a publish next to its nested manifest"""
+        data = json.dumps(self.rejected).encode("utf-8")
+        key = quarantine_key(index_key)
+        self.s3.put_object(Body=data, Bucket=bucket, Key=key)
+        logging.warning(f"Quarantined {self.summary()}; see s3://{bucket}/{key}")
+        return key
@@ -24,18 +24,15 @@ import os
 import uuid
 from datetime import datetime
 
-import boto3
 import urllib3
 
+from adx_coordinator import runtime, telemetry
+
+runtime.configure_logging("DEBUG")
+
 
 def lambda_handler(event, context):
     try:
-        global log_level
-        log_level = str(os.environ.get("LOG_LEVEL")).upper()
-        if log_level not in ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]:
-            log_level = "DEBUG"
-        logging.getLogger().setLevel(log_level)
-
         logging.debug("Helper received event:{}".format(event))
 
         http = urllib3.PoolManager()
@@ -61,8 +58,8 @@ def lambda_handler(event, context):
                 "Data": metricdata,
             }
             logging.info("Sending metric data:{}".format(solutionData))
-            resp = sendMetric(solutionData)
-            logging.debug("Send metric response:{}".format(resp))
+            # Sent while the response below is built and sent
+            telemetry.send_in_background(solutionData)
 
         response = {}
         responseData = {}
@@ -87,16 +84,6 @@ def lambda_handler(event, context):
     except Exception as e:
         logging.error(e)
         raise e
+    finally:
+        telemetry.flush()
     return responseData
-
-
-def sendMetric(solutionData):
-    metricURL = "https://metrics.awssolutionsbuilder.com/generic"
-    http = urllib3.PoolManager()
-    encoded_data = json.dumps(solutionData).encode("utf-8")
-    return http.request(
-        "POST",
-        metricURL,
-        body=encoded_data,
-        headers={"Content-Type": "application/json"},
-    )
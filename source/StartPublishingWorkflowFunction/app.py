@@ -18,152 +18,427 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 ##############################################################################
 
-import calendar
+import hashlib
 import json
 import logging
 import os
 import sys
-import time
 import traceback
+import urllib.parse
 from datetime import datetime
 
-import boto3
+from botocore.exceptions import ClientError
 
+from adx_coordinator import (
+    admission,
+    assets,
+    checkpoint,
+    delta,
+    emf,
+    jobs,
+    manifest,
+    progress,
+    runtime,
+    validation,
+)
 
-def lambda_handler(event, context):
+EXECUTION_NAME_PREFIX = "Execution-ADX-PublishingWorkflow-SFN@"
+
+
+class InvalidManifest(Exception):
+    """Raised for a manifest that cannot be published"""
+
+
+def manifest_records(event):
+    """
+    Returns the bucket, key and identity of every manifest in an S3 notification.
+
+    The identity includes the object's version and event sequencer, so a redelivered
+    event maps to the same execution while a re-upload of the same key does not.
+    """
+    records = []
+    for record in event["Records"]:
+        s3_object = record["s3"]["object"]
+        bucket = record["s3"]["bucket"]["name"]
+        key = urllib.parse.unquote_plus(s3_object["key"])
+        version = ":".join(
+            str(s3_object.get(field, "")) for field in ("versionId", "sequencer", "eTag")
+        )
+        records.append(
+            {"Bucket": bucket, "Key": key, "Identity": f"s3://{bucket}/{key}#{version}"}
+        )
+    return records
+
+
+def queued_manifest_records(event):
     """
-    This function triggers from an S3 event source when a manifest file
-    for a new product update is put in the ManifestBucket
+    Returns the manifest records carried by the S3 notifications in an SQS batch.
+
+    Each record also holds the id and receipt handle of the message it came in.
     """
+    records = []
+    for message in event["Records"]:
+        body = json.loads(message["body"])
+        if "Records" not in body:
+            # e.g. the s3:TestEvent sent when the notification is configured
+            logging.info(f"Ignoring message without S3 records: {body.get('Event')}")
+            continue
+        for record in manifest_records(body):
+            record["MessageId"] = message["messageId"]
+            record["ReceiptHandle"] = message["receiptHandle"]
+            records.append(record)
+    return records
+
+
+def admit_groups(sfn, state_machine_arn, groups):
+    """Splits groups into the ones started now and the ones deferred by the job budget"""
+    budget = int(
+        os.environ.get("IN_FLIGHT_JOB_BUDGET", str(admission.DEFAULT_IN_FLIGHT_JOB_BUDGET))
+    )
+    per_execution = admission.jobs_per_execution(
+        int(os.environ.get("REVISION_CONCURRENCY", "1")),
+        int(os.environ.get("MAX_CONCURRENT_JOBS", str(jobs.MAX_CONCURRENT_JOBS))),
+    )
+    running = admission.running_executions(sfn, state_machine_arn)
+    slots = admission.admission_slots(running, budget, per_execution)
+    logging.info(
+        f"{running=} executions, {budget=} in-flight jobs, {per_execution=}: admitting "
+        f"{min(slots, len(groups))} of {len(groups)} manifest groups"
+    )
+    return groups[:slots], groups[slots:]
+
+
+def defer_messages(sqs, queue_url, records):
+    """Makes deferred messages visible again after ADMISSION_RETRY_SECONDS"""
+    receipt_handles = {record["MessageId"]: record["ReceiptHandle"] for record in records}
+    for receipt_handle in receipt_handles.values():
+        sqs.change_message_visibility(
+            QueueUrl=queue_url,
+            ReceiptHandle=receipt_handle,
+            VisibilityTimeout=admission.ADMISSION_RETRY_SECONDS,
+        )
 
+
+def execution_name(records):
+    """Builds a deterministic execution name from the manifests an execution publishes"""
+    identities = "\n".join(record["Identity"] for record in records)
+    digest = hashlib.sha256(identities.encode("utf-8")).hexdigest()
+    return f"{EXECUTION_NAME_PREFIX}{digest[:40]}"
+
+
+def execution_exists(sfn, state_machine_arn, name):
+    execution_arn = f"{state_machine_arn.replace(':stateMachine:', ':execution:')}:{name}"
     try:
-        global log_level
-        log_level = str(os.environ.get("LOG_LEVEL")).upper()
-        valid_log_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
-        if log_level not in valid_log_levels:
-            log_level = "ERROR"
+        sfn.describe_execution(executionArn=execution_arn)
+    except ClientError as error:
+        if error.response["Error"]["Code"] != "ExecutionDoesNotExist":
+            raise
+        return False
+    return True
 
-        logging.getLogger().setLevel(log_level)
 
-        STATE_MACHINE_ARN = os.environ["STATE_MACHINE_ARN"]
-        assets_per_revision = int(os.environ.get("ASSETS_PER_REVISION", "10000"))
-        logging.debug(f"{event=}")
-        bucket = event["Records"][0]["s3"]["bucket"]["name"]
-        key = event["Records"][0]["s3"]["object"]["key"]
-
-        logging.info(f"validating the manifest file from s3://{bucket}/{key}")
-
-        s3 = boto3.client("s3")
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        manifest_dict_flat = json.loads(obj["Body"].read())
-
-        product_id = manifest_dict_flat["product_id"]
-        dataset_id = manifest_dict_flat["dataset_id"]
-        intial_asset_list = manifest_dict_flat["asset_list"]
-        asset_list = []
-
-        try:
-            for entry in intial_asset_list:
-                asset_bucket = entry["Bucket"]
-                prefix = entry["Key"]
-                if prefix.endswith("/"):
-                    paginator = s3.get_paginator("list_objects_v2")
-                    response_iterator = paginator.paginate(
-                        Bucket=asset_bucket,
-                        Prefix=prefix,
-                        PaginationConfig={"PageSize": 1000},
-                    )
-                    for page in response_iterator:
-                        logging.info(f"Finding keys in prefix={prefix} and page={page}")
-                        if "Contents" not in page:
-                            raise ValueError(
-                                "Failed - no resources found in the prefix"
-                            )
-                        files = page["Contents"]
-                        for file in files:
-                            if file["Size"] != 0:
-                                logging.info(file["Key"])
-                                asset_list.append(
-                                    {"Bucket": asset_bucket, "Key": file["Key"]}
-                                )
-                                logging.info(f"Adding key to manifest: {file['Key']}")
-                else:
-                    asset_list.append({"Bucket": asset_bucket, "Key": prefix})
-        except Exception as error:
-            logging.error(f"lambda_handler error: {error}")
-            logging.error(f"lambda_handler trace: {traceback.format_exc()}")
-            result = {"Error": f"{error=}"}
-            return json.dumps(result)
-
-        # Update ends
-        num_assets = len(asset_list)
-
-        if not product_id or not dataset_id or not asset_list:
-            error_message = (
-                "Invalid manifest file; missing required fields from manifest file: product_id, "
-                "dataset_id, asset_list "
-            )
-            logging.error(error_message)
-            sys.exit(error_message)
+def read_manifest(s3, bucket, key):
+    logging.info(f"validating the manifest file from s3://{bucket}/{key}")
+
+    obj = s3.get_object(Bucket=bucket, Key=key)
+    try:
+        manifest_dict_flat = manifest.read_json(obj)
+    except ValueError as error:
+        logging.error(f"Manifest s3://{bucket}/{key} is not valid JSON: {error}")
+        raise InvalidManifest("Invalid manifest file; not valid JSON")
+    if not isinstance(manifest_dict_flat, dict):
+        logging.error(f"Manifest s3://{bucket}/{key} is not a JSON object")
+        raise InvalidManifest("Invalid manifest file; not a JSON object")
+
+    product_id = manifest_dict_flat.get("product_id")
+    dataset_id = manifest_dict_flat.get("dataset_id")
+    intial_asset_list = manifest_dict_flat.get("asset_list")
 
-        logging.debug(
-            f"{bucket=}\n{key=}\n{product_id=}\n{dataset_id=}\n{num_assets=}\n{assets_per_revision=}"
+    if not product_id or not dataset_id or not intial_asset_list:
+        error_message = (
+            "Invalid manifest file; missing required fields from manifest file: product_id, "
+            "dataset_id, asset_list "
         )
+        logging.error(f"{error_message} in s3://{bucket}/{key}")
+        raise InvalidManifest(error_message)
+    return manifest_dict_flat
+
+
+def group_manifests(manifests, coalesce):
+    """
+    Groups (record, manifest) pairs into publishing units.
+
+    Without ``coalesce`` every manifest is published on its own. With it, manifests that
+    target the same product and dataset are merged, in upload order, into one unit.
+    """
+    if not coalesce:
+        return [[pair] for pair in manifests]
+    groups = {}
+    for record, manifest_dict in manifests:
+        target = (manifest_dict["product_id"], manifest_dict["dataset_id"])
+        groups.setdefault(target, []).append((record, manifest_dict))
+    return list(groups.values())
+
+
+def nested_manifest_key(records, name):
+    key = records[0]["Key"].split(".")[0]
+    if len(records) == 1:
+        return key + ".manifest"
+    # A coalesced group gets its own nested manifest next to its first manifest
+    return f"{key}-coalesced-{name[len(EXECUTION_NAME_PREFIX):][:12]}.manifest"
+
+
+def iter_unique_assets(asset_stream):
+    """Drops assets referenced again by a later manifest of a coalesced group"""
+    seen = set()
+    for asset in asset_stream:
+        asset_key = (asset["Bucket"], asset["Key"])
+        if asset_key not in seen:
+            seen.add(asset_key)
+            yield asset
 
-        asset_list_nested = []
 
+def start_publishing(s3, sfn, state_machine_arn, group, settings):
+    """Expands one group of manifests into a nested manifest and starts its execution"""
+    records = [record for record, _ in group]
+    manifest_dicts = [manifest_dict for _, manifest_dict in group]
+    bucket = records[0]["Bucket"]
+    product_id = manifest_dicts[0]["product_id"]
+    dataset_id = manifest_dicts[0]["dataset_id"]
+    intial_asset_list = [
+        entry for manifest_dict in manifest_dicts for entry in manifest_dict["asset_list"]
+    ]
+    comment = next(
+        (m["comment"] for m in manifest_dicts if m.get("comment")), None
+    )
+    stage = emf.Stage("StartPublishing", product_id, dataset_id)
+
+    EXECUTION_NAME = execution_name(records)
+    if execution_exists(sfn, state_machine_arn, EXECUTION_NAME):
+        logging.info(f"{EXECUTION_NAME=} was already started for this upload, skipping")
+        return {"ExecutionName": EXECUTION_NAME, "Message": "State machine already started"}
+
+    nested_manifest_file_key = nested_manifest_key(records, EXECUTION_NAME)
+    if len(records) > 1:
         logging.info(
-            "chunk into lists of 10k assets to account for ADX limit of 10k assets per revision"
+            f"Coalescing {len(records)} manifests for {dataset_id=} into {nested_manifest_file_key}"
+        )
+    # A new upload always publishes new revisions; only a retried execution resumes from
+    # the checkpoints and finalized markers of the manifest key
+    checkpoint.clear(s3, bucket, nested_manifest_file_key)
+    writer = manifest.ManifestWriter(s3, bucket, nested_manifest_file_key)
+
+    logging.info(
+        "chunk into lists of 10k assets to account for ADX limit of 10k assets per revision "
+        "and into lists of 100 assets to account for ADX limit of 100 assets per job"
+    )
+    asset_stream = assets.iter_assets(
+        s3,
+        intial_asset_list,
+        max_workers=settings["listing_concurrency"],
+        fan_out=settings["listing_fan_out"],
+    )
+    if len(records) > 1:
+        asset_stream = iter_unique_assets(asset_stream)
+    validator = None
+    if settings["asset_validation"] != validation.VALIDATION_NONE:
+        validator = validation.Validator(
+            s3, settings["asset_validation"], max_workers=settings["listing_concurrency"]
+        )
+        asset_stream = validator.iter_valid_assets(asset_stream)
+    if settings["delta_publishing"]:
+        published = delta.load_published_assets(s3, bucket, dataset_id)
+        asset_stream = delta.iter_changed_assets(
+            s3, asset_stream, published, max_workers=settings["listing_concurrency"]
         )
-        asset_lists_10k = [
-            asset_list[i: i + assets_per_revision]
-            for i in range(0, len(asset_list), assets_per_revision)
-        ]
-
-        for revision_index, assets_10k in enumerate(asset_lists_10k):
-            logging.info(
-                "chunk into lists of 100 assets to account for ADX limit of 100 assets per job"
+    revision_stream = assets.iter_revisions(
+        asset_stream,
+        settings["assets_per_revision"],
+        packing=settings["job_packing"],
+        s3=s3,
+        max_workers=settings["listing_concurrency"],
+    )
+    for jobs in revision_stream:
+        revision_index = writer.add_revision(jobs)
+        if settings["delta_publishing"]:
+            delta.write_revision_assets(
+                s3, bucket, nested_manifest_file_key, revision_index, jobs
             )
-            asset_lists_100 = [
-                assets_10k[i: i + 100] for i in range(0, len(assets_10k), 100)
-            ]
-            asset_list_nested.append(asset_lists_100)
+        logging.info(
+            f"Wrote {len(jobs)} jobs for {revision_index=} as {writer.manifest_format} "
+            f"under {manifest.shard_prefix(nested_manifest_file_key)}"
+        )
 
-        nested_manifest_file_key = key.split(".")[0] + ".manifest"
+    num_assets = writer.asset_count
 
-        manifest_dict = {
-            "product_id": product_id,
-            "dataset_id": dataset_id,
-            "asset_list_nested": asset_list_nested,
-        }
+    if validator and validator.rejected:
+        stage.put("InvalidAssetCount", len(validator.rejected))
+        if validator.mode == validation.VALIDATION_REJECT:
+            error_message = f"Invalid manifest file; {validator.summary()}"
+            logging.error(error_message)
+            raise InvalidManifest(error_message)
+        validator.write_quarantine(bucket, nested_manifest_file_key)
 
-        s3 = boto3.client("s3")
-        data = json.dumps(manifest_dict).encode("utf-8")
-        response = s3.put_object(Body=data, Bucket=bucket, Key=nested_manifest_file_key)
+    if not num_assets and settings["delta_publishing"]:
+        logging.info(f"No new or changed assets to publish for {dataset_id=}")
+        return {"ExecutionName": EXECUTION_NAME, "Message": "No new or changed assets to publish"}
 
-        EXECUTION_NAME = f"Execution-ADX-PublishingWorkflow-SFN@{str(calendar.timegm(time.gmtime()))}"
-        INPUT = json.dumps({"Bucket": bucket, "Key": nested_manifest_file_key})
-        sfn = boto3.client("stepfunctions")
-        logging.debug(f"{EXECUTION_NAME=}")
-        sfn_response = sfn.start_execution(
-            stateMachineArn=STATE_MACHINE_ARN, name=EXECUTION_NAME, input=INPUT
-        )
-        logging.debug(f"{INPUT=}")
-        logging.debug(f"{sfn_response=}")
+    if not num_assets:
+        error_message = "Invalid manifest file; asset_list did not resolve to any assets"
+        logging.error(error_message)
+        raise InvalidManifest(error_message)
+
+    logging.debug(
+        f"{bucket=}\n{nested_manifest_file_key=}\n{product_id=}\n{dataset_id=}\n{num_assets=}\n"
+        f"assets_per_revision={settings['assets_per_revision']}"
+    )
 
-        metrics = {
-            "Version": os.getenv("Version"),
-            "TimeStamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f"),
+    writer.close(product_id, dataset_id, comment=comment)
+
+    # The execution starts with the plan of its first segment, so the revision map
+    # input is not prepared from the index that was just written
+    plan = progress.segment_plan(
+        EXECUTION_NAME,
+        [revision["job_asset_counts"] for revision in writer.revisions],
+        0,
+        settings["revisions_per_execution"],
+    )
+    progress.start_segment(
+        s3,
+        bucket,
+        nested_manifest_file_key,
+        EXECUTION_NAME,
+        product_id,
+        dataset_id,
+        plan,
+    )
+    INPUT = json.dumps(
+        {
             "Bucket": bucket,
             "Key": nested_manifest_file_key,
-            "StateMachineARN": STATE_MACHINE_ARN,
-            "ExecutionName": EXECUTION_NAME,
+            "ProductId": product_id,
+            "DatasetId": dataset_id,
+            "Comment": comment,
+            **plan,
+        }
+    )
+    logging.debug(f"{EXECUTION_NAME=}")
+    try:
+        sfn_response = sfn.start_execution(
+            stateMachineArn=state_machine_arn, name=EXECUTION_NAME, input=INPUT
+        )
+    except ClientError as error:
+        if error.response["Error"]["Code"] != "ExecutionAlreadyExists":
+            raise
+        logging.info(f"{EXECUTION_NAME=} was started by a concurrent delivery of this upload")
+        return {"ExecutionName": EXECUTION_NAME, "Message": "State machine already started"}
+    logging.debug(runtime.lazy(lambda: f"{INPUT=}"))
+    logging.debug(runtime.lazy(lambda: f"{sfn_response=}"))
+
+    metrics = {
+        "Version": os.getenv("Version"),
+        "TimeStamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f"),
+        "Bucket": bucket,
+        "Key": nested_manifest_file_key,
+        "ManifestCount": len(records),
+        "StateMachineARN": state_machine_arn,
+        "ExecutionName": EXECUTION_NAME,
+        "PublishId": EXECUTION_NAME,
+    }
+    logging.info(f"Metrics:{metrics}")
+
+    stage.set_property("PublishId", EXECUTION_NAME)
+    stage.put("ManifestCount", len(records))
+    stage.put("AssetCount", num_assets)
+    stage.put("RevisionCount", len(writer.revisions))
+    stage.emit()
+    return {"ExecutionName": EXECUTION_NAME, "Message": "State machine started"}
+
+
+def lambda_handler(event, context):
+    """
+    This function triggers from an S3 event source when manifest files
+    for a new product update are put in the ManifestBucket, or from the
+    ingestion queue those events are buffered in
+    """
+
+    queued = False
+    try:
+        STATE_MACHINE_ARN = os.environ["STATE_MACHINE_ARN"]
+        settings = {
+            "assets_per_revision": int(os.environ.get("ASSETS_PER_REVISION", "10000")),
+            "listing_concurrency": int(os.environ.get("LISTING_CONCURRENCY", "8")),
+            "listing_fan_out": os.environ.get("LISTING_FAN_OUT", "No") == "Yes",
+            "job_packing": os.environ.get("JOB_PACKING", assets.PACKING_SEQUENTIAL),
+            "delta_publishing": os.environ.get("DELTA_PUBLISHING", "No") == "Yes",
+            "revisions_per_execution": progress.revisions_per_execution(),
+            "asset_validation": os.environ.get(
+                "ASSET_VALIDATION", validation.VALIDATION_NONE
+            ),
         }
-        logging.info(f"Metrics:{metrics}")
+        coalesce_manifests = os.environ.get("COALESCE_MANIFESTS", "No") == "Yes"
+        logging.debug(runtime.lazy(lambda: f"{event=}"))
+
+        s3 = runtime.client("s3")
+        sfn = runtime.client("stepfunctions")
+
+        queued = bool(event["Records"]) and event["Records"][0].get("eventSource") == "aws:sqs"
+        records = queued_manifest_records(event) if queued else manifest_records(event)
+
+        # Every manifest of the batch is handled before the invocation fails for an invalid
+        # one; execution names are idempotent so a retried event does not publish twice
+        invalid_manifests = []
+        failed_records = []
+        manifests = []
+        for record in records:
+            try:
+                manifests.append((record, read_manifest(s3, record["Bucket"], record["Key"])))
+            except InvalidManifest as error:
+                invalid_manifests.append(f"s3://{record['Bucket']}/{record['Key']}: {error}")
+
+        groups = group_manifests(manifests, coalesce_manifests)
+        if queued:
+            groups, deferred = admit_groups(sfn, STATE_MACHINE_ARN, groups)
+            deferred_records = [record for group in deferred for record, _ in group]
+            defer_messages(runtime.client("sqs"), os.environ["QUEUE_URL"], deferred_records)
+            failed_records.extend(deferred_records)
+
+        results = []
+        for group in groups:
+            try:
+                results.append(start_publishing(s3, sfn, STATE_MACHINE_ARN, group, settings))
+            except InvalidManifest as error:
+                invalid_manifests.extend(
+                    f"s3://{record['Bucket']}/{record['Key']}: {error}" for record, _ in group
+                )
+            except Exception as error:
+                logging.error(f"lambda_handler error: {error}")
+                logging.error(f"lambda_handler trace: {traceback.format_exc()}")
+                results.append({"Error": f"{error=}"})
+                failed_records.extend(record for record, _ in group)
 
     except Exception as error:
         logging.error(f"lambda_handler error: {error}")
         logging.error(f"lambda_handler trace: {traceback.format_exc()}")
+        if queued:
+            # Fails the whole batch so every message is delivered again
+            raise
         result = {"Error": f"{error=}"}
         return json.dumps(result)
-    return {"Message": "State machine started"}
+
+    if queued:
+        # Messages of deferred or failed manifests return to the queue. Invalid manifests
+        # would fail the same way on every delivery, so their messages are dropped
+        for invalid_manifest in invalid_manifests:
+            logging.error(f"Dropping {invalid_manifest}")
+        message_ids = dict.fromkeys(record["MessageId"] for record in failed_records)
+        return {
+            "batchItemFailures": [{"itemIdentifier": message_id} for message_id in message_ids]
+        }
+
+    if invalid_manifests:
+        sys.exit("; ".join(invalid_manifests))
+
+    if len(results) == 1:
+        return json.dumps(results[0]) if "Error" in results[0] else results[0]
+    return {"Message": f"Processed {len(manifests)} manifests", "Results": results}